@@ -2,6 +2,8 @@ import os
 import csv
 import json
 import psycopg2
+from psycopg2 import extras
+from itertools import islice
 from datetime import datetime
 from flask import Flask, request, jsonify
 from werkzeug.utils import secure_filename
@@ -19,9 +21,20 @@ DB_CONFIG = {
     'password': os.getenv('POSTGRES_PASSWORD', 'postgres')
 }
 
+# Quantidade de linhas do CSV lidas e inseridas por lote
+CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', '5000'))
+
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG)
 
+def iter_chunks(reader, size):
+    """Percorre o reader em listas de até 'size' linhas"""
+    while True:
+        chunk = list(islice(reader, size))
+        if not chunk:
+            return
+        yield chunk
+
 @app.route('/extract-csv', methods=['POST'])
 def extract_csv():
     if 'file' not in request.files:
@@ -34,6 +47,7 @@ def extract_csv():
     filename = secure_filename(file.filename)
     filepath = os.path.join(UPLOAD_FOLDER, filename)
     file.save(filepath)
+    source_id = None
 
     try:
         # Detectar colunas e ler linhas
@@ -52,43 +66,48 @@ def extract_csv():
                 }), 400
             # --- FIM DA MODIFICAÇÃO ---
 
-            rows = list(reader)
-
-        row_count = len(rows)
-        original_structure = json.dumps(columns)
-        created_at = datetime.utcnow()
-        status = 'pending'
-        source_id = None
-
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                # Inserir registro em sources
-                cur.execute(
-                    """
-                    INSERT INTO sources (filename, original_structure, created_at, row_count, status)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                    """,
-                    (filename, original_structure, created_at, row_count, status)
-                )
-                source_id = cur.fetchone()[0]
-
-                # Inserir cada linha em extraction_results
-                for idx, row in enumerate(rows, start=1):
+            original_structure = json.dumps(columns)
+            created_at = datetime.utcnow()
+            status = 'pending'
+            row_count = 0
+
+            # Uma única transação, como antes: em caso de erro nenhuma linha do source fica gravada.
+            # Os lotes só limitam a memória usada na leitura do CSV
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    # Inserir registro em sources (row_count é preenchido ao final)
                     cur.execute(
                         """
-                        INSERT INTO extraction_results (source_id, data, created_at, row_number)
-                        VALUES (%s, %s, %s, %s)
+                        INSERT INTO sources (filename, original_structure, created_at, row_count, status)
+                        VALUES (%s, %s, %s, %s, %s)
+                        RETURNING id
                         """,
-                        (source_id, json.dumps(row), created_at, idx)
+                        (filename, original_structure, created_at, row_count, status)
                     )
-
-                # Atualizar status para 'completed'
-                cur.execute(
-                    "UPDATE sources SET status = %s WHERE id = %s",
-                    ('completed', source_id)
-                )
-            conn.commit()
+                    source_id = cur.fetchone()[0]
+
+                    # Ler e inserir o CSV em lotes de tamanho fixo, sem carregar o arquivo inteiro
+                    for chunk in iter_chunks(reader, CSV_CHUNK_SIZE):
+                        extras.execute_values(
+                            cur,
+                            """
+                            INSERT INTO extraction_results (source_id, data, created_at, row_number)
+                            VALUES %s
+                            """,
+                            [
+                                (source_id, json.dumps(row), created_at, idx)
+                                for idx, row in enumerate(chunk, start=row_count + 1)
+                            ],
+                            page_size=len(chunk)
+                        )
+                        row_count += len(chunk)
+
+                    # Atualizar a quantidade de linhas e o status para 'completed'
+                    cur.execute(
+                        "UPDATE sources SET row_count = %s, status = %s WHERE id = %s",
+                        (row_count, 'completed', source_id)
+                    )
+                conn.commit()
 
     except Exception as e:
         # Em caso de erro, atualizar status para 'error' se o source_id foi criado
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testes da ingestão de CSV (/extract-csv) com uma conexão simulada: verificam que os
+lotes são inseridos em uma única transação.
+"""
+
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as csv_app
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        self.conn.statements.append(' '.join(query.split()))
+
+    def fetchone(self):
+        return (1,)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class FakeConnection:
+    """Conexão que registra commits/rollbacks como o 'with conn' do psycopg2"""
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type:
+            self.rollback()
+        return False
+
+def upload_csv(monkeypatch, fail_on_chunk=None, rows=5, chunk_size=2):
+    """Envia um CSV de 'rows' linhas; execute_values falha no lote fail_on_chunk (1, 2, ...)"""
+    connections = []
+    chunks = []
+
+    def fake_connection():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    def fake_execute_values(cur, query, values, page_size=None):
+        chunks.append(values)
+        if len(chunks) == fail_on_chunk:
+            raise RuntimeError('falha no lote')
+
+    monkeypatch.setattr(csv_app, 'get_db_connection', fake_connection)
+    monkeypatch.setattr(csv_app.extras, 'execute_values', fake_execute_values)
+    monkeypatch.setattr(csv_app, 'CSV_CHUNK_SIZE', chunk_size)
+
+    content = 'nome,telefone\n' + ''.join(f'PESSOA {i},6499999000{i}\n' for i in range(rows))
+    response = csv_app.app.test_client().post(
+        '/extract-csv',
+        data={'file': (io.BytesIO(content.encode('utf-8')), 'lista.csv')},
+        content_type='multipart/form-data'
+    )
+    return response, connections, chunks
+
+def test_all_chunks_in_one_transaction(monkeypatch):
+    """Todos os lotes e o status final são gravados com um único commit"""
+    response, connections, chunks = upload_csv(monkeypatch)
+
+    assert response.status_code == 200
+    assert response.get_json()['rows_inserted'] == 5
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert connections[0].commits == 1
+    assert connections[0].statements[-1].startswith('UPDATE sources SET row_count = %s, status = %s')
+
+def test_failure_on_second_chunk_rolls_back(monkeypatch):
+    """Uma falha no segundo lote desfaz o source e o primeiro lote (nada é confirmado)"""
+    response, connections, chunks = upload_csv(monkeypatch, fail_on_chunk=2)
+
+    assert response.status_code == 500
+    assert len(chunks) == 2
+    assert connections[0].commits == 0
+    assert connections[0].rollbacks == 1
@@ -1,73 +1,136 @@
+import io
 import os
+import csv
+import json
+import uuid
+import base64
+import functools
+import threading
+import zipfile
 import tempfile
-import fitz  # PyMuPDF - para verificar páginas do PDF
-from flask import Flask, request, jsonify
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from flask import Flask, Blueprint, Request, Response, request, jsonify, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
-from extractor import extract_devedores_from_pdf
-from database import insert_extraction_data, create_source, update_source_items_count, update_source_processed_count, update_source_status, get_db_connection
+from database import create_source, update_source_status, db_connection, create_extraction_job, get_extraction_job, source_upload_exists, get_devedor
+from metrics import stage, collect_timings, rounded_timings, render_metrics
 import logging
 
+# PyMuPDF e pandas (extractor, pdf_document, jobs) são importados apenas no caminho
+# de extração, para que o processo suba rápido e os endpoints de leitura não os carreguem
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)  # Permite requests do frontend
+bp = Blueprint('pdf_extractor', __name__)
 
 # Configurações
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+MAX_CONTENT_LENGTH = 50 * 1024 * 1024
 ALLOWED_EXTENSIONS = {'pdf'}
 MAX_PDF_PAGES = int(os.getenv('MAX_PDF_PAGES', '40'))
 UPLOAD_FOLDER = tempfile.gettempdir()
-import tempfile
-import fitz  # PyMuPDF - para verificar páginas do PDF
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from werkzeug.exceptions import RequestEntityTooLarge
-from extractor import extract_devedores_from_pdf
-from database import insert_extraction_data, create_source, update_source_items_count, update_source_processed_count, update_source_status, get_db_connection
-import logging
+# Uploads até este tamanho são processados direto da memória, sem arquivo temporário
+PDF_IN_MEMORY_MAX_BYTES = int(os.getenv('PDF_IN_MEMORY_MAX_BYTES', str(10 * 1024 * 1024)))
+ASYNC_UPLOADS = os.getenv('ASYNC_UPLOADS', 'false').lower() in ('1', 'true', 'sim')
+ON_CONFLICT_MODES = ('nothing', 'update', 'merge')
+# Upload em lote (/upload/batch): arquivos por lote e tamanho descompactado máximo de um ZIP.
+# 'merge' não é aceito: cada arquivo do lote marcaria como removidos os CCPs dos outros
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '20'))
+BATCH_MAX_UNCOMPRESSED_BYTES = int(os.getenv('BATCH_MAX_UNCOMPRESSED_BYTES', str(200 * 1024 * 1024)))
+BATCH_ON_CONFLICT_MODES = ('nothing', 'update')
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', '100'))
+RESULTS_MAX_PAGE_SIZE = int(os.getenv('RESULTS_MAX_PAGE_SIZE', '1000'))
+# Busca aproximada por nome: limite padrão/máximo de resultados e similaridade mínima (0 a 1)
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '100'))
+SEARCH_MIN_SIMILARITY = float(os.getenv('SEARCH_MIN_SIMILARITY', '0.5'))
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '2000'))
+# Extrações síncronas simultâneas por processo e tempo máximo (s) de espera por uma vaga.
+# As páginas são lidas no pool de processos da extração (PARALLEL_EXTRACTION em extractor.py);
+# sem o pool, o find_tables() das extrações simultâneas é serializado por find_tables_lock
+SYNC_EXTRACTION_CONCURRENCY = int(os.getenv('SYNC_EXTRACTION_CONCURRENCY', '2'))
+SYNC_EXTRACTION_WAIT = float(os.getenv('SYNC_EXTRACTION_WAIT', '120'))
+sync_extraction_slots = threading.BoundedSemaphore(SYNC_EXTRACTION_CONCURRENCY)
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+class UploadRequest(Request):
+    """
+    Request do serviço: cada arquivo do multipart fica em memória até PDF_IN_MEMORY_MAX_BYTES.
+    O padrão do Werkzeug grava em um arquivo temporário, antes da view, todo upload acima
+    de 500 KB; acima do limite, o arquivo continua indo para o disco (SpooledTemporaryFile).
+    """
 
-app = Flask(__name__)
-CORS(app)  # Permite requests do frontend
-
-# Configurações
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
-ALLOWED_EXTENSIONS = {'pdf'}
-MAX_PDF_PAGES = int(os.getenv('MAX_PDF_PAGES', '40'))
-UPLOAD_FOLDER = tempfile.gettempdir()
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=PDF_IN_MEMORY_MAX_BYTES, mode='rb+', dir=UPLOAD_FOLDER)
 
 def allowed_file(filename):
     """Verifica se o arquivo tem extensão permitida"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def check_pdf_page_limit(pdf_path):
+def check_pdf_page_limit(pdf):
     """
-    Verifica se o PDF está dentro do limite de páginas permitido.
+    Verifica se o PDF (PdfDocument já aberto) está dentro do limite de páginas permitido.
+    A contagem vem da árvore de páginas; nenhuma página é carregada.
     Retorna (is_valid, page_count, error_message)
     """
+    from pdf_document import PdfPageLimitError
+
     try:
-        doc = fitz.open(pdf_path)
-        page_count = len(doc)
-        doc.close()
-        
-        if page_count > MAX_PDF_PAGES:
-            return False, page_count, f"PDF tem {page_count} páginas. Limite máximo: {MAX_PDF_PAGES} páginas"
-        
+        page_count = pdf.check_page_limit(MAX_PDF_PAGES)
         return True, page_count, None
-        
+    except PdfPageLimitError as e:
+        return False, e.page_count, str(e)
+
+def open_uploaded_pdf(file, filename):
+    """
+    Abre o PDF enviado uma única vez; o mesmo documento segue para validação, hash e extração.
+    Uploads pequenos são abertos da memória; os maiores que PDF_IN_MEMORY_MAX_BYTES vão para
+    um arquivo temporário com nome único.
+    Retorna (pdf, None) ou (None, resposta de erro).
+    """
+    from pdf_document import PdfDocument
+
+    try:
+        with stage('abertura_pdf'):
+            pdf = PdfDocument.from_upload(
+                file, filename=filename, max_in_memory=PDF_IN_MEMORY_MAX_BYTES, temp_dir=UPLOAD_FOLDER
+            )
+        return pdf, None
     except Exception as e:
-        return False, 0, f"Erro ao verificar páginas do PDF: {str(e)}"
+        logger.warning(f"PDF rejeitado: {str(e)}")
+        return None, (jsonify({
+            'status': 'error',
+            'message': f"Erro ao verificar páginas do PDF: {str(e)}",
+            'page_count': 0,
+            'max_pages_allowed': MAX_PDF_PAGES
+        }), 400)
+
+def find_already_processed_upload(file_hash, filename):
+    """
+    Se o upload é uma atualização (sourceId) com onConflict='nothing' e o mesmo arquivo
+    já foi aplicado a esse source, retorna a resposta "nenhum registro novo" sem reprocessar.
+    """
+    from extractor import EXTRACTOR_VERSION
+    from jobs import already_processed_payload
+
+    source_id_param = request.form.get('sourceId')
+    if not source_id_param or get_on_conflict_mode() != 'nothing':
+        return None
+
+    source_id = int(source_id_param)
+    with stage('verificacao_reenvio'):
+        already_processed = source_upload_exists(source_id, file_hash, EXTRACTOR_VERSION)
+    if not already_processed:
+        return None
 
-@app.route('/', methods=['GET'])
+    logger.info(f"Arquivo {filename} ({file_hash[:12]}) já processado no source {source_id}")
+    return jsonify(already_processed_payload(source_id, filename, max_pages=MAX_PDF_PAGES)), 200
+
+@bp.route('/', methods=['GET'])
 def index():
     """Endpoint principal"""
     return jsonify({
@@ -81,14 +144,27 @@ def index():
         },
         'endpoints': {
             'upload': '/upload',
+            'upload_batch': '/upload/batch',
+            'jobs': '/jobs/<job_id>',
             'health': '/health',
+            'metrics': '/metrics',
             'status': '/status',
             'sources': '/sources',
-            'extraction_results': '/extraction_results'
+            'extraction_results': '/extraction_results',
+            'search': '/extraction_results/search?q=',
+            'devedores': '/devedores/<ccp>',
+            'layout_templates': '/layout_templates',
+            'export': '/sources/<source_id>/extraction_results/export'
         }
     })
 
-@app.route('/health', methods=['GET'])
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato do Prometheus (tempos por etapa, páginas, registros, espera do pool)"""
+    content, content_type = render_metrics()
+    return Response(content, content_type=content_type)
+
+@bp.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de health check"""
     return jsonify({
@@ -97,9 +173,29 @@ def health_check():
         'version': '1.0.0'
     })
 
-@app.route('/upload', methods=['POST'])
+def wants_timings():
+    """Indica se a resposta deve incluir o tempo de cada etapa (campo/parâmetro 'timings')"""
+    value = request.form.get('timings', request.args.get('timings', 'false'))
+    return str(value).lower() in ('1', 'true', 'sim')
+
+def with_stage_timings(view):
+    """
+    Coleta os tempos por etapa da requisição em g.stage_timings e registra a etapa 'total'.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with collect_timings() as timings:
+            g.stage_timings = timings
+            with stage('total'):
+                return view(*args, **kwargs)
+    return wrapper
+
+@bp.route('/upload', methods=['POST'])
+@with_stage_timings
 def upload_pdf():
     """Endpoint para upload e processamento de PDF"""
+    from jobs import load_or_extract_devedores, persist_extraction_results
+
     try:
         # Verificar se foi enviado um arquivo
         if 'file' not in request.files:
@@ -124,17 +220,44 @@ def upload_pdf():
                 'message': 'Apenas arquivos PDF são permitidos'
             }), 400
 
-        # Salvar arquivo temporariamente
         filename = secure_filename(file.filename)
-        temp_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(temp_path)
 
-        logger.info(f"Arquivo PDF salvo temporariamente: {temp_path}")
+        if get_on_conflict_mode() not in ON_CONFLICT_MODES:
+            return jsonify({
+                'status': 'error',
+                'message': f"onConflict inválido. Valores aceitos: {', '.join(ON_CONFLICT_MODES)}"
+            }), 400
+
+        error_response = check_extraction_engine()
+        if error_response:
+            return error_response
+
+        if is_async_request():
+            return enqueue_pdf_upload(file, filename)
 
+        # Limita as extrações síncronas simultâneas por processo, para que as demais
+        # threads do worker continuem livres para os endpoints de leitura
+        if not sync_extraction_slots.acquire(timeout=SYNC_EXTRACTION_WAIT):
+            logger.warning("Upload recusado: limite de extrações simultâneas atingido")
+            return jsonify({
+                'status': 'error',
+                'message': 'Servidor ocupado processando outros PDFs. Tente novamente em instantes ou envie com async=true.'
+            }), 503
+
+        pdf = None
         try:
+            pdf, error_response = open_uploaded_pdf(file, filename)
+            if error_response:
+                return error_response
+
+            file_hash = pdf.sha256
+            already_processed = find_already_processed_upload(file_hash, filename)
+            if already_processed:
+                return already_processed
+
             # Verificar limite de páginas do PDF
             logger.info("Verificando limite de páginas do PDF...")
-            is_valid, page_count, error_message = check_pdf_page_limit(temp_path)
+            is_valid, page_count, error_message = check_pdf_page_limit(pdf)
             
             if not is_valid:
                 logger.warning(f"PDF rejeitado: {error_message}")
@@ -149,13 +272,18 @@ def upload_pdf():
 
             # Extrair dados do PDF
             logger.info("Iniciando extração de dados do PDF...")
-            devedores_data = extract_devedores_from_pdf(temp_path)
+            extraction_stats = {}
+            devedores_data, cache_hit = load_or_extract_devedores(
+                pdf, engine=get_extraction_engine(), stats=extraction_stats
+            )
 
             if not devedores_data:
                 return jsonify({
                     'status': 'warning',
                     'message': 'Nenhum dado foi encontrado no PDF',
-                    'extracted_count': 0
+                    'extracted_count': 0,
+                    'page_count': page_count,
+                    'paginas_ignoradas': extraction_stats.get('paginas_ignoradas')
                 }), 200
 
             logger.info(f"Extração concluída. {len(devedores_data)} registros encontrados")
@@ -167,38 +295,17 @@ def upload_pdf():
                 # Atualização de source existente
                 logger.info(f"Atualizando source existente: {source_id_param}")
                 source_id = int(source_id_param)
-                
-                # Verificar se o source existe
-                conn = get_db_connection()
-                if conn:
-                    try:
-                        with conn.cursor() as cur:
-                            cur.execute("SELECT nome FROM sources WHERE id = %s", (source_id,))
-                            source_result = cur.fetchone()
-                            
-                            if not source_result:
-                                return jsonify({
-                                    'status': 'error',
-                                    'message': f'Source com ID {source_id} não encontrado'
-                                }), 404
-                            
-                            source_name = source_result[0]
-                            logger.info(f"Source encontrado: {source_name}")
-                            
-                    finally:
-                        conn.close()
-                else:
-                    return jsonify({
-                        'status': 'error',
-                        'message': 'Erro ao conectar com o banco de dados'
-                    }), 500
+                error_response = check_existing_source(source_id)
+                if error_response:
+                    return error_response
             else:
                 # Criar novo source
                 logger.info(f"Criando novo source para o arquivo: {filename}")
                 logger.info(f"📊 Parâmetros: len(devedores_data)={len(devedores_data)}")
                 
                 try:
-                    source_id = create_source(filename, len(devedores_data), 0, 'processando')
+                    # quantidade_itens é incrementada por insert_extraction_data
+                    source_id = create_source(filename, 0, 0, 'processando')
                     logger.info(f"🎯 Resultado create_source: {source_id}")
                 except Exception as e:
                     logger.error(f"❌ Exceção ao chamar create_source: {e}")
@@ -215,79 +322,14 @@ def upload_pdf():
                         'message': 'Erro ao criar registro do source'
                     }), 500
 
-            # Inserir dados no banco
-            logger.info("Inserindo dados no banco de dados...")
-            insert_result = insert_extraction_data(devedores_data, source_id)
-            
-            if not insert_result['success']:
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Erro ao inserir dados no banco'
-                }), 500
-            
-            # Atualizar campos do source
-            conn = get_db_connection()
-            if conn:
-                try:
-                    with conn.cursor() as cur:
-                        # Atualizar quantidade_itens, registros_processados e status
-                        cur.execute(
-                            """UPDATE sources 
-                               SET quantidade_itens = %s, 
-                                   registros_processados = %s, 
-                                   status = %s,
-                                   updated_at = CURRENT_TIMESTAMP
-                               WHERE id = %s""",
-                            (insert_result['total_in_source'], 
-                             insert_result['inserted_count'], 
-                             'concluido' if insert_result['success'] else 'erro', 
-                             source_id)
-                        )
-                        conn.commit()
-                finally:
-                    conn.close()
-
-            # Preparar mensagem de resposta
-            response_message = 'PDF processado com sucesso'
-            registros_inseridos = insert_result['inserted_count']
-            
-            if source_id_param:
-                if registros_inseridos > 0:
-                    response_message = f'Lista atualizada com sucesso! {registros_inseridos} novos registros adicionados.'
-                else:
-                    response_message = 'Lista processada. Nenhum registro novo foi adicionado (todos os registros já existiam).'
-            
-            # Preparar informações sobre duplicatas e registros inválidos
-            warnings = []
-            if insert_result['duplicates']:
-                warnings.append({
-                    'type': 'duplicates',
-                    'count': len(insert_result['duplicates']),
-                    'message': f'{len(insert_result["duplicates"])} registros já existiam na lista e foram ignorados',
-                    'details': insert_result['duplicates']
-                })
-            
-            if insert_result['invalid_records']:
-                warnings.append({
-                    'type': 'invalid',
-                    'count': len(insert_result['invalid_records']),
-                    'message': f'{len(insert_result["invalid_records"])} registros eram inválidos e foram ignorados',
-                    'details': insert_result['invalid_records']
-                })
-
-            return jsonify({
-                'status': 'success',
-                'message': response_message,
-                'extracted_count': len(devedores_data),
-                'registros_inseridos': registros_inseridos,
-                'total_registros_fonte': insert_result['total_in_source'],
-                'warnings': warnings,
-                'filename': filename,
-                'source_id': source_id,
-                'page_count': page_count,
-                'max_pages_allowed': MAX_PDF_PAGES,
-                'is_update': bool(source_id_param)
-            }), 200
+            payload, http_status = persist_extraction_results(
+                devedores_data, source_id, filename, page_count, MAX_PDF_PAGES, bool(source_id_param),
+                get_on_conflict_mode(), file_hash=file_hash, cache_hit=cache_hit,
+                skipped_pages=extraction_stats.get('paginas_ignoradas')
+            )
+            if http_status == 200 and wants_timings():
+                payload['timings'] = rounded_timings(g.stage_timings)
+            return jsonify(payload), http_status
 
         except Exception as e:
             logger.error(f"Erro no processamento: {str(e)}")
@@ -297,13 +339,10 @@ def upload_pdf():
             }), 500
 
         finally:
-            # Limpar arquivo temporário
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    logger.info(f"Arquivo temporário removido: {temp_path}")
-            except Exception as e:
-                logger.warning(f"Erro ao remover arquivo temporário: {str(e)}")
+            # Fecha o documento (e remove o arquivo temporário, se o upload foi para o disco)
+            if pdf:
+                pdf.close()
+            sync_extraction_slots.release()
 
     except RequestEntityTooLarge:
         return jsonify({
@@ -318,115 +357,571 @@ def upload_pdf():
             'message': f'Erro interno do servidor: {str(e)}'
         }), 500
 
-@app.route('/status', methods=['GET'])
-def check_database_status():
-    """Verifica o status da conexão com o banco de dados"""
+def is_async_request():
+    """Indica se o upload deve ser processado em segundo plano (campo/parâmetro 'async')"""
+    value = request.form.get('async', request.args.get('async'))
+    if value is None:
+        return ASYNC_UPLOADS
+    return str(value).lower() in ('1', 'true', 'sim')
+
+def get_on_conflict_mode():
+    """
+    Define o que fazer com CCPs que já existem no source: 'nothing' (ignorar, padrão),
+    'update' (atualizar os dados que mudaram) ou 'merge' (atualização incremental:
+    grava só a diferença e marca como removidos os CCPs que saíram da lista).
+    """
+    return request.form.get('onConflict', request.args.get('onConflict', 'nothing')).lower()
+
+def get_extraction_engine():
+    """
+    Motor de leitura das tabelas pedido no upload: 'auto', 'tables' (find_tables/template)
+    ou 'words' (coordenadas das palavras). None usa o padrão EXTRACTION_ENGINE do extrator.
+    """
+    value = request.form.get('engine', request.args.get('engine'))
+    return value.lower() if value else None
+
+def check_extraction_engine():
+    """
+    Valida o campo 'engine' contra os motores do extrator (extractor.EXTRACTION_ENGINES).
+    O extractor (PyMuPDF) só é importado se um motor foi pedido. Retorna a resposta de erro ou None.
+    """
+    engine = get_extraction_engine()
+    if engine is None:
+        return None
+
+    from extractor import EXTRACTION_ENGINES
+    if engine in EXTRACTION_ENGINES:
+        return None
+    return jsonify({
+        'status': 'error',
+        'message': f"engine inválido. Valores aceitos: {', '.join(EXTRACTION_ENGINES)}"
+    }), 400
+
+def check_existing_source(source_id):
+    """
+    Verifica se o source informado existe.
+    Retorna None se existir, ou a resposta de erro (json, status) caso contrário.
+    """
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({
+                'status': 'error',
+                'message': 'Erro ao conectar com o banco de dados'
+            }), 500
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT nome FROM sources WHERE id = %s", (source_id,))
+            source_result = cur.fetchone()
+
+        if not source_result:
+            return jsonify({
+                'status': 'error',
+                'message': f'Source com ID {source_id} não encontrado'
+            }), 404
+
+        logger.info(f"Source encontrado: {source_result[0]}")
+        return None
+
+def zip_batch_items(archive):
+    """
+    Lista os PDFs de um ZIP como itens de lote (filename, open_pdf), sem extrair nada:
+    cada entrada é descompactada só quando o worker abre o documento.
+    Retorna (itens, ignorados) ou lança ValueError se o ZIP descompactado for grande demais.
+    """
+    from pdf_document import PdfDocument
+
+    archive_lock = threading.Lock()
+    items = []
+    ignored = []
+    total_size = 0
+
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+            continue
+        if not allowed_file(name):
+            ignored.append({'filename': info.filename, 'motivo': 'Apenas arquivos PDF são permitidos'})
+            continue
+        if info.file_size > MAX_CONTENT_LENGTH:
+            ignored.append({'filename': info.filename, 'motivo': 'Arquivo muito grande'})
+            continue
+
+        total_size += info.file_size
+        if total_size > BATCH_MAX_UNCOMPRESSED_BYTES:
+            raise ValueError(f'ZIP muito grande: o limite descompactado é {BATCH_MAX_UNCOMPRESSED_BYTES // (1024 * 1024)}MB')
+
+        def open_pdf(info=info):
+            # O ZipFile compartilha um único arquivo: uma entrada é lida por vez
+            with archive_lock:
+                return PdfDocument.from_zip_entry(
+                    archive, info, max_in_memory=PDF_IN_MEMORY_MAX_BYTES, temp_dir=UPLOAD_FOLDER
+                )
+
+        items.append((secure_filename(name), open_pdf))
+
+    return items, ignored
+
+def upload_batch_items(files):
+    """
+    Itens de lote (filename, open_pdf) para os PDFs enviados diretamente no formulário.
+    Retorna (itens, ignorados).
+    """
+    from pdf_document import PdfDocument
+
+    items = []
+    ignored = []
+    for file in files:
+        filename = secure_filename(file.filename)
+        if not allowed_file(filename):
+            ignored.append({'filename': file.filename, 'motivo': 'Apenas arquivos PDF são permitidos'})
+            continue
+        items.append((filename, functools.partial(
+            PdfDocument.from_upload, file, filename=filename,
+            max_in_memory=PDF_IN_MEMORY_MAX_BYTES, temp_dir=UPLOAD_FOLDER
+        )))
+    return items, ignored
+
+@bp.route('/upload/batch', methods=['POST'])
+@with_stage_timings
+def upload_batch():
+    """
+    Upload em lote: vários PDFs (campo 'files') ou um único ZIP com os PDFs.
+    Os arquivos são processados ao mesmo tempo (BATCH_UPLOAD_WORKERS por lote); cada um
+    gera o seu source, ou todos vão para um único source com singleSource=true
+    (nome em sourceName). Retorna um relatório consolidado e o resultado de cada arquivo.
+    """
+    from jobs import process_batch, batch_report
+
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f and f.filename]
+    if not files:
+        return jsonify({
+            'status': 'error',
+            'message': 'Nenhum arquivo foi enviado'
+        }), 400
+
+    on_conflict = get_on_conflict_mode()
+    if on_conflict not in BATCH_ON_CONFLICT_MODES:
+        return jsonify({
+            'status': 'error',
+            'message': f"onConflict inválido para lotes. Valores aceitos: {', '.join(BATCH_ON_CONFLICT_MODES)}"
+        }), 400
+
+    error_response = check_extraction_engine()
+    if error_response:
+        return error_response
+    engine = get_extraction_engine()
+
+    single_source = request.form.get('singleSource', request.args.get('singleSource', 'false')).lower() in ('1', 'true', 'sim')
+
+    archive = None
     try:
-        conn = get_db_connection()
-        if conn:
-            conn.close()
+        if len(files) == 1 and files[0].filename.lower().endswith('.zip'):
+            batch_name = secure_filename(files[0].filename)
+            try:
+                archive = zipfile.ZipFile(files[0].stream)
+                items, ignored = zip_batch_items(archive)
+            except (zipfile.BadZipFile, ValueError) as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'ZIP inválido: {str(e)}'
+                }), 400
+        else:
+            batch_name = None
+            items, ignored = upload_batch_items(files)
+
+        if not items:
             return jsonify({
-                'status': 'ok',
-                'database': 'connected'
-            })
+                'status': 'error',
+                'message': 'Nenhum PDF encontrado no lote',
+                'arquivos_ignorados': ignored
+            }), 400
+
+        if len(items) > BATCH_MAX_FILES:
+            return jsonify({
+                'status': 'error',
+                'message': f'Lote com {len(items)} PDFs. Limite máximo: {BATCH_MAX_FILES} arquivos'
+            }), 400
+
+        # O lote ocupa uma vaga de extração síncrona; a concorrência entre os arquivos é do lote
+        if not sync_extraction_slots.acquire(timeout=SYNC_EXTRACTION_WAIT):
+            logger.warning("Lote recusado: limite de extrações simultâneas atingido")
+            return jsonify({
+                'status': 'error',
+                'message': 'Servidor ocupado processando outros PDFs. Tente novamente em instantes.'
+            }), 503
+
+        try:
+            source_id = None
+            if single_source:
+                source_name = secure_filename(request.form.get('sourceName', '')) or batch_name or f'lote_{len(items)}_arquivos'
+                source_id = create_source(source_name, 0, 0, 'processando')
+                if not source_id:
+                    return jsonify({
+                        'status': 'error',
+                        'message': 'Erro ao criar registro do source'
+                    }), 500
+
+            logger.info(f"Lote com {len(items)} PDF(s) (source único: {source_id})")
+            results = process_batch(items, MAX_PDF_PAGES, source_id, on_conflict, engine)
+
+            report = batch_report(results, source_id)
+            if single_source and not report['arquivos_processados']:
+                update_source_status(source_id, 'erro')
+            report['arquivos_ignorados'] = ignored
+            if wants_timings():
+                report['timings'] = rounded_timings(g.stage_timings)
+            return jsonify(report), 200
+        finally:
+            sync_extraction_slots.release()
+
+    except Exception as e:
+        logger.error(f"Erro no processamento do lote: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Erro ao processar lote: {str(e)}'
+        }), 500
+
+    finally:
+        if archive:
+            archive.close()
+
+def enqueue_pdf_upload(file, filename):
+    """
+    Abre o PDF, registra o source (status 'processando') e o job de extração com o
+    PDF na fila durável do banco, de onde qualquer instância o processa.
+    Responde imediatamente com o ID do job.
+    """
+    from jobs import notify_queue_workers
+
+    job_id = str(uuid.uuid4())
+
+    pdf = None
+    try:
+        pdf, error_response = open_uploaded_pdf(file, filename)
+        if error_response:
+            return error_response
+
+        already_processed = find_already_processed_upload(pdf.sha256, filename)
+        if already_processed:
+            return already_processed
+
+        is_valid, page_count, error_message = check_pdf_page_limit(pdf)
+        if not is_valid:
+            logger.warning(f"PDF rejeitado: {error_message}")
+            return jsonify({
+                'status': 'error',
+                'message': error_message,
+                'page_count': page_count,
+                'max_pages_allowed': MAX_PDF_PAGES
+            }), 400
+
+        source_id_param = request.form.get('sourceId')
+        if source_id_param:
+            source_id = int(source_id_param)
+            error_response = check_existing_source(source_id)
+            if error_response:
+                return error_response
         else:
+            source_id = create_source(filename, 0, 0, 'processando')
+            if not source_id:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Erro ao criar registro do source'
+                }), 500
+
+        if not create_extraction_job(
+            job_id, source_id, filename, page_count, bool(source_id_param), pdf.read_bytes(),
+            get_on_conflict_mode(), get_extraction_engine(), wants_timings(), MAX_PDF_PAGES
+        ):
+            if not source_id_param:
+                update_source_status(source_id, 'erro')
             return jsonify({
                 'status': 'error',
-                'database': 'disconnected'
+                'message': 'Erro ao registrar job de extração'
             }), 500
+
+        notify_queue_workers()
+        logger.info(f"Job {job_id} enfileirado para o source {source_id} ({page_count} páginas)")
+
+        return jsonify({
+            'status': 'accepted',
+            'message': 'PDF recebido. A extração está sendo processada em segundo plano.',
+            'job_id': job_id,
+            'job_url': f'/jobs/{job_id}',
+            'source_id': source_id,
+            'filename': filename,
+            'page_count': page_count,
+            'max_pages_allowed': MAX_PDF_PAGES,
+            'is_update': bool(source_id_param)
+        }), 202
+
+    finally:
+        # O job lê o PDF guardado no banco; o documento do upload não é mais usado
+        if pdf:
+            pdf.close()
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Endpoint para consultar o andamento de um job de extração assíncrona"""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'ID de job inválido'
+        }), 400
+
+    try:
+        job = get_extraction_job(job_id)
+    except Exception as e:
+        logger.error(f"Erro ao buscar job {job_id}: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Erro ao buscar job: {str(e)}'
+        }), 500
+
+    if not job:
+        return jsonify({
+            'status': 'error',
+            'message': 'Job não encontrado'
+        }), 404
+
+    total = job['total_paginas'] or 0
+    job['progresso'] = round(job['paginas_processadas'] * 100 / total, 1) if total else 0.0
+
+    return jsonify({
+        'status': 'success',
+        'job': job
+    })
+
+@bp.route('/devedores/<ccp>', methods=['GET'])
+def get_devedor_by_ccp(ccp):
+    """
+    Consulta um devedor pelo CCP em todos os sources: registro atual (da lista mais
+    recente em que aparece) e histórico por source, via chave primária e índice de CCP.
+    """
+    try:
+        devedor = get_devedor(ccp.strip())
     except Exception as e:
+        logger.error(f"Erro ao buscar devedor {ccp}: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Erro ao buscar devedor: {str(e)}'
+        }), 500
+
+    if not devedor:
+        return jsonify({
+            'status': 'error',
+            'message': 'Devedor não encontrado'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'ccp': ccp.strip(),
+        'devedor': devedor['atual'],
+        'historico': devedor['historico'],
+        'quantidade_sources': len(devedor['historico'])
+    })
+
+@bp.route('/layout_templates', methods=['GET'])
+def get_layout_templates():
+    """Lista os templates de layout de tabela aprendidos (colunas, cabeçalho e uso)"""
+    from layout_templates import LAYOUT_TEMPLATES, LAYOUT_TEMPLATES_FILE, list_templates
+
+    templates = list_templates()
+    return jsonify({
+        'status': 'success',
+        'enabled': LAYOUT_TEMPLATES,
+        'file': LAYOUT_TEMPLATES_FILE,
+        'templates': templates,
+        'count': len(templates)
+    })
+
+@bp.route('/status', methods=['GET'])
+def check_database_status():
+    """Verifica o status da conexão com o banco de dados (usando uma conexão do pool)"""
+    try:
+        with db_connection() as conn:
+            if not conn:
+                return jsonify({
+                    'status': 'error',
+                    'database': 'disconnected',
+                    'message': 'Não foi possível conectar ao PostgreSQL'
+                }), 500
+
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+
+            return jsonify({
+                'status': 'ok',
+                'database': 'connected',
+                'message': 'Conexão com PostgreSQL está funcionando'
+            })
+    except Exception as e:
+        logger.error(f"Erro ao verificar banco: {str(e)}")
         return jsonify({
             'status': 'error',
             'database': 'error',
-            'message': str(e)
+            'message': f'Erro ao verificar conexão: {str(e)}'
         }), 500
 
-@app.route('/extraction_results', methods=['GET'])
+@bp.route('/extraction_results', methods=['GET'])
 def get_extraction_results():
     """Endpoint para buscar resultados de extração do banco"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({
-                'status': 'error',
-                'message': 'Erro na conexão com banco de dados'
-            }), 500
+        with db_connection() as conn:
+            if not conn:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Erro na conexão com banco de dados'
+                }), 500
 
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT er.id, er.ccp, er.nome, er.celular, er.processo, er.valor_devido,
-                       er.status, er.data_cadastro, er.data_atualizacao, er.created_at,
-                       src.id as source_id, src.nome as source_nome, src.data_upload
-                FROM extraction_results er
-                JOIN sources src ON er.source_id = src.id
-                ORDER BY er.created_at DESC 
-                LIMIT 100
-            """)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT er.id, er.ccp, er.nome, er.celular, er.processo, er.valor_devido,
+                           er.status, er.data_cadastro, er.data_atualizacao, er.created_at,
+                           src.id as source_id, src.nome as source_nome, src.data_upload
+                    FROM extraction_results er
+                    JOIN sources src ON er.source_id = src.id
+                    ORDER BY er.created_at DESC 
+                    LIMIT 100
+                """)
             
-            columns = [desc[0] for desc in cur.description]
-            results = []
+                columns = [desc[0] for desc in cur.description]
+                results = []
             
-            for row in cur.fetchall():
-                row_dict = dict(zip(columns, row))
-                # Converter datetime para string se necessário
-                for date_field in ['data_cadastro', 'data_atualizacao', 'created_at', 'data_upload']:
-                    if row_dict.get(date_field):
-                        row_dict[date_field] = row_dict[date_field].isoformat()
-                results.append(row_dict)
+                for row in cur.fetchall():
+                    row_dict = dict(zip(columns, row))
+                    # Converter datetime para string se necessário
+                    for date_field in ['data_cadastro', 'data_atualizacao', 'created_at', 'data_upload']:
+                        if row_dict.get(date_field):
+                            row_dict[date_field] = row_dict[date_field].isoformat()
+                    results.append(row_dict)
             
+                return jsonify({
+                    'status': 'success',
+                    'data': results,
+                    'count': len(results)
+                })
+
+    except Exception as e:
+        logger.error(f"Erro ao buscar extraction_results: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Erro ao buscar resultados: {str(e)}'
+        }), 500
+
+@bp.route('/extraction_results/search', methods=['GET'])
+def search_extraction_results():
+    """
+    Busca aproximada de contribuintes pelo nome, sem diferenciar acentos e maiúsculas.
+    Usa o índice de trigramas em normalize_nome(nome) e ordena pela similaridade.
+    Parâmetros: ?q= (mínimo 3 caracteres), limit=, similaridade_min=, source_id=, status=
+    """
+    termo = ' '.join(request.args.get('q', '').split())
+    try:
+        if len(termo) < 3:
+            raise ValueError('Informe ao menos 3 caracteres em q')
+        limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+        if limit < 1 or limit > SEARCH_MAX_PAGE_SIZE:
+            raise ValueError(f'limit deve estar entre 1 e {SEARCH_MAX_PAGE_SIZE}')
+        similaridade_min = float(request.args.get('similaridade_min', SEARCH_MIN_SIMILARITY))
+        if not 0 < similaridade_min <= 1:
+            raise ValueError('similaridade_min deve estar entre 0 e 1')
+        source_id = request.args.get('source_id', type=int)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    # normalize_nome(%(termo)s) é constante (função IMMUTABLE), então o <% usa o índice GIN
+    conditions = ["normalize_nome(%(termo)s) <%% normalize_nome(er.nome)"]
+    params = {'termo': termo, 'similaridade_min': str(similaridade_min), 'limit': limit}
+    if source_id:
+        conditions.append("er.source_id = %(source_id)s")
+        params['source_id'] = source_id
+    if request.args.get('status'):
+        conditions.append("er.status = %(status)s")
+        params['status'] = request.args['status']
+
+    try:
+        with db_connection() as conn:
+            if not conn:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Erro na conexão com banco de dados'
+                }), 500
+
+            with conn.cursor() as cur:
+                # Vale só para esta transação (desfeita ao devolver a conexão ao pool)
+                cur.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %(similaridade_min)s, true)", params)
+                cur.execute(f"""
+                    SELECT er.id, er.ccp, er.nome, er.celular, er.processo, er.valor_devido, er.status,
+                           er.source_id, src.nome AS source_nome,
+                           round(word_similarity(normalize_nome(%(termo)s), normalize_nome(er.nome))::numeric, 3) AS similaridade
+                    FROM extraction_results er
+                    JOIN sources src ON er.source_id = src.id
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY similaridade DESC, er.nome, er.id
+                    LIMIT %(limit)s
+                """, params)
+
+                columns = [desc[0] for desc in cur.description]
+                results = [dict(zip(columns, row)) for row in cur.fetchall()]
+
             return jsonify({
                 'status': 'success',
+                'q': termo,
                 'data': results,
                 'count': len(results)
             })
 
     except Exception as e:
-        logger.error(f"Erro ao buscar extraction_results: {str(e)}")
+        logger.error(f"Erro na busca por nome '{termo}': {str(e)}")
         return jsonify({
             'status': 'error',
             'message': f'Erro ao buscar resultados: {str(e)}'
         }), 500
-    finally:
-        if conn:
-            conn.close()
 
-@app.route('/sources', methods=['GET'])
+@bp.route('/sources', methods=['GET'])
 def get_sources():
     """Endpoint para buscar sources (PDFs processados)"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({
-                'status': 'error',
-                'message': 'Erro na conexão com banco de dados'
-            }), 500
+        with db_connection() as conn:
+            if not conn:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Erro na conexão com banco de dados'
+                }), 500
 
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, nome, data_upload, quantidade_itens, registros_processados, status, created_at, updated_at
-                FROM sources 
-                ORDER BY data_upload DESC
-            """)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, nome, data_upload, quantidade_itens, registros_processados, status, created_at, updated_at
+                    FROM sources 
+                    ORDER BY data_upload DESC
+                """)
             
-            columns = [desc[0] for desc in cur.description]
-            results = []
+                columns = [desc[0] for desc in cur.description]
+                results = []
             
-            for row in cur.fetchall():
-                row_dict = dict(zip(columns, row))
-                # Converter datetime para string se necessário
-                if row_dict.get('data_upload'):
-                    row_dict['data_upload'] = row_dict['data_upload'].isoformat()
-                if row_dict.get('created_at'):
-                    row_dict['created_at'] = row_dict['created_at'].isoformat()
-                if row_dict.get('updated_at'):
-                    row_dict['updated_at'] = row_dict['updated_at'].isoformat()
-                results.append(row_dict)
+                for row in cur.fetchall():
+                    row_dict = dict(zip(columns, row))
+                    # Converter datetime para string se necessário
+                    if row_dict.get('data_upload'):
+                        row_dict['data_upload'] = row_dict['data_upload'].isoformat()
+                    if row_dict.get('created_at'):
+                        row_dict['created_at'] = row_dict['created_at'].isoformat()
+                    if row_dict.get('updated_at'):
+                        row_dict['updated_at'] = row_dict['updated_at'].isoformat()
+                    results.append(row_dict)
             
-            return jsonify({
-                'status': 'success',
-                'data': results,
-                'count': len(results)
-            })
+                return jsonify({
+                    'status': 'success',
+                    'data': results,
+                    'count': len(results)
+                })
 
     except Exception as e:
         logger.error(f"Erro ao buscar sources: {str(e)}")
@@ -434,126 +929,312 @@ def get_sources():
             'status': 'error',
             'message': str(e)
         }), 500
-    finally:
-        if conn:
-            conn.close()
 
-@app.route('/sources/<int:source_id>/extraction_results', methods=['GET'])
+def encode_results_cursor(created_at, result_id):
+    """Gera o cursor opaco da paginação a partir do último registro da página"""
+    raw = json.dumps({'c': created_at.isoformat(), 'i': result_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_results_cursor(cursor):
+    """Lê o cursor da paginação. Retorna (created_at, id) ou lança ValueError"""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(raw['c']), int(raw['i'])
+    except Exception:
+        raise ValueError('Cursor de paginação inválido')
+
+def parse_extraction_results_filters(args):
+    """
+    Monta as condições SQL dos filtros opcionais (status, valor_min, valor_max, nome).
+    Retorna (condicoes, parametros) ou lança ValueError para valores inválidos.
+    """
+    conditions = []
+    params = []
+
+    if args.get('status'):
+        conditions.append("status = %s")
+        params.append(args['status'])
+
+    for arg, operator in (('valor_min', '>='), ('valor_max', '<=')):
+        if args.get(arg):
+            try:
+                value = Decimal(args[arg])
+            except InvalidOperation:
+                raise ValueError(f'Parâmetro {arg} inválido')
+            conditions.append(f"valor_devido {operator} %s")
+            params.append(value)
+
+    if args.get('nome'):
+        # Busca por prefixo, sem diferenciar maiúsculas (usa o índice upper(nome) text_pattern_ops)
+        prefix = args['nome'].strip().upper()
+        prefix = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append("upper(nome) LIKE %s")
+        params.append(prefix + '%')
+
+    return conditions, params
+
+@bp.route('/sources/<int:source_id>/extraction_results', methods=['GET'])
 def get_extraction_results_by_source(source_id):
-    """Endpoint para buscar resultados de extração de um source específico"""
+    """
+    Endpoint para buscar resultados de extração de um source específico.
+    Paginação por cursor (keyset em created_at, id): ?limit=&cursor=
+    Filtros opcionais: ?status=&valor_min=&valor_max=&nome= (prefixo do nome)
+    """
+    try:
+        limit = int(request.args.get('limit', RESULTS_PAGE_SIZE))
+        if limit < 1 or limit > RESULTS_MAX_PAGE_SIZE:
+            raise ValueError(f'limit deve estar entre 1 e {RESULTS_MAX_PAGE_SIZE}')
+        conditions, params = parse_extraction_results_filters(request.args)
+        cursor = request.args.get('cursor')
+        if cursor:
+            conditions.append("(created_at, id) < (%s, %s)")
+            params.extend(decode_results_cursor(cursor))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    try:
+        with db_connection() as conn:
+            if not conn:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Erro na conexão com banco de dados'
+                }), 500
+
+            with conn.cursor() as cur:
+                # Primeiro buscar informações do source
+                cur.execute("""
+                    SELECT id, nome, data_upload, quantidade_itens, registros_processados, status, created_at, updated_at
+                    FROM sources 
+                    WHERE id = %s
+                """, (source_id,))
+            
+                source_row = cur.fetchone()
+                if not source_row:
+                    return jsonify({
+                        'status': 'error',
+                        'message': 'Source não encontrado'
+                    }), 404
+            
+                source_columns = [desc[0] for desc in cur.description]
+                source_info = dict(zip(source_columns, source_row))
+                for date_field in ['data_upload', 'created_at', 'updated_at']:
+                    if source_info.get(date_field):
+                        source_info[date_field] = source_info[date_field].isoformat()
+            
+                # Buscar uma página de resultados de extração do source (um registro a mais indica se há próxima página)
+                where = " AND ".join(["source_id = %s"] + conditions)
+                cur.execute(f"""
+                    SELECT id, ccp, nome, celular, processo, valor_devido, 
+                           status, data_cadastro, data_atualizacao, created_at
+                    FROM extraction_results 
+                    WHERE {where}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, [source_id] + params + [limit + 1])
+            
+                columns = [desc[0] for desc in cur.description]
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+
+                next_cursor = None
+                if has_more:
+                    last = dict(zip(columns, rows[-1]))
+                    next_cursor = encode_results_cursor(last['created_at'], last['id'])
+
+                extraction_results = []
+                for row in rows:
+                    row_dict = dict(zip(columns, row))
+                    for date_field in ['data_cadastro', 'data_atualizacao', 'created_at']:
+                        if row_dict.get(date_field):
+                            row_dict[date_field] = row_dict[date_field].isoformat()
+                    extraction_results.append(row_dict)
+            
+                return jsonify({
+                    'status': 'success',
+                    'source': source_info,
+                    'extraction_results': extraction_results,
+                    'count': len(extraction_results),
+                    'pagination': {
+                        'limit': limit,
+                        'has_more': has_more,
+                        'next_cursor': next_cursor
+                    }
+                })
+
+    except Exception as e:
+        logger.error(f"Erro ao buscar resultados do source {source_id}: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def json_default(value):
+    """Serializa datas e decimais nas linhas exportadas (mesmo formato das respostas JSON)"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Tipo não serializável: {type(value)}')
+
+def iter_export_ndjson(cur, columns):
+    """Gera as linhas do cursor como NDJSON, em blocos"""
+    while True:
+        rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            return
+        yield ''.join(
+            json.dumps(dict(zip(columns, row)), default=json_default, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+def iter_export_csv(cur, columns):
+    """Gera as linhas do cursor como CSV (com cabeçalho), em blocos"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    while True:
+        rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+@bp.route('/sources/<int:source_id>/extraction_results/export', methods=['GET'])
+def export_extraction_results(source_id):
+    """
+    Exporta todos os resultados de um source em streaming (?format=ndjson ou csv).
+    Lê do banco com um cursor nomeado (server-side), então a memória não depende do tamanho do source.
+    Aceita os mesmos filtros de /sources/<id>/extraction_results.
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'status': 'error',
+            'message': f"Formato inválido. Valores aceitos: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+
+    try:
+        conditions, params = parse_extraction_results_filters(request.args)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    # A conexão fica emprestada enquanto a resposta é transmitida e é devolvida ao fechar a resposta
+    connection_ctx = db_connection()
+    conn = connection_ctx.__enter__()
+    released = False
+
+    def release_connection():
+        nonlocal released
+        if not released:
+            released = True
+            connection_ctx.__exit__(None, None, None)
+
     try:
-        conn = get_db_connection()
         if not conn:
+            release_connection()
             return jsonify({
                 'status': 'error',
                 'message': 'Erro na conexão com banco de dados'
             }), 500
 
         with conn.cursor() as cur:
-            # Primeiro buscar informações do source
-            cur.execute("""
-                SELECT id, nome, data_upload, quantidade_itens, registros_processados, status, created_at, updated_at
-                FROM sources 
-                WHERE id = %s
-            """, (source_id,))
-            
-            source_row = cur.fetchone()
-            if not source_row:
+            cur.execute("SELECT nome FROM sources WHERE id = %s", (source_id,))
+            if not cur.fetchone():
+                release_connection()
                 return jsonify({
                     'status': 'error',
                     'message': 'Source não encontrado'
                 }), 404
-            
-            source_columns = [desc[0] for desc in cur.description]
-            source_info = dict(zip(source_columns, source_row))
-            for date_field in ['data_upload', 'created_at', 'updated_at']:
-                if source_info.get(date_field):
-                    source_info[date_field] = source_info[date_field].isoformat()
-            
-            # Buscar resultados de extração do source
-            cur.execute("""
-                SELECT id, ccp, nome, celular, processo, valor_devido, 
-                       status, data_cadastro, data_atualizacao, created_at
-                FROM extraction_results 
-                WHERE source_id = %s
-                ORDER BY created_at DESC
-            """, (source_id,))
-            
-            columns = [desc[0] for desc in cur.description]
-            extraction_results = []
-            
-            for row in cur.fetchall():
-                row_dict = dict(zip(columns, row))
-                for date_field in ['data_cadastro', 'data_atualizacao', 'created_at']:
-                    if row_dict.get(date_field):
-                        row_dict[date_field] = row_dict[date_field].isoformat()
-                extraction_results.append(row_dict)
-            
-            return jsonify({
-                'status': 'success',
-                'source': source_info,
-                'extraction_results': extraction_results,
-                'count': len(extraction_results)
-            })
+
+        where = " AND ".join(["source_id = %s"] + conditions)
+        cur = conn.cursor(name=f'export_{source_id}_{uuid.uuid4().hex}')
+        cur.itersize = EXPORT_FETCH_SIZE
+        cur.execute(f"""
+            SELECT id, ccp, nome, celular, processo, valor_devido,
+                   status, data_cadastro, data_atualizacao, created_at
+            FROM extraction_results
+            WHERE {where}
+            ORDER BY id
+        """, [source_id] + params)
+        columns = ['id', 'ccp', 'nome', 'celular', 'processo', 'valor_devido',
+                   'status', 'data_cadastro', 'data_atualizacao', 'created_at']
 
     except Exception as e:
-        logger.error(f"Erro ao buscar resultados do source {source_id}: {str(e)}")
+        release_connection()
+        logger.error(f"Erro ao exportar resultados do source {source_id}: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
-    finally:
-        if conn:
-            conn.close()
 
-@app.errorhandler(413)
+    def generate():
+        try:
+            if export_format == 'csv':
+                yield from iter_export_csv(cur, columns)
+            else:
+                yield from iter_export_ndjson(cur, columns)
+        except Exception as e:
+            logger.error(f"Erro durante a exportação do source {source_id}: {str(e)}")
+            raise
+        finally:
+            release_connection()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=source_{source_id}.{export_format}'
+    response.call_on_close(release_connection)
+    return response
+
+@bp.app_errorhandler(413)
 def too_large(e):
     return jsonify({
         'status': 'error',
         'message': 'Arquivo muito grande. Tamanho máximo permitido: 50MB'
     }), 413
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(e):
     return jsonify({
         'status': 'error',
         'message': 'Erro interno do servidor'
     }), 500
 
-@app.route('/status', methods=['GET'])
-def database_status():
-    """Endpoint para verificar status da conexão com banco"""
-    try:
-        conn = get_db_connection()
-        if conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1")
-                result = cur.fetchone()
-            conn.close()
-            
-            return jsonify({
-                'status': 'success',
-                'database': 'connected',
-                'message': 'Conexão com PostgreSQL está funcionando'
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'database': 'disconnected',
-                'message': 'Não foi possível conectar ao PostgreSQL'
-            }), 500
-            
-    except Exception as e:
-        logger.error(f"Erro ao verificar banco: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'database': 'error',
-            'message': f'Erro ao verificar conexão: {str(e)}'
-        }), 500
+def create_app(config=None):
+    """
+    Cria e configura a aplicação Flask.
+    Usada pelo Gunicorn ('app:create_app()') e pelo servidor de desenvolvimento.
+    """
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    CORS(app)  # Permite requests do frontend
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    if config:
+        app.config.update(config)
+
+    app.register_blueprint(bp)
+    return app
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
     
     logger.info(f"Iniciando PDF Extractor API na porta {port}")
+    app = create_app()
+    # Consome a fila de extração no processo que serve as requisições (no modo debug, não no
+    # processo do reloader). No Gunicorn, os workers da fila são iniciados em gunicorn.conf.py
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from jobs import start_queue_workers
+        start_queue_workers()
     app.run(host='0.0.0.0', port=port, debug=debug)
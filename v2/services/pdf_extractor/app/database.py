@@ -1,176 +1,408 @@
+import io
 import os
+import math
+import time
+import threading
 import psycopg2
-from psycopg2 import sql, extras
+from psycopg2 import sql, extras, pool, extensions
+from contextlib import contextmanager
 import json
+from decimal import Decimal
+from metrics import stage, observe_db_pool_wait
+
+# Pool de conexões compartilhado pelo processo
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Tempo máximo (s) esperando uma conexão livre quando o pool está cheio
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Conexões ociosas há mais tempo que isso (s) são testadas com SELECT 1 antes do uso
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+
+def get_connection_params():
+    """Retorna os parâmetros de conexão com o banco de dados."""
+    # Usar DATABASE_URL se disponível (Docker), senão usar variáveis individuais
+    database_url = os.getenv("DATABASE_URL")
+
+    if database_url:
+        return {'dsn': database_url, 'sslmode': 'disable'}
+
+    return {
+        'host': os.getenv("DB_HOST", "localhost"),
+        'port': os.getenv("DB_PORT", "5432"),
+        'dbname': os.getenv("DB_NAME", "morrinhos"),
+        'user': os.getenv("DB_USER", "postgres"),
+        'password': os.getenv("DB_PASSWORD", "postgres123"),
+        'sslmode': 'disable'
+    }
 
 def get_db_connection():
-    """Cria e retorna uma nova conexão com o banco de dados."""
+    """
+    Cria e retorna uma nova conexão avulsa com o banco de dados (fora do pool).
+    Dentro do serviço prefira db_connection(), que reutiliza as conexões do pool.
+    """
     try:
-        # Usar DATABASE_URL se disponível (Docker), senão usar variáveis individuais
-        database_url = os.getenv("DATABASE_URL")
-        
-        if database_url:
-            conn = psycopg2.connect(database_url, sslmode='disable')
-        else:
-            conn = psycopg2.connect(
-                host=os.getenv("DB_HOST", "localhost"),
-                port=os.getenv("DB_PORT", "5432"),
-                dbname=os.getenv("DB_NAME", "morrinhos"),
-                user=os.getenv("DB_USER", "postgres"),
-                password=os.getenv("DB_PASSWORD", "postgres123"),
-                sslmode='disable'
-            )
-        return conn
+        return psycopg2.connect(**get_connection_params())
     except psycopg2.OperationalError as e:
         print(f"Erro ao conectar ao PostgreSQL: {e}")
         return None
 
-def create_source(nome, quantidade_itens=0, registros_processados=0, status='processando'):
+def get_db_pool():
     """
-    Cria um novo registro na tabela 'sources' e retorna o ID gerado.
+    Retorna o pool de conexões do processo, criando-o na primeira chamada.
+    O pool é recriado após um fork, pois conexões não podem ser compartilhadas entre processos.
     """
-    print(f"🔄 Tentando criar source: nome={nome}, quantidade_itens={quantidade_itens}, registros_processados={registros_processados}, status={status}")
-    
-    conn = get_db_connection()
-    if conn is None:
-        print("❌ Erro: Não foi possível conectar ao banco de dados")
-        return None
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **get_connection_params())
+            _pool_pid = os.getpid()
+            _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+            _last_used.clear()
+            print(f"Pool de conexões criado (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+        return _pool
+
+def _is_connection_healthy(conn):
+    """Verifica se uma conexão do pool ainda pode ser usada."""
+    if conn.closed:
+        return False
+    if conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+
+    idle = time.monotonic() - _last_used.get(id(conn), 0)
+    if idle < DB_POOL_HEALTHCHECK_IDLE:
+        return True
 
     try:
         with conn.cursor() as cur:
-            print("📝 Executando query de inserção...")
-            cur.execute(
-                """
-                INSERT INTO sources (nome, data_upload, quantidade_itens, registros_processados, status)
-                VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s)
-                RETURNING id;
-                """,
-                (nome, quantidade_itens, registros_processados, status)
-            )
-            source_id = cur.fetchone()[0]
-            conn.commit()
-            print(f"✅ Source criado com ID: {source_id}")
-            return source_id
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(f"❌ Erro detalhado ao criar source: {error}")
-        print(f"❌ Tipo do erro: {type(error)}")
+            cur.execute("SELECT 1")
         conn.rollback()
-        return None
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout_connection():
+    """Pega uma conexão saudável do pool, aguardando até DB_POOL_TIMEOUT se estiver cheio."""
+    db_pool = get_db_pool()
+    slots = _pool_slots
+    wait_start = time.perf_counter()
+    acquired = slots.acquire(timeout=DB_POOL_TIMEOUT)
+    observe_db_pool_wait(time.perf_counter() - wait_start)
+    if not acquired:
+        print(f"Erro: nenhuma conexão livre no pool após {DB_POOL_TIMEOUT}s")
+        return None, None
+
+    try:
+        # Descarta conexões quebradas (ex.: banco reiniciado) até achar uma saudável
+        for _ in range(DB_POOL_MAX + 1):
+            conn = db_pool.getconn()
+            if _is_connection_healthy(conn):
+                return conn, slots
+            print("Conexão inválida descartada do pool")
+            _last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Não foi possível obter uma conexão saudável do pool")
+    except Exception:
+        slots.release()
+        raise
+
+def _checkin_connection(db_pool, conn, slots):
+    """Devolve a conexão ao pool, desfazendo qualquer transação deixada aberta."""
+    try:
+        close = bool(conn.closed)
+        if not close and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn, close=close)
     finally:
-        if conn:
-            conn.close()
+        slots.release()
 
-def update_source_items_count(source_id, quantidade_itens):
+@contextmanager
+def db_connection():
     """
-    Atualiza a quantidade de itens processados para um source específico.
+    Empresta uma conexão do pool pelo tempo do bloco 'with'.
+    Retorna None se não for possível conectar ao banco, mantendo o padrão dos helpers.
     """
-    conn = get_db_connection()
+    try:
+        db_pool = get_db_pool()
+        conn, slots = _checkout_connection()
+    except psycopg2.Error as e:
+        print(f"Erro ao conectar ao PostgreSQL: {e}")
+        conn, slots = None, None
+
     if conn is None:
-        return False
+        yield None
+        return
 
     try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE sources SET quantidade_itens = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s;
-                """,
-                (quantidade_itens, source_id)
-            )
-            conn.commit()
-            print(f"Source {source_id} atualizado com {quantidade_itens} itens")
-            return True
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Erro ao atualizar source: {error}")
-        conn.rollback()
-        return False
+        yield conn
     finally:
-        if conn:
-            conn.close()
+        _checkin_connection(db_pool, conn, slots)
+
+def create_source(nome, quantidade_itens=0, registros_processados=0, status='processando'):
+    """
+    Cria um novo registro na tabela 'sources' e retorna o ID gerado.
+    """
+    print(f"🔄 Tentando criar source: nome={nome}, quantidade_itens={quantidade_itens}, registros_processados={registros_processados}, status={status}")
+    
+    with db_connection() as conn:
+        if conn is None:
+            print("❌ Erro: Não foi possível conectar ao banco de dados")
+            return None
+
+        try:
+            with conn.cursor() as cur:
+                print("📝 Executando query de inserção...")
+                cur.execute(
+                    """
+                    INSERT INTO sources (nome, data_upload, quantidade_itens, registros_processados, status)
+                    VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s)
+                    RETURNING id;
+                    """,
+                    (nome, quantidade_itens, registros_processados, status)
+                )
+                source_id = cur.fetchone()[0]
+                conn.commit()
+                print(f"✅ Source criado com ID: {source_id}")
+                return source_id
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"❌ Erro detalhado ao criar source: {error}")
+            print(f"❌ Tipo do erro: {type(error)}")
+            conn.rollback()
+            return None
+
+def update_source_items_count(source_id, quantidade_itens):
+    """
+    Atualiza a quantidade de itens processados para um source específico.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sources SET quantidade_itens = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s;
+                    """,
+                    (quantidade_itens, source_id)
+                )
+                conn.commit()
+                print(f"Source {source_id} atualizado com {quantidade_itens} itens")
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao atualizar source: {error}")
+            conn.rollback()
+            return False
 
 def update_source_processed_count(source_id, registros_processados):
     """
     Atualiza a quantidade de registros processados para um source específico.
     """
-    conn = get_db_connection()
-    if conn is None:
-        return False
+    with db_connection() as conn:
+        if conn is None:
+            return False
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE sources SET registros_processados = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s;
-                """,
-                (registros_processados, source_id)
-            )
-            conn.commit()
-            print(f"Source {source_id} atualizado com {registros_processados} registros processados")
-            return True
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Erro ao atualizar registros processados do source: {error}")
-        conn.rollback()
-        return False
-    finally:
-        if conn:
-            conn.close()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sources SET registros_processados = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s;
+                    """,
+                    (registros_processados, source_id)
+                )
+                conn.commit()
+                print(f"Source {source_id} atualizado com {registros_processados} registros processados")
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao atualizar registros processados do source: {error}")
+            conn.rollback()
+            return False
 
 def update_source_status(source_id, status):
     """
     Atualiza o status de um source específico.
     """
-    conn = get_db_connection()
-    if conn is None:
-        return False
+    with db_connection() as conn:
+        if conn is None:
+            return False
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE sources SET status = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s;
-                """,
-                (status, source_id)
-            )
-            conn.commit()
-            print(f"Source {source_id} atualizado com status: {status}")
-            return True
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Erro ao atualizar status do source: {error}")
-        conn.rollback()
-        return False
-    finally:
-        if conn:
-            conn.close()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sources SET status = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s;
+                    """,
+                    (status, source_id)
+                )
+                conn.commit()
+                print(f"Source {source_id} atualizado com status: {status}")
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao atualizar status do source: {error}")
+            conn.rollback()
+            return False
+
+# Upsert de extraction_results em uma única ida ao banco. O CTE 'existing' enxerga o estado
+# anterior ao INSERT, e xmax = 0 distingue linhas inseridas de linhas atualizadas.
+# {data} é um VALUES (lotes pequenos) ou a tabela de staging carregada via COPY (lotes grandes).
+UPSERT_EXTRACTION_SQL = """
+    WITH data (source_id, ccp, nome, celular, processo, valor_devido, status) AS (
+        {data}
+    ),
+    existing AS (
+        SELECT er.ccp, er.nome
+        FROM extraction_results er
+        JOIN data d ON er.source_id = d.source_id AND er.ccp = d.ccp
+    ),
+    upserted AS (
+        INSERT INTO extraction_results (source_id, ccp, nome, celular, processo, valor_devido, status)
+        SELECT source_id, ccp, nome, celular, processo, valor_devido, status FROM data
+        ON CONFLICT (source_id, ccp) {on_conflict}
+        RETURNING ccp, (xmax = 0) AS inserted
+    )
+    SELECT ccp, inserted, NULL AS nome_existente FROM upserted
+    UNION ALL
+    SELECT ccp, NULL, nome FROM existing;
+"""
+
+ON_CONFLICT_CLAUSES = {
+    'nothing': 'DO NOTHING',
+    'update': """DO UPDATE SET
+            nome = EXCLUDED.nome,
+            celular = EXCLUDED.celular,
+            processo = EXCLUDED.processo,
+            valor_devido = EXCLUDED.valor_devido
+        WHERE (extraction_results.nome, extraction_results.celular, extraction_results.processo, extraction_results.valor_devido)
+            IS DISTINCT FROM (EXCLUDED.nome, EXCLUDED.celular, EXCLUDED.processo, EXCLUDED.valor_devido)""",
+}
+
+# Tipos explícitos: colunas só com NULL no VALUES seriam inferidas como text
+EXTRACTION_ROW_TEMPLATE = "(%s::integer, %s::varchar, %s::text, %s::varchar, %s::text, %s::numeric, %s::varchar)"
+
+# A partir de quantos registros a carga usa COPY FROM STDIN em vez de VALUES
+BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "5000"))
+
+# Tabela temporária por conexão; as linhas somem no commit, então ela pode ser reutilizada pelo pool
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS extraction_results_staging (
+        source_id INTEGER,
+        ccp TEXT,
+        nome TEXT,
+        celular TEXT,
+        processo TEXT,
+        valor_devido NUMERIC,
+        status TEXT
+    ) ON COMMIT DELETE ROWS;
+"""
 
-def insert_extraction_data(data, source_id):
+STAGED_ROWS_SQL = "SELECT source_id, ccp, nome, celular, processo, valor_devido, status FROM extraction_results_staging"
+
+def _copy_text_value(value):
+    """Formata um valor para o formato texto do COPY (NULL como \\N e caracteres especiais escapados)."""
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+def copy_rows_to_staging(cur, rows):
     """
-    Insere uma lista de dicionários na tabela 'extraction_results'.
-    Utiliza a cláusula ON CONFLICT para evitar a inserção de registros duplicados no mesmo source.
-    Filtra registros com valores nulos ou vazios na coluna 'nome'.
-    Retorna um dicionário com informações detalhadas sobre a inserção.
+    Carrega as linhas na tabela de staging com COPY FROM STDIN a partir de um buffer em memória.
     """
-    if not data:
-        print("Nenhum dado para inserir.")
-        return {
-            'success': False,
-            'inserted_count': 0,
-            'duplicates': [],
-            'invalid_records': [],
-            'total_processed': 0
-        }
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_text_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
 
-    if not source_id:
-        print("Source ID é obrigatório.")
-        return {
-            'success': False,
-            'inserted_count': 0,
-            'duplicates': [],
-            'invalid_records': [],
-            'total_processed': 0
-        }
+    cur.execute(CREATE_STAGING_SQL)
+    cur.copy_expert(
+        "COPY extraction_results_staging (source_id, ccp, nome, celular, processo, valor_devido, status) FROM STDIN",
+        buffer
+    )
+
+def upsert_extraction_rows(cur, rows, on_conflict, bulk=None):
+    """
+    Executa o upsert das linhas e retorna (ccp, inserted, nome_existente) para cada linha afetada ou já existente.
+    Com bulk=None, o COPY é usado automaticamente a partir de BULK_COPY_THRESHOLD linhas.
+    """
+    if bulk is None:
+        bulk = len(rows) >= BULK_COPY_THRESHOLD
+
+    if bulk:
+        print(f"Carga em lote via COPY: {len(rows)} registros")
+        copy_rows_to_staging(cur, rows)
+        cur.execute(UPSERT_EXTRACTION_SQL.format(
+            data=STAGED_ROWS_SQL,
+            on_conflict=ON_CONFLICT_CLAUSES[on_conflict]
+        ))
+        return cur.fetchall()
+
+    return extras.execute_values(
+        cur,
+        UPSERT_EXTRACTION_SQL.format(data='VALUES %s', on_conflict=ON_CONFLICT_CLAUSES[on_conflict]),
+        rows,
+        template=EXTRACTION_ROW_TEMPLATE,
+        page_size=len(rows),
+        fetch=True
+    )
+
+# Aponta o índice de devedores (tabela devedores) para os registros do source recém-gravados.
+# Só substitui o registro atual de um CCP se o source enviado for o mesmo ou mais recente
+# (created_at, id): reenviar ou importar em lote uma lista antiga não sobrescreve dados novos.
+# As linhas seguem em ordem de CCP para que uploads simultâneos travem os CCPs na mesma ordem.
+SYNC_DEVEDORES_SQL = """
+    INSERT INTO devedores (ccp, extraction_result_id, source_id, nome, celular, processo, valor_devido)
+    SELECT ccp, id, source_id, nome, celular, processo, valor_devido
+    FROM extraction_results
+    WHERE source_id = %s AND ccp = ANY(%s)
+    ORDER BY ccp
+    ON CONFLICT (ccp) DO UPDATE SET
+        extraction_result_id = EXCLUDED.extraction_result_id,
+        source_id = EXCLUDED.source_id,
+        nome = EXCLUDED.nome,
+        celular = EXCLUDED.celular,
+        processo = EXCLUDED.processo,
+        valor_devido = EXCLUDED.valor_devido,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE (SELECT ROW(s.created_at, s.id) FROM sources s WHERE s.id = EXCLUDED.source_id)
+       >= (SELECT ROW(s.created_at, s.id) FROM sources s WHERE s.id = devedores.source_id)
+"""
 
+def sync_devedores_index(cur, source_id, ccps):
+    """
+    Atualiza o índice de devedores com os CCPs presentes no arquivo enviado ao source:
+    o registro deste source passa a ser o atual de cada CCP, a menos que o CCP já aponte
+    para um source mais recente. Roda na transação do chamador.
+    """
+    if ccps:
+        with stage('indice_devedores'):
+            cur.execute(SYNC_DEVEDORES_SQL, (source_id, sorted(set(ccps))))
+
+def _prepare_extraction_batch(data):
+    """
+    Separa os registros sem nome (inválidos) e os CCPs repetidos no próprio arquivo
+    (mantém a primeira ocorrência). Retorna (valid_data, unique_data, invalid_records, batch_duplicates).
+    """
     # Filtrar registros válidos (com nome não nulo e não vazio)
     valid_data = []
     invalid_records = []
@@ -195,21 +427,66 @@ def insert_extraction_data(data, source_id):
             
         # Se chegou até aqui, o registro é válido
         valid_data.append(item)
-    
-    if not valid_data:
-        print("Nenhum registro válido para inserir após filtragem.")
+
+    # CCP repetido no próprio arquivo: mantém a primeira ocorrência (o ON CONFLICT não aceita o mesmo CCP duas vezes)
+    unique_data = []
+    batch_duplicates = []
+    seen_ccps = {}
+    for item in valid_data:
+        ccp_num = item.get('CCP')
+        if ccp_num and ccp_num in seen_ccps:
+            batch_duplicates.append({
+                'ccp': ccp_num,
+                'nome': item.get('CONTRIBUINTE', 'N/A'),
+                'processo': item.get('PROCESSO(S)', 'N/A'),
+                'nome_existente': seen_ccps[ccp_num],
+                'valor_devido': item.get('VALOR DEVIDO', 0),
+                'motivo': f'CCP {ccp_num} repetido no arquivo'
+            })
+            continue
+        if ccp_num:
+            seen_ccps[ccp_num] = item.get('CONTRIBUINTE')
+        unique_data.append(item)
+
+    return valid_data, unique_data, invalid_records, batch_duplicates
+
+def insert_extraction_data(data, source_id, on_conflict='nothing', final_status='concluido', bulk=None):
+    """
+    Insere uma lista de dicionários na tabela 'extraction_results'.
+    Utiliza a cláusula ON CONFLICT para evitar a inserção de registros duplicados no mesmo source:
+    on_conflict='nothing' ignora CCPs já existentes e on_conflict='update' atualiza os que mudaram.
+    Filtra registros com valores nulos ou vazios na coluna 'nome'.
+    Os contadores e o status (final_status) do source são atualizados na mesma transação.
+    Lotes grandes (bulk=None e BULK_COPY_THRESHOLD ou mais registros) são carregados via COPY.
+    Retorna um dicionário com informações detalhadas sobre a inserção.
+    """
+    if on_conflict not in ON_CONFLICT_CLAUSES:
+        raise ValueError(f"on_conflict inválido: {on_conflict}")
+
+    if not data:
+        print("Nenhum dado para inserir.")
         return {
             'success': False,
             'inserted_count': 0,
             'duplicates': [],
-            'invalid_records': invalid_records,
-            'total_processed': len(data)
+            'invalid_records': [],
+            'total_processed': 0
         }
-    
-    print(f"Tentando inserir {len(valid_data)} registros válidos de {len(data)} total para source_id {source_id}.")
 
-    conn = get_db_connection()
-    if conn is None:
+    if not source_id:
+        print("Source ID é obrigatório.")
+        return {
+            'success': False,
+            'inserted_count': 0,
+            'duplicates': [],
+            'invalid_records': [],
+            'total_processed': 0
+        }
+
+    valid_data, unique_data, invalid_records, batch_duplicates = _prepare_extraction_batch(data)
+
+    if not valid_data:
+        print("Nenhum registro válido para inserir após filtragem.")
         return {
             'success': False,
             'inserted_count': 0,
@@ -217,36 +494,22 @@ def insert_extraction_data(data, source_id):
             'invalid_records': invalid_records,
             'total_processed': len(data)
         }
+    
+    print(f"Tentando inserir {len(unique_data)} registros válidos de {len(data)} total para source_id {source_id}.")
 
-    try:
-        with conn.cursor() as cur:
-            # Verificar quais CCPs já existem para identificar duplicatas
-            ccps_para_inserir = [item.get('CCP') for item in valid_data if item.get('CCP')]
-            
-            # Query para verificar registros existentes (por CCP e source_id)
-            if ccps_para_inserir:
-                cur.execute(
-                    "SELECT ccp, nome FROM extraction_results WHERE source_id = %s AND ccp = ANY(%s)",
-                    (source_id, ccps_para_inserir)
-                )
-                existing_records = cur.fetchall()
-                existing_ccps = {record[0]: record[1] for record in existing_records}
-            else:
-                existing_ccps = {}
-            
-            # Contar registros antes da inserção
-            cur.execute("SELECT COUNT(*) FROM extraction_results WHERE source_id = %s", (source_id,))
-            count_before = cur.fetchone()[0]
-            
-            # Inserir dados usando execute_values para melhor performance
-            extras.execute_values(
-                cur,
-                """
-                INSERT INTO extraction_results (
-                    source_id, ccp, nome, celular, processo, valor_devido, status
-                ) VALUES %s;
-                """,
-                [
+    with db_connection() as conn:
+        if conn is None:
+            return {
+                'success': False,
+                'inserted_count': 0,
+                'duplicates': [],
+                'invalid_records': invalid_records,
+                'total_processed': len(data)
+            }
+
+        try:
+            with conn.cursor() as cur:
+                rows = [
                     (
                         source_id,
                         item.get('CCP'),
@@ -255,56 +518,829 @@ def insert_extraction_data(data, source_id):
                         item.get('PROCESSO(S)'),
                         item.get('VALOR DEVIDO'),
                         item.get('status', 'ativo')
-                    ) for item in valid_data
+                    ) for item in unique_data
                 ]
-            )
-            
-            # Contar registros após a inserção
-            cur.execute("SELECT COUNT(*) FROM extraction_results WHERE source_id = %s", (source_id,))
-            count_after = cur.fetchone()[0]
-            
-            # Calcular quantos foram realmente inseridos
-            inserted_count = count_after - count_before
-            
-            # Identificar registros duplicados com mais detalhes
-            duplicates = []
-            for item in valid_data:
+
+                # Uma única instrução: captura os registros já existentes e faz o upsert
+                with stage('upsert'):
+                    returned = upsert_extraction_rows(cur, rows, on_conflict, bulk)
+
+                inserted_count = 0
+                updated_ccps = set()
+                existing_ccps = {}
+                for ccp, inserted, nome_existente in returned:
+                    if inserted is None:
+                        existing_ccps[ccp] = nome_existente
+                    elif inserted:
+                        inserted_count += 1
+                    else:
+                        updated_ccps.add(ccp)
+
+                sync_devedores_index(cur, source_id, [row[1] for row in rows if row[1]])
+
+                # Atualizar os contadores do source na mesma transação
+                with stage('atualizacao_source'):
+                    cur.execute(
+                        """
+                        UPDATE sources
+                        SET quantidade_itens = COALESCE(quantidade_itens, 0) + %s,
+                            registros_processados = %s,
+                            status = %s,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                        RETURNING quantidade_itens;
+                        """,
+                        (inserted_count, inserted_count, final_status, source_id)
+                    )
+                    source_row = cur.fetchone()
+                total_in_source = source_row[0] if source_row else inserted_count
+
+                with stage('commit'):
+                    conn.commit()
+
+            # Identificar registros duplicados (ignorados) e atualizados com mais detalhes
+            duplicates = list(batch_duplicates)
+            updated = []
+            for item in unique_data:
                 ccp_num = item.get('CCP')
                 if ccp_num and ccp_num in existing_ccps:
-                    duplicates.append({
+                    record = {
                         'ccp': ccp_num,
                         'nome': item.get('CONTRIBUINTE', 'N/A'),
                         'processo': item.get('PROCESSO(S)', 'N/A'),
                         'nome_existente': existing_ccps[ccp_num],
-                        'valor_devido': item.get('VALOR DEVIDO', 0),
-                        'motivo': f'CCP {ccp_num} já existe na lista'
-                    })
-            
-            conn.commit()
-            
+                        'valor_devido': item.get('VALOR DEVIDO', 0)
+                    }
+                    if ccp_num in updated_ccps:
+                        record['motivo'] = f'CCP {ccp_num} já existia na lista e foi atualizado'
+                        updated.append(record)
+                    else:
+                        record['motivo'] = f'CCP {ccp_num} já existe na lista'
+                        duplicates.append(record)
+
             result = {
                 'success': True,
                 'inserted_count': inserted_count,
+                'updated_count': len(updated),
+                'skipped_count': len(duplicates),
                 'duplicates': duplicates,
+                'updated': updated,
                 'invalid_records': invalid_records,
                 'total_processed': len(data),
                 'total_valid': len(valid_data),
-                'total_in_source': count_after
+                'total_in_source': total_in_source
             }
-            
-            print(f"{inserted_count} novos registros inseridos com sucesso! (Total no source: {count_after})")
+
+            print(f"{inserted_count} novos registros inseridos com sucesso! (Total no source: {total_in_source})")
+            if updated:
+                print(f"{len(updated)} registros existentes foram atualizados.")
             if duplicates:
-                print(f"{len(duplicates)} registros duplicados foram atualizados.")
+                print(f"{len(duplicates)} registros duplicados foram ignorados.")
             if invalid_records:
                 print(f"{len(invalid_records)} registros inválidos foram ignorados.")
-                
+
             return result
-            
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Erro na inserção de dados: {error}")
-        conn.rollback()
-        raise error  # Re-raise para que a API possa capturar
-    finally:
-        if conn:
-            conn.close()
 
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro na inserção de dados: {error}")
+            conn.rollback()
+            raise error  # Re-raise para que a API possa capturar
+
+# Modo de atualização incremental (merge): colunas comparadas com a versão já gravada
+MERGE_COMPARED_FIELDS = (
+    ('nome', 'CONTRIBUINTE'),
+    ('celular', 'CELULAR'),
+    ('processo', 'PROCESSO(S)'),
+    ('valor_devido', 'VALOR DEVIDO'),
+)
+# Status dos CCPs que não aparecem mais na lista enviada
+REMOVED_STATUS = 'removido'
+
+def _merge_comparable(value):
+    """Normaliza um valor (do PDF ou do banco) para a comparação do merge"""
+    if value is None:
+        return None
+    if isinstance(value, (float, Decimal)):
+        if value != value:  # NaN
+            return 'NaN'
+        return Decimal(str(value)).normalize()
+    return str(value)
+
+def _merge_json_value(value):
+    """Valor do banco/PDF em formato serializável para os detalhes da resposta"""
+    if isinstance(value, Decimal):
+        return float(value) if value.is_finite() else None
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def jsonb_dumps(value):
+    """
+    Serializa um valor para uma coluna JSONB. NaN/Infinity (valor devido vazio nos
+    detalhes dos warnings) viram null: o JSONB não aceita esses literais.
+    """
+    def sanitize(item):
+        if isinstance(item, dict):
+            return {key: sanitize(val) for key, val in item.items()}
+        if isinstance(item, (list, tuple)):
+            return [sanitize(val) for val in item]
+        return _merge_json_value(item)
+
+    return json.dumps(sanitize(value), allow_nan=False)
+
+def _has_merge_ccp(ccp):
+    """O merge casa os registros pelo CCP: CCP nulo ou em branco não identifica o registro"""
+    return ccp is not None and bool(str(ccp).strip())
+
+def merge_extraction_data(data, source_id, final_status='concluido'):
+    """
+    Atualização incremental de um source: carrega uma única vez os registros já gravados,
+    calcula em memória os CCPs novos, os que tiveram dados alterados (valor devido, celular,
+    processo ou nome) e os que saíram da lista, e grava só essa diferença na mesma transação.
+    CCPs ausentes do arquivo ficam com status 'removido'; se voltarem, retornam para 'ativo'.
+    Registros sem CCP não têm como ser casados com os gravados: vão para 'invalid_records'
+    e ficam fora da diferença (os já gravados sem CCP não são alterados).
+    Retorna o mesmo dicionário de insert_extraction_data, com 'removed', 'removed_count',
+    'unchanged_count' e 'new_ccps'.
+    """
+    if not data or not source_id:
+        print("Nenhum dado para atualizar." if not data else "Source ID é obrigatório.")
+        return {
+            'success': False,
+            'inserted_count': 0,
+            'duplicates': [],
+            'invalid_records': [],
+            'total_processed': len(data or [])
+        }
+
+    valid_data, unique_data, invalid_records, batch_duplicates = _prepare_extraction_batch(data)
+
+    # Sem CCP o registro seria inserido de novo a cada atualização e a cópia anterior marcada como removida
+    for item in valid_data:
+        if not _has_merge_ccp(item.get('CCP')):
+            invalid_records.append({
+                'ccp': 'Vazio',
+                'nome': item.get('CONTRIBUINTE'),
+                'motivo': 'CCP vazio',
+                'processo': item.get('PROCESSO(S)') or 'N/A'
+            })
+            print(f"Registro ignorado no merge por não ter CCP: {item}")
+    valid_data = [item for item in valid_data if _has_merge_ccp(item.get('CCP'))]
+    unique_data = [item for item in unique_data if _has_merge_ccp(item.get('CCP'))]
+
+    if not valid_data:
+        print("Nenhum registro válido para atualizar após filtragem.")
+        return {
+            'success': False,
+            'inserted_count': 0,
+            'duplicates': [],
+            'invalid_records': invalid_records,
+            'total_processed': len(data)
+        }
+
+    with db_connection() as conn:
+        if conn is None:
+            return {
+                'success': False,
+                'inserted_count': 0,
+                'duplicates': [],
+                'invalid_records': invalid_records,
+                'total_processed': len(data)
+            }
+
+        try:
+            with conn.cursor() as cur:
+                with stage('carga_existentes'):
+                    # Trava o source: dois merges simultâneos calculariam diferenças sobre o mesmo estado
+                    cur.execute("SELECT id FROM sources WHERE id = %s FOR UPDATE", (source_id,))
+                    cur.execute(
+                        """
+                        SELECT ccp, nome, celular, processo, valor_devido, status
+                        FROM extraction_results
+                        WHERE source_id = %s AND NULLIF(BTRIM(ccp), '') IS NOT NULL
+                        """,
+                        (source_id,)
+                    )
+                    existing = {row[0]: row for row in cur.fetchall()}
+
+                with stage('diferenca'):
+                    to_insert = []
+                    changed = []
+                    unchanged_count = 0
+                    file_ccps = set()
+                    for item in unique_data:
+                        ccp_num = item.get('CCP')
+                        current = existing.get(ccp_num)
+                        if current is None:
+                            to_insert.append(item)
+                            continue
+
+                        file_ccps.add(ccp_num)
+                        alteracoes = {}
+                        for position, (column, key) in enumerate(MERGE_COMPARED_FIELDS, start=1):
+                            if _merge_comparable(current[position]) != _merge_comparable(item.get(key)):
+                                alteracoes[column] = {
+                                    'anterior': _merge_json_value(current[position]),
+                                    'novo': _merge_json_value(item.get(key))
+                                }
+                        if current[5] == REMOVED_STATUS:
+                            alteracoes['status'] = {'anterior': REMOVED_STATUS, 'novo': 'ativo'}
+
+                        if alteracoes:
+                            changed.append((item, alteracoes))
+                        else:
+                            unchanged_count += 1
+
+                    removed = [
+                        row for ccp_num, row in existing.items()
+                        if ccp_num not in file_ccps and row[5] != REMOVED_STATUS
+                    ]
+
+                with stage('gravacao_diferenca'):
+                    inserted_ccps = []
+                    if to_insert:
+                        returned = extras.execute_values(
+                            cur,
+                            """
+                            INSERT INTO extraction_results (source_id, ccp, nome, celular, processo, valor_devido, status)
+                            VALUES %s
+                            ON CONFLICT (source_id, ccp) DO NOTHING
+                            RETURNING ccp
+                            """,
+                            [
+                                (source_id, item.get('CCP'), item.get('CONTRIBUINTE'), item.get('CELULAR'),
+                                 item.get('PROCESSO(S)'), item.get('VALOR DEVIDO'), item.get('status', 'ativo'))
+                                for item in to_insert
+                            ],
+                            template=EXTRACTION_ROW_TEMPLATE,
+                            fetch=True
+                        )
+                        inserted_ccps = [row[0] for row in returned]
+
+                    if changed:
+                        extras.execute_values(
+                            cur,
+                            f"""
+                            UPDATE extraction_results er
+                            SET nome = d.nome,
+                                celular = d.celular,
+                                processo = d.processo,
+                                valor_devido = d.valor_devido,
+                                status = CASE WHEN er.status = '{REMOVED_STATUS}' THEN 'ativo' ELSE er.status END
+                            FROM (VALUES %s) AS d (source_id, ccp, nome, celular, processo, valor_devido, status)
+                            WHERE er.source_id = d.source_id AND er.ccp = d.ccp
+                            """,
+                            [
+                                (source_id, item.get('CCP'), item.get('CONTRIBUINTE'), item.get('CELULAR'),
+                                 item.get('PROCESSO(S)'), item.get('VALOR DEVIDO'), item.get('status', 'ativo'))
+                                for item, _ in changed
+                            ],
+                            template=EXTRACTION_ROW_TEMPLATE
+                        )
+
+                    if removed:
+                        cur.execute(
+                            "UPDATE extraction_results SET status = %s WHERE source_id = %s AND ccp = ANY(%s)",
+                            (REMOVED_STATUS, source_id, [row[0] for row in removed])
+                        )
+
+                inserted_count = len(inserted_ccps)
+                sync_devedores_index(cur, source_id, [item.get('CCP') for item in unique_data if item.get('CCP')])
+
+                with stage('atualizacao_source'):
+                    cur.execute(
+                        """
+                        UPDATE sources
+                        SET quantidade_itens = COALESCE(quantidade_itens, 0) + %s,
+                            registros_processados = %s,
+                            status = %s,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                        RETURNING quantidade_itens;
+                        """,
+                        (inserted_count, inserted_count + len(changed), final_status, source_id)
+                    )
+                    source_row = cur.fetchone()
+                total_in_source = source_row[0] if source_row else inserted_count
+
+                with stage('commit'):
+                    conn.commit()
+
+            updated = [
+                {
+                    'ccp': item.get('CCP'),
+                    'nome': item.get('CONTRIBUINTE', 'N/A'),
+                    'processo': item.get('PROCESSO(S)', 'N/A'),
+                    'valor_devido': _merge_json_value(item.get('VALOR DEVIDO')),
+                    'alteracoes': alteracoes,
+                    'motivo': f"CCP {item.get('CCP')} teve {', '.join(alteracoes)} alterado(s)"
+                } for item, alteracoes in changed
+            ]
+            removed_details = [
+                {
+                    'ccp': row[0],
+                    'nome': row[1],
+                    'processo': row[3],
+                    'valor_devido': _merge_json_value(row[4]),
+                    'motivo': f'CCP {row[0]} não consta mais na lista'
+                } for row in removed
+            ]
+
+            result = {
+                'success': True,
+                'inserted_count': inserted_count,
+                'updated_count': len(updated),
+                'skipped_count': len(batch_duplicates),
+                'unchanged_count': unchanged_count,
+                'removed_count': len(removed_details),
+                'duplicates': list(batch_duplicates),
+                'updated': updated,
+                'removed': removed_details,
+                'new_ccps': [ccp_num for ccp_num in inserted_ccps if ccp_num],
+                'invalid_records': invalid_records,
+                'total_processed': len(data),
+                'total_valid': len(valid_data),
+                'total_in_source': total_in_source
+            }
+
+            print(f"Merge do source {source_id}: {inserted_count} novos, {len(updated)} alterados, "
+                  f"{len(removed_details)} removidos, {unchanged_count} sem alteração.")
+            if invalid_records:
+                print(f"{len(invalid_records)} registros inválidos foram ignorados.")
+
+            return result
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro no merge de dados: {error}")
+            conn.rollback()
+            raise error  # Re-raise para que a API possa capturar
+
+def create_extraction_job(job_id, source_id, filename, total_paginas=0, is_update=False, pdf_data=None,
+                          on_conflict='nothing', engine=None, include_timings=False, max_paginas=None):
+    """
+    Registra um novo job de extração assíncrona na tabela 'extraction_jobs' (a fila).
+    O PDF (pdf_data) é gravado em 'extraction_job_files' na mesma transação, junto com as
+    opções do upload, para que qualquer instância possa processar o job.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO extraction_jobs (id, source_id, filename, status, is_update, total_paginas,
+                                                 on_conflict, engine, include_timings, max_paginas)
+                    VALUES (%s, %s, %s, 'pendente', %s, %s, %s, %s, %s, %s);
+                    """,
+                    (job_id, source_id, filename, is_update, total_paginas,
+                     on_conflict, engine, include_timings, max_paginas)
+                )
+                if pdf_data is not None:
+                    cur.execute(
+                        "INSERT INTO extraction_job_files (job_id, conteudo) VALUES (%s, %s);",
+                        (job_id, psycopg2.Binary(pdf_data))
+                    )
+                conn.commit()
+                print(f"Job {job_id} criado para o source {source_id}")
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao criar job de extração: {error}")
+            conn.rollback()
+            return False
+
+def update_extraction_job_progress(job_id, paginas_processadas, total_paginas=None):
+    """
+    Atualiza o progresso (páginas processadas) de um job de extração.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_jobs
+                    SET paginas_processadas = %s,
+                        total_paginas = COALESCE(%s, total_paginas),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s;
+                    """,
+                    (paginas_processadas, total_paginas, job_id)
+                )
+                conn.commit()
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao atualizar progresso do job {job_id}: {error}")
+            conn.rollback()
+            return False
+
+def finish_extraction_job(job_id, status, resultado=None, erro=None, worker_id=None):
+    """
+    Finaliza um job de extração com o status final, o resultado (JSON) ou a mensagem de erro,
+    e descarta o PDF guardado para o job. Com worker_id, só finaliza se o job ainda pertencer
+    a esse worker (se o heartbeat expirou, o job já pode estar com outra instância).
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_jobs
+                    SET status = %s,
+                        resultado = %s,
+                        erro = %s,
+                        finished_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND (%s IS NULL OR worker_id = %s);
+                    """,
+                    (status, jsonb_dumps(resultado) if resultado is not None else None, erro, job_id,
+                     worker_id, worker_id)
+                )
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    print(f"Job {job_id} não pertence mais ao worker {worker_id}; resultado descartado")
+                    return False
+                cur.execute("DELETE FROM extraction_job_files WHERE job_id = %s;", (job_id,))
+                conn.commit()
+                print(f"Job {job_id} finalizado com status: {status}")
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao finalizar job {job_id}: {error}")
+            conn.rollback()
+            return False
+
+def claim_extraction_job(worker_id, visibility_timeout, max_attempts):
+    """
+    Reivindica o próximo job da fila para worker_id: um job 'pendente' já disponível ou um
+    job 'processando' cujo heartbeat expirou (visibility_timeout segundos). SKIP LOCKED faz
+    com que instâncias concorrentes nunca peguem o mesmo job. Antes, jobs abandonados que já
+    usaram as max_attempts tentativas são encerrados com erro.
+    Retorna o job reivindicado (dicionário) ou None se a fila estiver vazia.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return None
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_jobs
+                    SET status = 'erro',
+                        erro = 'Job abandonado: o worker parou de responder em todas as tentativas',
+                        finished_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE status = 'processando'
+                      AND COALESCE(heartbeat_at, updated_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                      AND tentativas >= %s
+                    RETURNING id, source_id, is_update;
+                    """,
+                    (visibility_timeout, max_attempts)
+                )
+                abandoned = cur.fetchall()
+                if abandoned:
+                    cur.execute(
+                        "DELETE FROM extraction_job_files WHERE job_id = ANY(%s::uuid[]);",
+                        ([str(job_id) for job_id, _, _ in abandoned],)
+                    )
+                    cur.execute(
+                        "UPDATE sources SET status = 'erro', updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s);",
+                        ([source_id for _, source_id, is_update in abandoned if not is_update],)
+                    )
+                    print(f"{len(abandoned)} job(s) abandonado(s) encerrado(s) com erro")
+
+                cur.execute(
+                    """
+                    WITH proximo AS (
+                        SELECT id
+                        FROM extraction_jobs
+                        WHERE (status = 'pendente' AND disponivel_em <= CURRENT_TIMESTAMP)
+                           OR (status = 'processando'
+                               AND COALESCE(heartbeat_at, updated_at) < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                        ORDER BY disponivel_em, created_at
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE extraction_jobs j
+                    SET status = 'processando',
+                        worker_id = %s,
+                        tentativas = j.tentativas + 1,
+                        heartbeat_at = CURRENT_TIMESTAMP,
+                        started_at = COALESCE(j.started_at, CURRENT_TIMESTAMP),
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM proximo
+                    WHERE j.id = proximo.id
+                    RETURNING j.id, j.source_id, j.filename, j.is_update, j.total_paginas, j.on_conflict,
+                              j.engine, j.include_timings, j.max_paginas, j.tentativas;
+                    """,
+                    (visibility_timeout, worker_id)
+                )
+                row = cur.fetchone()
+                columns = [desc[0] for desc in cur.description]
+                conn.commit()
+                if not row:
+                    return None
+
+                job = dict(zip(columns, row))
+                job['id'] = str(job['id'])
+                return job
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao reivindicar job da fila: {error}")
+            conn.rollback()
+            return None
+
+def heartbeat_extraction_job(job_id, worker_id):
+    """
+    Renova o heartbeat de um job em processamento. Retorna False se o job não pertence
+    mais a worker_id (o heartbeat expirou e outra instância o reivindicou).
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_jobs
+                    SET heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND worker_id = %s AND status = 'processando';
+                    """,
+                    (job_id, worker_id)
+                )
+                conn.commit()
+                return cur.rowcount == 1
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao renovar heartbeat do job {job_id}: {error}")
+            conn.rollback()
+            return False
+
+def retry_extraction_job(job_id, worker_id, erro, delay):
+    """
+    Devolve um job que falhou para a fila, disponível de novo após delay segundos.
+    O PDF continua guardado para a próxima tentativa.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_jobs
+                    SET status = 'pendente',
+                        erro = %s,
+                        worker_id = NULL,
+                        heartbeat_at = NULL,
+                        paginas_processadas = 0,
+                        disponivel_em = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND worker_id = %s;
+                    """,
+                    (erro, delay, job_id, worker_id)
+                )
+                conn.commit()
+                return cur.rowcount == 1
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao devolver o job {job_id} para a fila: {error}")
+            conn.rollback()
+            return False
+
+def release_extraction_job(job_id, worker_id):
+    """
+    Devolve para a fila, sem contar a tentativa, um job que worker_id estava processando
+    quando o processo foi encerrado (reciclagem ou parada do worker do Gunicorn).
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_jobs
+                    SET status = 'pendente',
+                        worker_id = NULL,
+                        heartbeat_at = NULL,
+                        paginas_processadas = 0,
+                        tentativas = GREATEST(tentativas - 1, 0),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND worker_id = %s AND status = 'processando';
+                    """,
+                    (job_id, worker_id)
+                )
+                conn.commit()
+                return cur.rowcount == 1
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao devolver o job {job_id} para a fila: {error}")
+            conn.rollback()
+            return False
+
+def get_extraction_job_file(job_id):
+    """Retorna o conteúdo (bytes) do PDF guardado para o job, ou None se não existir"""
+    with db_connection() as conn:
+        if conn is None:
+            raise psycopg2.OperationalError("Não foi possível conectar ao banco de dados")
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT conteudo FROM extraction_job_files WHERE job_id = %s;", (job_id,))
+            row = cur.fetchone()
+            return bytes(row[0]) if row else None
+
+def get_extraction_job(job_id):
+    """
+    Busca um job de extração pelo ID. Retorna um dicionário ou None se não existir.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            raise psycopg2.OperationalError("Não foi possível conectar ao banco de dados")
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, source_id, filename, status, is_update, total_paginas, paginas_processadas,
+                       resultado, erro, tentativas, worker_id, created_at, started_at, finished_at,
+                       updated_at, heartbeat_at
+                FROM extraction_jobs
+                WHERE id = %s;
+                """,
+                (job_id,)
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+
+            columns = [desc[0] for desc in cur.description]
+            job = dict(zip(columns, row))
+            job['id'] = str(job['id'])
+            for date_field in ['created_at', 'started_at', 'finished_at', 'updated_at', 'heartbeat_at']:
+                if job.get(date_field):
+                    job[date_field] = job[date_field].isoformat()
+            return job
+
+def get_devedor(ccp):
+    """
+    Busca um devedor pelo CCP no índice de devedores, com o histórico de todos os
+    sources em que ele aparece (mais recente primeiro).
+    Retorna um dicionário {'atual': ..., 'historico': [...]} ou None se o CCP não existir.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            raise psycopg2.OperationalError("Não foi possível conectar ao banco de dados")
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT d.ccp, d.nome, d.celular, d.processo, d.valor_devido, er.status,
+                       d.extraction_result_id, d.source_id, s.nome AS source_nome, d.updated_at
+                FROM devedores d
+                JOIN extraction_results er ON er.id = d.extraction_result_id
+                JOIN sources s ON s.id = d.source_id
+                WHERE d.ccp = %s;
+                """,
+                (ccp,)
+            )
+            row = cur.fetchone()
+            atual = dict(zip([desc[0] for desc in cur.description], row)) if row else None
+
+            cur.execute(
+                """
+                SELECT er.id AS extraction_result_id, er.source_id, s.nome AS source_nome, s.data_upload,
+                       er.nome, er.celular, er.processo, er.valor_devido, er.status, er.updated_at
+                FROM extraction_results er
+                JOIN sources s ON s.id = er.source_id
+                WHERE er.ccp = %s
+                ORDER BY er.updated_at DESC, er.id DESC;
+                """,
+                (ccp,)
+            )
+            columns = [desc[0] for desc in cur.description]
+            historico = [dict(zip(columns, item)) for item in cur.fetchall()]
+
+    if not historico:
+        return None
+    if not atual:
+        # Source do registro atual excluído (ON DELETE CASCADE): usa o mais recente restante
+        atual = dict(historico[0], ccp=ccp)
+
+    for record in [atual] + historico:
+        if not record:
+            continue
+        for date_field in ['data_upload', 'updated_at']:
+            if record.get(date_field):
+                record[date_field] = record[date_field].isoformat()
+
+    return {'atual': atual, 'historico': historico}
+
+def get_cached_extraction(sha256, extractor_version):
+    """
+    Busca no cache o resultado da extração de um PDF (pelo SHA-256 do conteúdo).
+    Retorna {'page_count': ..., 'paginas_ignoradas': ..., 'registros': [...]} ou None.
+    Falhas no cache nunca interrompem o upload.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return None
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE extraction_cache
+                    SET hits = hits + 1, last_hit_at = CURRENT_TIMESTAMP
+                    WHERE sha256 = %s AND extractor_version = %s
+                    RETURNING page_count, paginas_ignoradas, registros;
+                    """,
+                    (sha256, extractor_version)
+                )
+                row = cur.fetchone()
+                conn.commit()
+                if not row:
+                    return None
+                return {'page_count': row[0], 'paginas_ignoradas': row[1], 'registros': json.loads(row[2])}
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao consultar o cache de extração: {error}")
+            conn.rollback()
+            return None
+
+def save_cached_extraction(sha256, extractor_version, page_count, registros, paginas_ignoradas=None):
+    """
+    Grava no cache o resultado da extração de um PDF (e quantas páginas a pré-triagem descartou).
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO extraction_cache (sha256, extractor_version, page_count, paginas_ignoradas, registros)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (sha256, extractor_version) DO NOTHING;
+                    """,
+                    (sha256, extractor_version, page_count, paginas_ignoradas, json.dumps(registros))
+                )
+                conn.commit()
+                print(f"Extração armazenada no cache: {sha256[:12]} ({len(registros)} registros)")
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao gravar o cache de extração: {error}")
+            conn.rollback()
+            return False
+
+def source_upload_exists(source_id, sha256, extractor_version):
+    """
+    Verifica se o mesmo arquivo (pelo SHA-256) já foi processado para o source.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT 1 FROM source_uploads
+                    WHERE source_id = %s AND sha256 = %s AND extractor_version = %s;
+                    """,
+                    (source_id, sha256, extractor_version)
+                )
+                return cur.fetchone() is not None
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao consultar uploads do source: {error}")
+            conn.rollback()
+            return False
+
+def record_source_upload(source_id, sha256, extractor_version):
+    """
+    Registra que o arquivo (pelo SHA-256) foi processado para o source.
+    """
+    with db_connection() as conn:
+        if conn is None:
+            return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO source_uploads (source_id, sha256, extractor_version)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT DO NOTHING;
+                    """,
+                    (source_id, sha256, extractor_version)
+                )
+                conn.commit()
+                return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Erro ao registrar upload do source: {error}")
+            conn.rollback()
+            return False
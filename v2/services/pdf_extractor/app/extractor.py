@@ -1,14 +1,88 @@
+import os
+import math
 import fitz  # PyMuPDF
-import pandas as pd
 import json
 import re
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pdf_document import PdfDocument, find_tables_lock
+from layout_templates import (
+    find_layout_template, record_template_hit, extract_rows_with_template
+)
+
+# Extração no pool de processos: com PARALLEL_EXTRACTION, cada documento é extraído em
+# processos 'spawn' (faixas de páginas em paralelo a partir de PARALLEL_EXTRACTION_MIN_PAGES
+# páginas), fora do processo que atende as requisições. Um processo por núcleo por padrão;
+# no Gunicorn os núcleos são divididos entre os workers, veja gunicorn.conf.py
+PARALLEL_EXTRACTION = os.getenv('PARALLEL_EXTRACTION', 'true').lower() in ('1', 'true', 'sim')
+PARALLEL_EXTRACTION_WORKERS = int(os.getenv('PARALLEL_EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.getenv('PARALLEL_EXTRACTION_MIN_PAGES', '4'))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Versão da lógica de extração/limpeza. Alterar sempre que o resultado da extração
+# mudar, para que o cache de extrações (por hash do PDF) não devolva dados antigos
+EXTRACTOR_VERSION = '6'
+
+DEVEDOR_COLUMNS = ['CCP', 'CONTRIBUINTE', 'CELULAR', 'PROCESSO(S)', 'VALOR DEVIDO']
+
+# Backend da limpeza das tabelas: 'python' (listas de table.extract(), sem pandas) ou
+# 'pandas' (table.to_pandas() + limpeza vetorizada). O pandas é opcional e só é
+# importado quando o backend 'pandas' é usado.
+EXTRACTION_BACKEND = os.getenv('EXTRACTION_BACKEND', 'python').lower()
+
+# Motor de leitura das tabelas: 'tables' (find_tables, ou o template de layout quando houver),
+# 'words' (coordenadas das palavras, sem find_tables) ou 'auto' (words quando o template do
+# documento é reconhecido e a conferência por amostragem bate com o caminho de tabelas)
+EXTRACTION_ENGINES = ('auto', 'tables', 'words')
+EXTRACTION_ENGINE = os.getenv('EXTRACTION_ENGINE', 'auto').lower()
+# Páginas conferidas contra o caminho de tabelas antes de usar o motor de palavras
+WORDS_ENGINE_CHECK_PAGES = int(os.getenv('WORDS_ENGINE_CHECK_PAGES', '3'))
+# CCP numérico: início de uma nova linha da tabela no motor de palavras
+CCP_RE = re.compile(r'^\d[\d.\-/]*$')
+
+# Pré-triagem das páginas pela camada de texto: só páginas com o cabeçalho da tabela
+# ou com algum CCP sozinho na linha seguem para a detecção de tabelas. O CCP das listas tem
+# pelo menos 5 dígitos, com pontos de milhar e dígito verificador opcionais (100001, 123.456-7);
+# números de página, anos e datas (3, 2024, 12/2023) não contam
+PAGE_PRESCREEN = os.getenv('PAGE_PRESCREEN', 'true').lower() in ('1', 'true', 'sim')
+PRESCREEN_HEADER_TOKENS = ('CCP', 'CONTRIBUINTE', 'VALOR DEVIDO')
+PRESCREEN_CCP_LINE_RE = re.compile(r'^[ \t]*\d(?:\.?\d){4,}(?:-\d{1,2})?[ \t]*$', re.MULTILINE)
+
+# Expressões pré-compiladas da limpeza vetorizada
+EMPTY_TEXT_VALUES = ('nan', 'none', '')
+WHITESPACE_RE = re.compile(r'\s+')
+CURRENCY_PREFIX_RE = re.compile(r'R\$?\s*')
+DECIMAL_RE = re.compile(r'-?\d+(?:\.\d+)?')
+# Combina os padrões de is_valid_devedor_row em uma única expressão
+INVALID_ROW_RE = re.compile(
+    r'^(?:QUANTIDADE:|TOTAL:|CCP$|CONTRIBUINTE$|\s*$|-+$)|QUANTIDADE:\s*\d+\s*TOTAL:',
+    re.IGNORECASE
+)
+
+def extraction_cache_version(engine=None):
+    """
+    Versão gravada no cache de extrações: a versão do extrator, o motor pedido (engine ou
+    o padrão EXTRACTION_ENGINE) e se a pré-triagem está ligada. Trocar o motor ou a
+    pré-triagem não devolve o resultado extraído com a outra configuração.
+    """
+    prescreen = 'triagem' if PAGE_PRESCREEN else 'completa'
+    return f"{EXTRACTOR_VERSION}:{(engine or EXTRACTION_ENGINE).lower()}:{prescreen}"
+
+def is_missing_value(value):
+    """Equivalente a pd.isna para os valores de uma célula (None ou NaN)"""
+    return value is None or (isinstance(value, float) and math.isnan(value))
 
 def process_contribuinte_data(contribuinte_text):
     """
     Processa o texto da coluna contribuinte para limpar e padronizar.
     Remove quebras de linha e espaços extras.
     """
-    if not contribuinte_text or pd.isna(contribuinte_text):
+    if not contribuinte_text or is_missing_value(contribuinte_text):
         return None
     
     # Normalizar o texto: remover quebras de linha e espaços extras
@@ -22,7 +96,7 @@ def process_valor_devido(valor_text):
     Processa o valor devido convertendo de string para numeric.
     Espera formato brasileiro: R$ 2.572.371,44
     """
-    if not valor_text or pd.isna(valor_text):
+    if not valor_text or is_missing_value(valor_text):
         return None
     
     valor_str = str(valor_text).strip()
@@ -72,50 +146,643 @@ def is_valid_devedor_row(row):
     
     return True
 
-def extract_devedores_from_pdf(pdf_path):
+def normalize_contribuinte_series(contribuintes):
     """
-    Extrai tabelas de devedores de todas as páginas de um arquivo PDF e as converte em uma lista de dicionários.
+    Versão vetorizada de process_contribuinte_data: aplica a limpeza em toda a coluna de uma vez.
     """
-    try:
-        doc = fitz.open(pdf_path)
-    except Exception as e:
-        print(f"Erro ao abrir o arquivo PDF: {e}")
-        return []
+    import pandas as pd
+
+    texts = contribuintes.astype(object)
+    present = ~(texts.isna() | (texts == ''))
+
+    cleaned = pd.Series([None] * len(texts), index=texts.index, dtype=object)
+    cleaned[present] = (
+        texts[present].astype(str)
+        .str.strip()
+        .str.replace(WHITESPACE_RE, ' ', regex=True)
+    )
+    return cleaned
+
+def parse_valor_devido_series(valores):
+    """
+    Versão vetorizada de process_valor_devido para o formato brasileiro (R$ 2.572.371,44).
+    Valores fora do formato numérico simples caem no caminho linha a linha, com o mesmo resultado.
+    """
+    import pandas as pd
+
+    texts = valores.astype(object)
+    present = ~(texts.isna() | (texts == ''))
+
+    normalized = (
+        texts[present].astype(str)
+        .str.strip()
+        .str.replace(CURRENCY_PREFIX_RE, '', regex=True)
+        .str.replace('.', '', regex=False)
+        .str.replace(',', '.', regex=False)
+    )
+    is_decimal = normalized.str.fullmatch(DECIMAL_RE)
+
+    parsed = pd.Series([None] * len(texts), index=texts.index, dtype=object)
+    parsed[normalized.index[is_decimal]] = normalized[is_decimal].astype(float).tolist()
+    fallback = normalized.index[~is_decimal]
+    if len(fallback):
+        parsed[fallback] = [process_valor_devido(texts[idx]) for idx in fallback]
+
+    # Mesma inferência de tipo que o .apply fazia (float64 com NaN para valores ausentes)
+    return pd.Series(parsed.tolist(), index=texts.index)
+
+def valid_devedor_rows_mask(df):
+    """
+    Versão vetorizada de is_valid_devedor_row: retorna uma máscara booleana com as linhas válidas.
+    """
+    ccp = df['CCP'].astype(str).str.strip()
+    contribuinte = df['CONTRIBUINTE'].astype(str).str.strip()
+
+    # Totalizadores, cabeçalhos, linhas vazias ou só com traços
+    invalid = ccp.str.contains(INVALID_ROW_RE) | contribuinte.str.contains(INVALID_ROW_RE)
+
+    # Linhas sem CCP nem CONTRIBUINTE aproveitáveis
+    empty_values = ['nan', 'none', '']
+    missing_any = (
+        ccp.str.lower().isin(empty_values) | contribuinte.str.lower().isin(empty_values)
+    )
+    ccp_ok = (ccp.str.len() > 0) & ~ccp.isin(['nan', 'none'])
+    contribuinte_ok = (contribuinte.str.len() > 0) & ~contribuinte.isin(['nan', 'none'])
+    insufficient = missing_any & ~ccp_ok & ~contribuinte_ok
+
+    filtered = invalid | insufficient
+    if filtered.any():
+        print(f"{int(filtered.sum())} linha(s) filtrada(s) (totalizadores, cabeçalhos ou dados insuficientes).")
+
+    return ~filtered
+
+def clean_devedores_dataframe(df, timings=None):
+    """
+    Limpa e valida uma tabela de devedores em lote e retorna as linhas válidas como dicionários.
+    Equivale a aplicar process_contribuinte_data, process_valor_devido e is_valid_devedor_row linha a linha.
+    Se informado, timings acumula as etapas 'normalizacao' e 'validacao'.
+    """
+    start = time.perf_counter()
+    df = df.copy()
+    df['CONTRIBUINTE'] = normalize_contribuinte_series(df['CONTRIBUINTE'])
+    df['VALOR DEVIDO'] = parse_valor_devido_series(df['VALOR DEVIDO'])
+    add_stage_time(timings, 'normalizacao', start)
+
+    start = time.perf_counter()
+    valid_rows = df[valid_devedor_rows_mask(df)].to_dict('records')
+    add_stage_time(timings, 'validacao', start)
+
+    # Adiciona campos padrão apenas para linhas válidas
+    for row in valid_rows:
+        row['status'] = 'ativo'
+
+    return valid_rows
+
+def normalize_contribuinte_value(value):
+    """Limpeza de uma célula CONTRIBUINTE, igual à de normalize_contribuinte_series"""
+    if value is None or value == '':
+        return None
+    return WHITESPACE_RE.sub(' ', str(value).strip())
+
+def parse_valor_devido_value(value):
+    """Conversão de uma célula VALOR DEVIDO, igual à de parse_valor_devido_series"""
+    if value is None or value == '':
+        return None
+    normalized = CURRENCY_PREFIX_RE.sub('', str(value).strip()).replace('.', '').replace(',', '.')
+    if DECIMAL_RE.fullmatch(normalized):
+        return float(normalized)
+    return process_valor_devido(value)
+
+def is_valid_devedor_values(ccp_value, contribuinte_value):
+    """Mesmas regras de valid_devedor_rows_mask, para uma única linha"""
+    ccp = str(ccp_value).strip()
+    contribuinte = str(contribuinte_value).strip()
+
+    # Totalizadores, cabeçalhos, linhas vazias ou só com traços
+    if INVALID_ROW_RE.search(ccp) or INVALID_ROW_RE.search(contribuinte):
+        return False
+
+    # Linhas sem CCP nem CONTRIBUINTE aproveitáveis
+    missing_any = ccp.lower() in EMPTY_TEXT_VALUES or contribuinte.lower() in EMPTY_TEXT_VALUES
+    ccp_ok = len(ccp) > 0 and ccp not in ('nan', 'none')
+    contribuinte_ok = len(contribuinte) > 0 and contribuinte not in ('nan', 'none')
+    return not (missing_any and not ccp_ok and not contribuinte_ok)
+
+def normalize_devedores_rows(rows):
+    """
+    Backend sem pandas, etapa de limpeza: normaliza CONTRIBUINTE e converte VALOR DEVIDO
+    das linhas de uma tabela (listas de table.extract(), na ordem de DEVEDOR_COLUMNS).
+    Retorna tuplas na mesma ordem.
+    """
+    records = [
+        (ccp, normalize_contribuinte_value(contribuinte), celular, processos, parse_valor_devido_value(valor))
+        for ccp, contribuinte, celular, processos, valor in rows
+    ]
+
+    # Como no pandas, a coluna de valores vira float (ausentes = NaN) se tiver algum número
+    if any(record[4] is not None for record in records):
+        nan = float('nan')
+        records = [record if record[4] is not None else record[:4] + (nan,) for record in records]
+
+    return records
+
+def filter_valid_devedores(records):
+    """
+    Backend sem pandas, etapa de validação: descarta totalizadores, cabeçalhos e linhas
+    sem dados e retorna as linhas válidas como dicionários.
+    """
+    valid_rows = []
+    filtered = 0
+    for ccp, contribuinte, celular, processos, valor in records:
+        if not is_valid_devedor_values(ccp, contribuinte):
+            filtered += 1
+            continue
+        valid_rows.append({
+            'CCP': ccp,
+            'CONTRIBUINTE': contribuinte,
+            'CELULAR': celular,
+            'PROCESSO(S)': processos,
+            'VALOR DEVIDO': valor,
+            'status': 'ativo'
+        })
+
+    if filtered:
+        print(f"{filtered} linha(s) filtrada(s) (totalizadores, cabeçalhos ou dados insuficientes).")
+
+    return valid_rows
+
+def clean_devedores_rows(rows, timings=None):
+    """
+    Backend sem pandas: limpa e valida as linhas de uma tabela e retorna as linhas
+    válidas como dicionários, idênticos aos de clean_devedores_dataframe.
+    Se informado, timings acumula as etapas 'normalizacao' (normalize_devedores_rows)
+    e 'validacao' (filter_valid_devedores).
+    """
+    start = time.perf_counter()
+    records = normalize_devedores_rows(rows)
+    add_stage_time(timings, 'normalizacao', start)
+
+    start = time.perf_counter()
+    valid_rows = filter_valid_devedores(records)
+    add_stage_time(timings, 'validacao', start)
+    return valid_rows
+
+def table_data_rows(table):
+    """
+    Linhas de dados de uma tabela do PyMuPDF como tuplas, sem a linha de cabeçalho
+    quando ela faz parte da tabela (mesmo recorte que table.to_pandas() faz).
+    """
+    column_count = len(table.header.names)
+    if column_count != len(DEVEDOR_COLUMNS):
+        raise ValueError(f"Tabela com {column_count} colunas; esperadas {len(DEVEDOR_COLUMNS)}")
+
+    rows = table.extract()
+    if not table.header.external:
+        rows = rows[1:]
+    return [tuple(row) for row in rows]
+
+def clean_devedores_table(table, timings=None):
+    """
+    Limpa uma tabela encontrada por find_tables() com o backend configurado.
+    Se informado, timings acumula a leitura das células em 'find_tables' e as etapas
+    'normalizacao' e 'validacao'.
+    """
+    if EXTRACTION_BACKEND == 'pandas':
+        # Converte a tabela para um DataFrame do Pandas
+        start = time.perf_counter()
+        df = table.to_pandas()
+        add_stage_time(timings, 'find_tables', start)
+
+        # Renomeia as colunas para facilitar o acesso
+        df.columns = DEVEDOR_COLUMNS
+        return clean_devedores_dataframe(df, timings)
+
+    start = time.perf_counter()
+    rows = table_data_rows(table)
+    add_stage_time(timings, 'find_tables', start)
+    return clean_devedores_rows(rows, timings)
+
+def is_candidate_page(page):
+    """
+    Pré-triagem barata de uma página: True se a camada de texto tem os tokens do
+    cabeçalho (CCP, CONTRIBUINTE, VALOR DEVIDO) ou uma linha só com um número de CCP.
+    Capas, resumos e páginas de assinatura não passam.
+    """
+    text = page.get_text('text')
+    normalized = WHITESPACE_RE.sub(' ', text).upper()
+    if all(token in normalized for token in PRESCREEN_HEADER_TOKENS):
+        return True
+    return PRESCREEN_CCP_LINE_RE.search(text) is not None
+
+def group_word_lines(words):
+    """
+    Agrupa as palavras de get_text('words') em linhas de texto pela altura (centro vertical).
+    Retorna listas de palavras ordenadas da esquerda para a direita, de cima para baixo.
+    """
+    lines = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        center = (word[1] + word[3]) / 2
+        if lines:
+            last = lines[-1]
+            last_center = (last[0][1] + last[0][3]) / 2
+            if abs(center - last_center) <= (last[0][3] - last[0][1]) / 2:
+                last.append(word)
+                continue
+        lines.append([word])
+    return [sorted(line, key=lambda w: w[0]) for line in lines]
+
+def header_column_edges(line):
+    """
+    Bordas internas das colunas a partir de uma linha de cabeçalho (CCP CONTRIBUINTE CELULAR
+    PROCESSO(S) VALOR DEVIDO): o início de cada nome de coluna a partir da segunda.
+    Retorna None se a linha não for o cabeçalho.
+    """
+    first_words = [name.split()[0] for name in DEVEDOR_COLUMNS]
+    texts = [word[4] for word in line]
+    positions = []
+    start = 0
+    for name in first_words:
+        try:
+            index = texts.index(name, start)
+        except ValueError:
+            return None
+        positions.append(line[index][0])
+        start = index + 1
+    return [x - 1 for x in positions[1:]]
+
+def line_cells(line, inner_edges):
+    """Texto de cada coluna em uma linha de palavras, pelas bordas internas das colunas"""
+    cells = [[] for _ in range(len(inner_edges) + 1)]
+    for word in line:
+        center = (word[0] + word[2]) / 2
+        cells[sum(1 for edge in inner_edges if center > edge)].append(word[4])
+    return [' '.join(cell) for cell in cells]
+
+def extract_rows_from_words(page, template=None):
+    """
+    Motor de palavras: reconstrói as linhas da tabela de devedores a partir das coordenadas
+    das palavras, sem find_tables(). As colunas vêm do template de layout ou do cabeçalho
+    da página. Uma nova linha começa quando há CCP ou um espaço vertical maior que meia
+    linha; as demais linhas de texto são continuação (nomes quebrados em várias linhas).
+    Retorna as linhas de dados no formato de table_data_rows, ou None sem cabeçalho na página.
+    """
+    lines = group_word_lines(page.get_text('words'))
+    inner_edges = template['columns'][1:-1] if template else None
+    header = list(DEVEDOR_COLUMNS)
+
+    rows = []
+    header_found = False
+    in_table = False
+    previous_bottom = None
+    for line in lines:
+        top = min(word[1] for word in line)
+        bottom = max(word[3] for word in line)
+        height = bottom - top
+
+        edges = inner_edges or header_column_edges(line)
+        if edges and line_cells(line, edges) == header:
+            # Cabeçalho (inclusive repetido no meio da página): a tabela começa na linha seguinte
+            inner_edges = edges
+            header_found = in_table = True
+            previous_bottom = bottom
+            continue
+        if not in_table:
+            continue
+
+        # Texto muito abaixo da última linha: fim da tabela (rodapé, assinatura etc.)
+        gap = top - previous_bottom
+        if gap > height * 3:
+            in_table = False
+            continue
+
+        cells = line_cells(line, inner_edges)
+        first_word = cells[0].split()[0] if cells[0] else ''
+        if cells[0] and not CCP_RE.match(first_word) and not INVALID_ROW_RE.search(cells[0]):
+            in_table = False
+            continue
+
+        if cells[0] or not rows or gap > height / 2:
+            rows.append([[cell] if cell else [] for cell in cells])
+        else:
+            for col, cell in enumerate(cells):
+                if cell:
+                    rows[-1][col].append(cell)
+        previous_bottom = bottom
+
+    if not header_found:
+        return None
+    return [tuple('\n'.join(cell) for cell in row) for row in rows]
+
+def same_devedores(a, b):
+    """Compara duas listas de devedores (NaN igual a NaN)"""
+    return repr(a) == repr(b)
+
+def words_engine_agrees(doc, template=None, sample_pages=None):
+    """
+    Confere o motor de palavras contra o caminho de tabelas (template ou find_tables)
+    em uma amostra de páginas (primeira, do meio e última por padrão). Páginas em que
+    o caminho de tabelas não encontra nada (ex.: listas sem réguas) não entram na conferência.
+    """
+    total_pages = doc.page_count
+    sample_pages = sample_pages or WORDS_ENGINE_CHECK_PAGES
+    if total_pages <= sample_pages:
+        page_numbers = list(range(total_pages))
+    else:
+        step = (total_pages - 1) / (sample_pages - 1) if sample_pages > 1 else 0
+        page_numbers = sorted({round(i * step) for i in range(sample_pages)})
+
+    for page_num in page_numbers:
+        page = doc[page_num]
+        expected = extract_devedores_from_page(page, page_num, template=template)
+        if not expected:
+            continue
+        rows = extract_rows_from_words(page, template)
+        if rows is None:
+            print(f"Motor de palavras sem cabeçalho na página {page_num + 1}; usando tabelas.")
+            return False
+        if not same_devedores(clean_devedores_rows(rows), expected):
+            print(f"Motor de palavras divergiu do caminho de tabelas na página {page_num + 1}; usando tabelas.")
+            return False
+    return True
+
+def choose_extraction_engine(doc, engine, template):
+    """
+    Resolve o motor do documento ('tables' ou 'words') a partir do pedido ('auto', 'tables'
+    ou 'words'). O motor de palavras só é usado se concordar com o de tabelas na amostra.
+    """
+    if engine not in EXTRACTION_ENGINES:
+        raise ValueError(f"Motor de extração inválido: {engine}")
+    if engine == 'tables' or (engine == 'auto' and not template):
+        return 'tables'
+    return 'words' if words_engine_agrees(doc, template) else 'tables'
+
+def add_stage_time(timings, stage_name, start):
+    """Acumula em timings (se informado) o tempo decorrido desde start"""
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + time.perf_counter() - start
+
+def extract_devedores_from_page(page, page_num, timings=None, template=None, engine='tables', stats=None):
+    """
+    Extrai as linhas válidas de devedores das tabelas de uma única página.
+    Páginas reprovadas na pré-triagem (is_candidate_page) são ignoradas e contadas
+    em stats['paginas_ignoradas'], se informado.
+    Com engine='words', a tabela é reconstruída pelas coordenadas das palavras.
+    Com um template de layout (layout_templates.py), a tabela é lida pela geometria
+    conhecida; se a página não corresponder ao template, usa find_tables().
+    Se informado, timings acumula o tempo das etapas 'palavras', 'tabela_template',
+    'find_tables' (detecção e leitura das células), 'normalizacao', 'validacao' e 'pre_triagem'.
+    """
+    if PAGE_PRESCREEN:
+        start = time.perf_counter()
+        candidate = is_candidate_page(page)
+        add_stage_time(timings, 'pre_triagem', start)
+        if not candidate:
+            print(f"Página {page_num + 1} ignorada na pré-triagem (sem cabeçalho nem CCP).")
+            if stats is not None:
+                stats['paginas_ignoradas'] = stats.get('paginas_ignoradas', 0) + 1
+            return []
+
+    if engine == 'words':
+        start = time.perf_counter()
+        rows = extract_rows_from_words(page, template)
+        add_stage_time(timings, 'palavras', start)
+        if rows is not None:
+            return clean_devedores_rows(rows, timings)
+
+    if template:
+        start = time.perf_counter()
+        rows = extract_rows_with_template(page, template)
+        add_stage_time(timings, 'tabela_template', start)
+        if rows is not None:
+            # Linhas no formato de table.extract(): sempre limpas pelo backend sem pandas
+            return clean_devedores_rows(rows, timings)
 
     all_devedores = []
-    for page_num, page in enumerate(doc):
-        # Encontra todas as tabelas na página
+    # Encontra todas as tabelas na página. A detecção e a leitura das células usam o estado
+    # global do find_tables(), então ficam sob find_tables_lock
+    with find_tables_lock:
+        start = time.perf_counter()
         tables = page.find_tables()
         table_list = list(tables)
+        add_stage_time(timings, 'find_tables', start)
         if table_list:
             print(f"Encontrada(s) {len(table_list)} tabela(s) na página {page_num + 1}.")
             for table in table_list:
-                # Converte a tabela para um DataFrame do Pandas
-                df = table.to_pandas()
-                
-                # Renomeia as colunas para facilitar o acesso
-                df.columns = [
-                    'CCP', 'CONTRIBUINTE', 'CELULAR', 'PROCESSO(S)', 'VALOR DEVIDO'
-                ]
-                
-                # Processa os dados
-                df['CONTRIBUINTE'] = df['CONTRIBUINTE'].apply(process_contribuinte_data)
-                df['VALOR DEVIDO'] = df['VALOR DEVIDO'].apply(process_valor_devido)
-                
-                # Filtra linhas válidas de devedores (remove totalizadores, cabeçalhos, etc.)
-                valid_rows = []
-                for _, row in df.iterrows():
-                    if is_valid_devedor_row(row):
-                        valid_rows.append(row.to_dict())
-                    
-                # Adiciona campos padrão apenas para linhas válidas
-                for row in valid_rows:
-                    row['status'] = 'ativo'
-                
-                # Adiciona apenas linhas válidas à lista principal
-                all_devedores.extend(valid_rows)
+                # Processa os dados e adiciona apenas linhas válidas à lista principal
+                all_devedores.extend(clean_devedores_table(table, timings))
         else:
             print(f"Nenhuma tabela encontrada na página {page_num + 1}.")
-            
+
+    return all_devedores
+
+def open_pdf_source(pdf_source):
+    """Abre o PDF a partir de um caminho ou dos bytes do arquivo"""
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return fitz.open(stream=pdf_source, filetype='pdf')
+    return fitz.open(pdf_source)
+
+def extract_devedores_from_page_range(pdf_source, start_page, end_page, template=None, engine='tables'):
+    """
+    Extrai os devedores das páginas [start_page, end_page) abrindo o documento no próprio processo.
+    Usada pelos workers da extração paralela.
+    Retorna (start_page, linhas, tempos por etapa, contadores de páginas).
+    """
+    doc = open_pdf_source(pdf_source)
+    try:
+        devedores = []
+        timings = {}
+        stats = {}
+        for page_num in range(start_page, end_page):
+            devedores.extend(extract_devedores_from_page(doc[page_num], page_num, timings, template, engine, stats))
+        return start_page, devedores, timings, stats
+    finally:
+        doc.close()
+
+def get_process_pool():
+    """Retorna o pool de processos da extração paralela, criando-o na primeira chamada"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # 'spawn' evita herdar locks de threads do servidor web no fork
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+def discard_process_pool(pool):
+    """
+    Descarta o pool de processos quebrado (um worker morreu: segfault do PyMuPDF em um PDF
+    malformado, OOM kill). A próxima extração paralela cria um pool novo.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_process_pool():
+    """
+    Encerra o pool de processos no fim do worker do Gunicorn, interrompendo as extrações em
+    andamento (os jobs da fila já foram devolvidos), para que nenhum processo do PyMuPDF
+    fique órfão extraindo páginas depois que o worker sai.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is None:
+        return
+    # O ProcessPoolExecutor não interrompe tarefas em andamento: os processos são encerrados aqui
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def split_page_ranges(total_pages, workers):
+    """
+    Divide as páginas em faixas contíguas. Usa duas faixas por worker para
+    equilibrar a carga e reportar o progresso com mais frequência.
+    """
+    chunks = max(1, min(total_pages, workers * 2))
+    chunk_size = -(-total_pages // chunks)  # divisão com arredondamento para cima
+    return [(start, min(start + chunk_size, total_pages)) for start in range(0, total_pages, chunk_size)]
+
+def resolve_document_extraction(doc, engine, timings=None):
+    """
+    Template de layout e motor de leitura do documento (veja choose_extraction_engine).
+    O uso (hit) de um template conhecido não é contado aqui, e sim pelo processo que pediu
+    a extração: os hits pendentes de um worker ocioso do pool não chegariam ao arquivo.
+    Se informado, timings acumula 'template_layout' e 'escolha_motor'.
+    Retorna (template, motor, True se o template já era conhecido).
+    """
+    # Geometria da tabela detectada uma vez (ou reaproveitada de outro PDF do mesmo layout)
+    start = time.perf_counter()
+    template, learned = find_layout_template(doc, len(DEVEDOR_COLUMNS), is_candidate_page if PAGE_PRESCREEN else None)
+    add_stage_time(timings, 'template_layout', start)
+
+    start = time.perf_counter()
+    engine = choose_extraction_engine(doc, (engine or EXTRACTION_ENGINE).lower(), template)
+    add_stage_time(timings, 'escolha_motor', start)
+    return template, engine, bool(template and not learned)
+
+def resolve_document_extraction_from_source(pdf_source, engine):
+    """
+    resolve_document_extraction nos workers do pool, abrindo o documento no próprio processo.
+    Retorna (template, motor, template conhecido, tempos por etapa).
+    """
+    doc = open_pdf_source(pdf_source)
+    try:
+        timings = {}
+        return resolve_document_extraction(doc, engine, timings) + (timings,)
+    finally:
+        doc.close()
+
+def extract_devedores_parallel(pdf_source, total_pages, progress_callback=None, timings=None, engine=None,
+                               stats=None):
+    """
+    Extrai os devedores no pool de processos: o template e o motor são resolvidos em um worker
+    e as páginas são distribuídas em faixas (uma só faixa abaixo de PARALLEL_EXTRACTION_MIN_PAGES).
+    Nenhuma página é lida no processo que chamou, que segue livre para atender requisições.
+    As linhas são reunidas na ordem das páginas, como na extração sequencial.
+    Os tempos por etapa e os contadores de páginas somam o trabalho de todos os processos.
+    Se o pool estiver quebrado, ele é descartado e BrokenProcessPool é relançada sem
+    alterar timings/stats, para que o documento possa ser extraído sequencialmente.
+    """
+    if total_pages >= PARALLEL_EXTRACTION_MIN_PAGES:
+        page_ranges = split_page_ranges(total_pages, PARALLEL_EXTRACTION_WORKERS)
+    else:
+        page_ranges = [(0, total_pages)]
+    print(f"Extração no pool: {total_pages} páginas em {len(page_ranges)} faixas ({PARALLEL_EXTRACTION_WORKERS} processos).")
+
+    pool = get_process_pool()
+    results = {}
+    range_results = []
+    pages_done = 0
+    try:
+        template, engine, template_hit, resolve_timings = pool.submit(
+            resolve_document_extraction_from_source, pdf_source, engine
+        ).result()
+        range_results.append((resolve_timings, {}))
+        print(f"Motor de extração: {engine}")
+
+        futures = {
+            pool.submit(extract_devedores_from_page_range, pdf_source, start, end, template, engine): (start, end)
+            for start, end in page_ranges
+        }
+        for future in as_completed(futures):
+            start, end = futures[future]
+            _, results[start], range_timings, range_stats = future.result()
+            range_results.append((range_timings, range_stats))
+            pages_done += end - start
+            if progress_callback:
+                progress_callback(pages_done, total_pages)
+    except BrokenProcessPool:
+        discard_process_pool(pool)
+        raise
+
+    if template_hit:
+        record_template_hit(template)
+    for range_timings, range_stats in range_results:
+        if timings is not None:
+            for stage_name, seconds in range_timings.items():
+                timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+        if stats is not None:
+            for name, count in range_stats.items():
+                stats[name] = stats.get(name, 0) + count
+
+    all_devedores = []
+    for start, _ in page_ranges:
+        all_devedores.extend(results[start])
+    return all_devedores
+
+def extract_devedores_from_document(pdf, progress_callback=None, parallel=None, timings=None, engine=None,
+                                    stats=None):
+    """
+    Extrai tabelas de devedores de todas as páginas de um PDF já aberto (PdfDocument)
+    e as converte em uma lista de dicionários. O documento não é fechado aqui.
+    Se informado, progress_callback(paginas_processadas, total_paginas) é chamado ao fim de cada
+    página (de cada faixa de páginas no pool).
+    Com parallel=None, a extração roda no pool de processos (extract_devedores_parallel) sempre
+    que PARALLEL_EXTRACTION está habilitada; com parallel=False, roda neste processo.
+    engine escolhe o motor de leitura das tabelas (EXTRACTION_ENGINES; padrão EXTRACTION_ENGINE).
+    Se informado, timings acumula o tempo de cada etapa ('template_layout', 'escolha_motor',
+    'palavras', 'tabela_template', 'find_tables', 'normalizacao', 'validacao', 'pre_triagem').
+    Se informado, stats recebe 'paginas_ignoradas' (páginas descartadas na pré-triagem).
+    """
+    total_pages = pdf.page_count
+
+    if parallel is None:
+        parallel = PARALLEL_EXTRACTION
+
+    if parallel and total_pages > 0:
+        try:
+            return extract_devedores_parallel(pdf.source, total_pages, progress_callback, timings, engine, stats)
+        except BrokenProcessPool as e:
+            print(f"Pool de processos quebrado ({e}); extraindo o documento sequencialmente.")
+
+    template, engine, template_hit = resolve_document_extraction(pdf.doc, engine, timings)
+    if template_hit:
+        record_template_hit(template)
+    print(f"Motor de extração: {engine}")
+
+    all_devedores = []
+    for page_num, page in enumerate(pdf.doc):
+        all_devedores.extend(extract_devedores_from_page(page, page_num, timings, template, engine, stats))
+
+        if progress_callback:
+            progress_callback(page_num + 1, total_pages)
+
     return all_devedores
 
+def extract_devedores_from_pdf(pdf_path, progress_callback=None, parallel=None):
+    """
+    Extrai tabelas de devedores de todas as páginas de um arquivo PDF e as converte em uma lista de dicionários.
+    Abre o arquivo e delega para extract_devedores_from_document.
+    """
+    try:
+        pdf = PdfDocument.from_path(pdf_path)
+    except Exception as e:
+        print(f"Erro ao abrir o arquivo PDF: {e}")
+        return []
+
+    with pdf:
+        return extract_devedores_from_document(pdf, progress_callback, parallel)
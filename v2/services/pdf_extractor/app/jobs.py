@@ -0,0 +1,496 @@
+import os
+import time
+import socket
+import threading
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from database import (
+    create_source, insert_extraction_data, merge_extraction_data, update_source_status,
+    update_extraction_job_progress, finish_extraction_job, claim_extraction_job, heartbeat_extraction_job,
+    retry_extraction_job, release_extraction_job, get_extraction_job_file, get_cached_extraction, save_cached_extraction,
+    record_source_upload
+)
+from metrics import (
+    stage, observe_stage, collect_timings, rounded_timings, observe_insert_result, PAGES_PROCESSED, PAGES_SKIPPED
+)
+
+logger = logging.getLogger(__name__)
+
+# O extractor (PyMuPDF) é importado só dentro das funções que extraem: iniciar os workers
+# da fila no boot do worker do Gunicorn não carrega o PyMuPDF antes do primeiro job
+
+# Quantidade de extrações executadas em paralelo em segundo plano (por processo).
+# Os jobs ficam na fila durável do Postgres (extraction_jobs): qualquer instância com
+# EXTRACTION_WORKERS > 0 processa os jobs pendentes, não só a que recebeu o upload.
+# Com 0, a instância apenas enfileira. As threads são iniciadas por start_queue_workers()
+# no worker do Gunicorn (post_worker_init) ou no servidor de desenvolvimento, nunca ao criar o app.
+# As threads só coordenam os jobs (banco, heartbeat, progresso): as páginas são extraídas no pool
+# de processos (PARALLEL_EXTRACTION em extractor.py) e, sem o pool, o find_tables() das extrações
+# simultâneas é serializado por find_tables_lock.
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '2'))
+# Arquivos de um mesmo lote (/upload/batch) processados ao mesmo tempo
+BATCH_UPLOAD_WORKERS = int(os.getenv('BATCH_UPLOAD_WORKERS', '2'))
+
+# Intervalo (s) entre consultas à fila quando ela está vazia
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+# Intervalo (s) entre heartbeats de um job em processamento
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '10'))
+# Sem heartbeat por esse tempo (s), o job é considerado abandonado e volta para a fila
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '60'))
+# Tentativas por job (falhas e abandonos) e espera (s) antes de cada nova tentativa
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', '30'))
+
+_queue_threads = []
+_queue_lock = threading.Lock()
+# Acorda os workers locais quando um job é enfileirado nesta instância
+_queue_wakeup = threading.Event()
+_queue_stop = threading.Event()
+# Jobs em andamento neste processo: {job_id: worker_id}
+_running_jobs = {}
+_running_lock = threading.Lock()
+
+def load_or_extract_devedores(pdf, progress_callback=None, engine=None, stats=None, parallel=None):
+    """
+    Retorna os devedores do PDF (PdfDocument já aberto), consultando antes o cache
+    de extrações pelo SHA-256 do arquivo e por extraction_cache_version(engine). Em caso de
+    cache miss, extrai do documento aberto (com o motor engine) e grava o resultado no cache.
+    parallel segue a regra de extract_devedores_from_document.
+    Retorna (devedores_data, cache_hit).
+    Se informado, stats recebe 'paginas_ignoradas' (páginas descartadas na pré-triagem).
+    """
+    from extractor import extract_devedores_from_document, extraction_cache_version
+
+    cache_version = extraction_cache_version(engine)
+    with stage('consulta_cache'):
+        cached = get_cached_extraction(pdf.sha256, cache_version)
+    if cached is not None:
+        logger.info(f"Extração encontrada no cache ({pdf.sha256[:12]}): {len(cached['registros'])} registros")
+        if progress_callback:
+            progress_callback(pdf.page_count, pdf.page_count)
+        if stats is not None:
+            stats['paginas_ignoradas'] = cached['paginas_ignoradas']
+        return cached['registros'], True
+
+    extraction_timings = {}
+    extraction_stats = {'paginas_ignoradas': 0}
+    with stage('extracao'):
+        devedores_data = extract_devedores_from_document(
+            pdf, progress_callback=progress_callback, parallel=parallel, timings=extraction_timings,
+            engine=engine, stats=extraction_stats
+        )
+    for stage_name, seconds in extraction_timings.items():
+        observe_stage(stage_name, seconds)
+    PAGES_PROCESSED.observe(pdf.page_count)
+    PAGES_SKIPPED.observe(extraction_stats['paginas_ignoradas'])
+    if stats is not None:
+        stats.update(extraction_stats)
+
+    # Extrações vazias não vão para o cache: o arquivo provavelmente não é uma lista válida
+    if devedores_data:
+        with stage('gravacao_cache'):
+            save_cached_extraction(
+                pdf.sha256, cache_version, pdf.page_count, devedores_data, extraction_stats['paginas_ignoradas']
+            )
+
+    return devedores_data, False
+
+def already_processed_payload(source_id, filename, page_count=None, max_pages=None):
+    """Resposta para o reenvio de um arquivo que já foi aplicado ao source"""
+    return {
+        'status': 'success',
+        'message': 'Lista processada. Nenhum registro novo foi adicionado (este arquivo já havia sido processado nesta lista).',
+        'extracted_count': 0,
+        'registros_inseridos': 0,
+        'registros_atualizados': 0,
+        'registros_ignorados': 0,
+        'warnings': [],
+        'filename': filename,
+        'source_id': source_id,
+        'page_count': page_count,
+        'max_pages_allowed': max_pages,
+        'is_update': True,
+        'cache_hit': True,
+        'already_processed': True
+    }
+
+def persist_extraction_results(devedores_data, source_id, filename, page_count, max_pages, is_update,
+                               on_conflict='nothing', file_hash=None, cache_hit=False, skipped_pages=None):
+    """
+    Insere os devedores extraídos no banco (os contadores do source são atualizados
+    na mesma transação) e monta a resposta da API. Retorna (payload, http_status).
+    skipped_pages é a quantidade de páginas descartadas na pré-triagem.
+    """
+    logger.info("Inserindo dados no banco de dados...")
+    with stage('insercao_banco'):
+        if on_conflict == 'merge':
+            insert_result = merge_extraction_data(devedores_data, source_id)
+        else:
+            insert_result = insert_extraction_data(devedores_data, source_id, on_conflict=on_conflict)
+
+    if not insert_result['success']:
+        return {
+            'status': 'error',
+            'message': 'Erro ao inserir dados no banco'
+        }, 500
+
+    observe_insert_result(insert_result)
+
+    # Registrar o arquivo no source, para que reenvios idênticos não sejam reprocessados
+    if file_hash:
+        from extractor import EXTRACTOR_VERSION
+        record_source_upload(source_id, file_hash, EXTRACTOR_VERSION)
+
+    # Preparar mensagem de resposta
+    response_message = 'PDF processado com sucesso'
+    registros_inseridos = insert_result['inserted_count']
+    registros_atualizados = insert_result['updated_count']
+
+    if on_conflict == 'merge' and is_update:
+        response_message = (
+            f'Lista atualizada com sucesso! {registros_inseridos} novos CCPs, '
+            f'{registros_atualizados} débitos alterados e {insert_result["removed_count"]} CCPs removidos.'
+        )
+    elif is_update:
+        if registros_inseridos > 0:
+            response_message = f'Lista atualizada com sucesso! {registros_inseridos} novos registros adicionados.'
+        elif registros_atualizados > 0:
+            response_message = f'Lista atualizada com sucesso! {registros_atualizados} registros existentes foram atualizados.'
+        else:
+            response_message = 'Lista processada. Nenhum registro novo foi adicionado (todos os registros já existiam).'
+
+    # Preparar informações sobre duplicatas e registros inválidos
+    warnings = []
+    if insert_result['duplicates']:
+        warnings.append({
+            'type': 'duplicates',
+            'count': len(insert_result['duplicates']),
+            'message': f'{len(insert_result["duplicates"])} registros já existiam na lista e foram ignorados',
+            'details': insert_result['duplicates']
+        })
+
+    if insert_result['updated']:
+        warnings.append({
+            'type': 'updated',
+            'count': len(insert_result['updated']),
+            'message': f'{len(insert_result["updated"])} registros já existiam na lista e foram atualizados',
+            'details': insert_result['updated']
+        })
+
+    if insert_result.get('removed'):
+        warnings.append({
+            'type': 'removed',
+            'count': len(insert_result['removed']),
+            'message': f'{len(insert_result["removed"])} registros não constam mais na lista e foram marcados como removidos',
+            'details': insert_result['removed']
+        })
+
+    if insert_result['invalid_records']:
+        warnings.append({
+            'type': 'invalid',
+            'count': len(insert_result['invalid_records']),
+            'message': f'{len(insert_result["invalid_records"])} registros eram inválidos e foram ignorados',
+            'details': insert_result['invalid_records']
+        })
+
+    payload = {
+        'status': 'success',
+        'message': response_message,
+        'extracted_count': len(devedores_data),
+        'registros_inseridos': registros_inseridos,
+        'registros_atualizados': registros_atualizados,
+        'registros_ignorados': insert_result['skipped_count'],
+        'total_registros_fonte': insert_result['total_in_source'],
+        'warnings': warnings,
+        'filename': filename,
+        'source_id': source_id,
+        'page_count': page_count,
+        'paginas_ignoradas': skipped_pages,
+        'max_pages_allowed': max_pages,
+        'is_update': is_update,
+        'cache_hit': cache_hit
+    }
+    if on_conflict == 'merge':
+        payload['registros_removidos'] = insert_result['removed_count']
+        payload['registros_inalterados'] = insert_result['unchanged_count']
+        payload['novos_ccps'] = insert_result['new_ccps']
+    return payload, 200
+
+def run_extraction_job(job_id, pdf, filename, source_id, max_pages, is_update, on_conflict='nothing',
+                       include_timings=False, engine=None, attempt=1, worker_id=None):
+    """
+    Executa a extração e a inserção de um PDF em segundo plano, registrando
+    o progresso por página e o resultado final em 'extraction_jobs'.
+    O job assume o PdfDocument recebido e o fecha ao final.
+    Com include_timings, o resultado inclui o tempo de cada etapa.
+    Falhas devolvem o job para a fila até JOB_MAX_ATTEMPTS tentativas.
+    """
+    page_count = pdf.page_count
+    logger.info(f"Job {job_id}: iniciando extração de {filename} (source {source_id}, tentativa {attempt})")
+
+    def on_page_done(paginas_processadas, total_paginas):
+        update_extraction_job_progress(job_id, paginas_processadas, total_paginas)
+
+    def fail(erro, resultado=None):
+        if attempt < JOB_MAX_ATTEMPTS and retry_extraction_job(job_id, worker_id, erro, JOB_RETRY_DELAY * attempt):
+            logger.warning(f"Job {job_id}: {erro}. Nova tentativa em {JOB_RETRY_DELAY * attempt}s")
+            return
+        if finish_extraction_job(job_id, 'erro', resultado=resultado, erro=erro, worker_id=worker_id) and not is_update:
+            update_source_status(source_id, 'erro')
+
+    with collect_timings() as timings:
+        try:
+            extraction_stats = {}
+            devedores_data, cache_hit = load_or_extract_devedores(
+                pdf, progress_callback=on_page_done, engine=engine, stats=extraction_stats
+            )
+
+            if not devedores_data:
+                logger.warning(f"Job {job_id}: nenhum dado encontrado no PDF")
+                finished = finish_extraction_job(job_id, 'concluido', resultado={
+                    'status': 'warning',
+                    'message': 'Nenhum dado foi encontrado no PDF',
+                    'extracted_count': 0,
+                    'source_id': source_id,
+                    'page_count': page_count,
+                    'paginas_ignoradas': extraction_stats.get('paginas_ignoradas')
+                }, worker_id=worker_id)
+                if finished and not is_update:
+                    update_source_status(source_id, 'erro')
+                return
+
+            logger.info(f"Job {job_id}: extração concluída. {len(devedores_data)} registros encontrados")
+            payload, http_status = persist_extraction_results(
+                devedores_data, source_id, filename, page_count, max_pages, is_update, on_conflict,
+                file_hash=pdf.sha256, cache_hit=cache_hit, skipped_pages=extraction_stats.get('paginas_ignoradas')
+            )
+
+            if http_status != 200:
+                fail(payload.get('message'), resultado=payload)
+                return
+
+            if include_timings:
+                payload['timings'] = rounded_timings(timings)
+            finish_extraction_job(job_id, 'concluido', resultado=payload, worker_id=worker_id)
+
+        except Exception as e:
+            logger.error(f"Job {job_id}: erro no processamento: {str(e)}")
+            fail(f'Erro ao processar PDF: {str(e)}')
+
+        finally:
+            # Fecha o documento (e remove o arquivo temporário, se o upload foi para o disco)
+            pdf.close()
+
+def heartbeat_loop(job_id, worker_id, done):
+    """Renova o heartbeat do job a cada JOB_HEARTBEAT_INTERVAL até done ser sinalizado"""
+    while not done.wait(JOB_HEARTBEAT_INTERVAL):
+        if not heartbeat_extraction_job(job_id, worker_id):
+            logger.warning(f"Job {job_id}: heartbeat recusado; o job pode ter sido reivindicado por outra instância")
+            return
+
+def process_claimed_job(job, worker_id):
+    """
+    Processa um job reivindicado da fila: lê o PDF guardado no banco e executa a extração
+    com um heartbeat em paralelo, para que o job não volte para a fila enquanto está em andamento.
+    """
+    from pdf_document import PdfDocument
+
+    job_id = job['id']
+    try:
+        data = get_extraction_job_file(job_id)
+        if data is None:
+            raise ValueError('PDF do job não encontrado')
+        pdf = PdfDocument(data, filename=job['filename'])
+    except Exception as e:
+        logger.error(f"Job {job_id}: não foi possível abrir o PDF: {str(e)}")
+        if finish_extraction_job(job_id, 'erro', erro=f'Erro ao abrir PDF: {str(e)}', worker_id=worker_id) \
+                and not job['is_update']:
+            update_source_status(job['source_id'], 'erro')
+        return
+
+    done = threading.Event()
+    heartbeat = threading.Thread(
+        target=heartbeat_loop, args=(job_id, worker_id, done), name=f'heartbeat-{job_id[:8]}', daemon=True
+    )
+    heartbeat.start()
+    try:
+        run_extraction_job(
+            job_id, pdf, job['filename'], job['source_id'], job['max_paginas'], job['is_update'],
+            job['on_conflict'] or 'nothing', job['include_timings'], job['engine'], job['tentativas'], worker_id
+        )
+    finally:
+        done.set()
+        heartbeat.join()
+
+def queue_worker_loop(worker_id):
+    """Reivindica e processa jobs da fila até stop_queue_workers()"""
+    logger.info(f"Worker da fila iniciado: {worker_id}")
+    while not _queue_stop.is_set():
+        job = claim_extraction_job(worker_id, JOB_VISIBILITY_TIMEOUT, JOB_MAX_ATTEMPTS)
+        if job is None:
+            _queue_wakeup.wait(JOB_POLL_INTERVAL)
+            _queue_wakeup.clear()
+            continue
+        with _running_lock:
+            _running_jobs[job['id']] = worker_id
+        try:
+            process_claimed_job(job, worker_id)
+        except Exception as e:
+            logger.error(f"Job {job['id']}: erro inesperado no worker: {str(e)}")
+        finally:
+            with _running_lock:
+                _running_jobs.pop(job['id'], None)
+
+def start_queue_workers():
+    """Inicia EXTRACTION_WORKERS threads consumindo a fila (uma vez por processo)"""
+    with _queue_lock:
+        if _queue_threads or EXTRACTION_WORKERS <= 0:
+            return
+        _queue_stop.clear()
+        instance = f"{socket.gethostname()}:{os.getpid()}"
+        for index in range(EXTRACTION_WORKERS):
+            thread = threading.Thread(
+                target=queue_worker_loop, args=(f"{instance}:{index}",), name=f'extraction-{index}', daemon=True
+            )
+            thread.start()
+            _queue_threads.append(thread)
+
+def stop_queue_workers(timeout=None):
+    """
+    Para de reivindicar jobs e espera até timeout segundos (no total) os que estão em
+    andamento. Os que não terminarem voltam para a fila sem contar a tentativa, e o
+    resultado que ainda produzirem aqui é descartado (finish_extraction_job confere o worker).
+    """
+    _queue_stop.set()
+    _queue_wakeup.set()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _queue_lock:
+        for thread in _queue_threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        _queue_threads.clear()
+
+    with _running_lock:
+        running = dict(_running_jobs)
+    for job_id, worker_id in running.items():
+        if release_extraction_job(job_id, worker_id):
+            logger.info(f"Job {job_id}: devolvido para a fila no encerramento do worker")
+
+def notify_queue_workers():
+    """Acorda os workers locais após enfileirar um job, sem esperar o próximo poll"""
+    _queue_wakeup.set()
+
+def process_batch_file(open_pdf, filename, max_pages, source_id=None, on_conflict='nothing', engine=None):
+    """
+    Processa um arquivo de um lote: abre o PDF (open_pdf() retorna um PdfDocument), valida o
+    limite de páginas, extrai e insere. Sem source_id, cria um source só para o arquivo.
+    Retorna o resultado do arquivo (payload de persist_extraction_results); erros viram
+    um resultado com status 'error', sem interromper os demais arquivos.
+    """
+    from pdf_document import PdfPageLimitError
+
+    pdf = None
+    try:
+        pdf = open_pdf()
+        page_count = pdf.check_page_limit(max_pages)
+
+        extraction_stats = {}
+        # A extração vai para o pool de processos: as threads do lote não disputam o GIL nem o find_tables()
+        devedores_data, cache_hit = load_or_extract_devedores(
+            pdf, engine=engine, stats=extraction_stats, parallel=True
+        )
+        if not devedores_data:
+            return {
+                'status': 'warning',
+                'message': 'Nenhum dado foi encontrado no PDF',
+                'filename': filename,
+                'extracted_count': 0,
+                'page_count': page_count,
+                'paginas_ignoradas': extraction_stats.get('paginas_ignoradas')
+            }
+
+        is_update = source_id is not None
+        if not is_update:
+            # quantidade_itens é incrementada por insert_extraction_data
+            source_id = create_source(filename, 0, 0, 'processando')
+            if not source_id:
+                return {'status': 'error', 'message': 'Erro ao criar registro do source', 'filename': filename}
+
+        payload, http_status = persist_extraction_results(
+            devedores_data, source_id, filename, page_count, max_pages, is_update, on_conflict,
+            file_hash=pdf.sha256, cache_hit=cache_hit, skipped_pages=extraction_stats.get('paginas_ignoradas')
+        )
+        if http_status != 200:
+            if not is_update:
+                update_source_status(source_id, 'erro')
+            payload['filename'] = filename
+        return payload
+
+    except PdfPageLimitError as e:
+        return {
+            'status': 'error',
+            'message': str(e),
+            'filename': filename,
+            'page_count': e.page_count,
+            'max_pages_allowed': max_pages
+        }
+    except Exception as e:
+        logger.error(f"Lote: erro ao processar {filename}: {str(e)}")
+        return {'status': 'error', 'message': f'Erro ao processar PDF: {str(e)}', 'filename': filename}
+    finally:
+        if pdf:
+            pdf.close()
+
+def process_batch(items, max_pages, source_id=None, on_conflict='nothing', engine=None, workers=None):
+    """
+    Processa os arquivos de um lote ao mesmo tempo, com até workers (BATCH_UPLOAD_WORKERS)
+    arquivos em andamento. items é uma lista de (filename, open_pdf). As threads só abrem os
+    arquivos e gravam os resultados; as páginas de cada arquivo são extraídas no pool de
+    processos da extração paralela.
+    Retorna os resultados na ordem dos arquivos. Cada arquivo roda com uma cópia do
+    contexto da requisição, para que os tempos das etapas entrem em ?timings=1.
+    """
+    workers = max(1, min(workers or BATCH_UPLOAD_WORKERS, len(items)))
+    logger.info(f"Lote: {len(items)} arquivo(s), {workers} em paralelo")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                process_batch_file, open_pdf, filename, max_pages, source_id, on_conflict, engine
+            )
+            for filename, open_pdf in items
+        ]
+        return [future.result() for future in futures]
+
+def batch_report(results, source_id=None):
+    """Relatório consolidado de um lote: totais e o resultado de cada arquivo"""
+    succeeded = [r for r in results if r['status'] == 'success']
+    failed = [r for r in results if r['status'] == 'error']
+
+    if len(failed) == len(results):
+        status = 'error'
+    elif failed:
+        status = 'partial'
+    else:
+        status = 'success'
+
+    def total(key):
+        return sum(r.get(key) or 0 for r in results)
+
+    return {
+        'status': status,
+        'message': f'{len(succeeded)} de {len(results)} arquivo(s) processado(s) com sucesso',
+        'arquivos': len(results),
+        'arquivos_processados': len(succeeded),
+        'arquivos_sem_dados': sum(1 for r in results if r['status'] == 'warning'),
+        'arquivos_com_erro': len(failed),
+        'extracted_count': total('extracted_count'),
+        'registros_inseridos': total('registros_inseridos'),
+        'registros_atualizados': total('registros_atualizados'),
+        'registros_ignorados': total('registros_ignorados'),
+        'page_count': total('page_count'),
+        'paginas_ignoradas': total('paginas_ignoradas'),
+        'source_id': source_id,
+        'source_ids': [r['source_id'] for r in succeeded] if source_id is None else [source_id],
+        'resultados': results
+    }
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from pdf_document import find_tables_lock
+
+# Templates de layout das tabelas de devedores.
+# As listas da prefeitura repetem a mesma tabela de cinco colunas em todas as páginas, então a
+# geometria (colunas e cabeçalho) é detectada uma vez com find_tables() e reaproveitada: nas
+# páginas seguintes as linhas vêm das réguas horizontais da página (get_drawings) e o texto
+# das palavras (get_text('words')) distribuídas nas células, sem a detecção completa.
+# Os templates ficam em um arquivo JSON (chave: produtor do PDF + texto do cabeçalho),
+# compartilhado entre os workers e consultável em GET /layout_templates. As alterações
+# são feitas sob um lock de arquivo (fcntl), relendo o arquivo antes de gravar, e cada
+# processo relê o arquivo quando outro o altera.
+
+LAYOUT_TEMPLATES = os.getenv('LAYOUT_TEMPLATES', 'true').lower() in ('1', 'true', 'sim')
+LAYOUT_TEMPLATES_FILE = os.getenv(
+    'LAYOUT_TEMPLATES_FILE', os.path.join(tempfile.gettempdir(), 'pdf_extractor_layout_templates.json')
+)
+# Quantas páginas do início do PDF são examinadas para encontrar/aprender o template
+LAYOUT_TEMPLATE_PROBE_PAGES = int(os.getenv('LAYOUT_TEMPLATE_PROBE_PAGES', '3'))
+# Os usos (hits) de cada template são acumulados em memória e gravados no arquivo a cada
+# LAYOUT_TEMPLATE_HITS_FLUSH segundos, em vez de reescrever o arquivo a cada documento
+LAYOUT_TEMPLATE_HITS_FLUSH = float(os.getenv('LAYOUT_TEMPLATE_HITS_FLUSH', '60'))
+
+# Tolerância (pt) para agrupar réguas na mesma altura
+EDGE_SNAP_TOLERANCE = 3.0
+# Fração mínima da largura da tabela que as réguas de uma altura devem cobrir para separar linhas
+MIN_RULE_COVERAGE = 0.5
+
+_templates = None
+_templates_version = None
+_templates_lock = threading.Lock()
+# Hits ainda não gravados: {chave: [quantidade, último uso]}
+_pending_hits = {}
+_last_hits_flush = time.monotonic()
+
+def template_key(producer, header):
+    """Chave do template: produtor do PDF e texto do cabeçalho"""
+    return f"{producer or ''}|{'|'.join(header)}"
+
+@contextmanager
+def _file_lock():
+    """Lock exclusivo entre processos para alterar o arquivo de templates (chamar com _templates_lock)"""
+    with open(f"{LAYOUT_TEMPLATES_FILE}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _file_version():
+    """Identifica a versão do arquivo (a gravação atômica troca o inode)"""
+    try:
+        stat = os.stat(LAYOUT_TEMPLATES_FILE)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+def _load_templates():
+    """
+    Retorna os templates, relendo o arquivo se outro processo o alterou desde a última
+    leitura (chamar com _templates_lock). A gravação é atômica, então a leitura não precisa do lock de arquivo.
+    """
+    global _templates, _templates_version
+    version = _file_version()
+    if _templates is None or version != _templates_version:
+        try:
+            with open(LAYOUT_TEMPLATES_FILE, encoding='utf-8') as f:
+                _templates = json.load(f)
+        except FileNotFoundError:
+            _templates = {}
+        except (OSError, ValueError) as e:
+            print(f"Erro ao carregar templates de layout ({LAYOUT_TEMPLATES_FILE}): {e}")
+            _templates = {}
+        _templates_version = version
+    return _templates
+
+def _save_templates():
+    """Grava os templates no arquivo de forma atômica (chamar com _templates_lock e _file_lock)"""
+    global _templates_version
+    tmp_path = f"{LAYOUT_TEMPLATES_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_templates, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, LAYOUT_TEMPLATES_FILE)
+        _templates_version = _file_version()
+    except OSError as e:
+        print(f"Erro ao gravar templates de layout ({LAYOUT_TEMPLATES_FILE}): {e}")
+
+def _flush_template_hits():
+    """Soma os hits pendentes aos gravados no arquivo (chamar com _templates_lock)"""
+    global _last_hits_flush
+    _last_hits_flush = time.monotonic()
+    if not _pending_hits:
+        return
+    with _file_lock():
+        templates = _load_templates()
+        for key, (hits, last_used_at) in _pending_hits.items():
+            stored = templates.get(key)
+            if stored:
+                stored['hits'] = stored.get('hits', 0) + hits
+                stored['last_used_at'] = max(stored.get('last_used_at') or '', last_used_at)
+        _save_templates()
+    _pending_hits.clear()
+
+def list_templates():
+    """Lista os templates conhecidos (com os de outros workers e os hits deste processo)"""
+    with _templates_lock:
+        _flush_template_hits()
+        return list(_load_templates().values())
+
+def templates_for_producer(producer):
+    """Templates já aprendidos para PDFs do mesmo produtor"""
+    with _templates_lock:
+        return [t for t in _load_templates().values() if t['producer'] == (producer or '')]
+
+def register_template(template):
+    """Guarda um template novo (ou substitui o de mesma chave), sem perder os gravados por outros processos"""
+    with _templates_lock:
+        with _file_lock():
+            _load_templates()[template['key']] = template
+            _save_templates()
+
+def record_template_hit(template):
+    """Conta mais um documento extraído com o template (gravado a cada LAYOUT_TEMPLATE_HITS_FLUSH segundos)"""
+    with _templates_lock:
+        pending = _pending_hits.setdefault(template['key'], [0, None])
+        pending[0] += 1
+        pending[1] = datetime.now().isoformat()
+        if time.monotonic() - _last_hits_flush >= LAYOUT_TEMPLATE_HITS_FLUSH:
+            _flush_template_hits()
+
+def normalize_cell_text(text):
+    """Texto da célula com espaços colapsados, para comparar cabeçalhos"""
+    return ' '.join((text or '').split())
+
+def learn_template(table, producer):
+    """
+    Cria um template a partir de uma tabela encontrada por find_tables().
+    Só tabelas com o cabeçalho na primeira linha da grade e colunas sem células
+    mescladas viram template; caso contrário retorna None.
+    """
+    if table.header.external:
+        return None
+
+    header = [normalize_cell_text(name) for name in table.header.names]
+    first_row = table.rows[0] if table.rows else None
+    if not first_row or any(cell is None for cell in first_row.cells):
+        return None
+
+    # Bordas das colunas: início de cada célula do cabeçalho e o fim da última
+    columns = [round(cell[0], 2) for cell in first_row.cells] + [round(first_row.cells[-1][2], 2)]
+    if columns != sorted(columns):
+        return None
+
+    return {
+        'key': template_key(producer, header),
+        'producer': producer or '',
+        'header': header,
+        'columns': columns,
+        'created_at': datetime.now().isoformat(),
+        'hits': 0
+    }
+
+def horizontal_rules(page, x0, x1):
+    """
+    Alturas das réguas horizontais (linhas e bordas de retângulos) que cobrem ao menos
+    MIN_RULE_COVERAGE da faixa [x0, x1]. Bordas próximas são agrupadas.
+    """
+    segments = []
+    for drawing in page.get_drawings():
+        for item in drawing['items']:
+            if item[0] == 'l':
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) <= 1:
+                    segments.append(((p1.y + p2.y) / 2, min(p1.x, p2.x), max(p1.x, p2.x)))
+            elif item[0] == 're':
+                rect = item[1]
+                segments.append((rect.y0, rect.x0, rect.x1))
+                segments.append((rect.y1, rect.x0, rect.x1))
+
+    width = x1 - x0
+    coverage = []  # [(y, largura coberta)]
+    for y, sx0, sx1 in sorted(segments):
+        covered = max(0.0, min(sx1, x1) - max(sx0, x0))
+        if not covered:
+            continue
+        if coverage and y - coverage[-1][0] <= EDGE_SNAP_TOLERANCE:
+            coverage[-1][1] += covered
+        else:
+            coverage.append([y, covered])
+
+    return [y for y, covered in coverage if covered >= width * MIN_RULE_COVERAGE]
+
+def _cell_texts(words, columns, row_edges):
+    """Distribui as palavras (get_text('words')) pelas células da grade, pelo centro de cada palavra"""
+    cells = {}
+    for x0, y0, x1, y1, text, block_no, line_no, word_no in words:
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        if not (columns[0] <= cx <= columns[-1] and row_edges[0] <= cy <= row_edges[-1]):
+            continue
+        col = next(i for i in range(len(columns) - 1) if cx <= columns[i + 1])
+        row = next(i for i in range(len(row_edges) - 1) if cy <= row_edges[i + 1])
+        cells.setdefault((row, col), []).append((block_no, line_no, word_no, text))
+
+    texts = {}
+    for position, cell_words in cells.items():
+        lines = {}
+        for block_no, line_no, word_no, text in sorted(cell_words):
+            lines.setdefault((block_no, line_no), []).append(text)
+        texts[position] = '\n'.join(' '.join(line) for line in lines.values())
+    return texts
+
+def extract_rows_with_template(page, template):
+    """
+    Lê a tabela da página com a geometria do template: linhas pelas réguas horizontais e
+    colunas do template. Retorna as linhas de dados (tuplas, sem o cabeçalho, como
+    table_data_rows) ou None se a página não tiver o cabeçalho do template no lugar esperado.
+    """
+    columns = template['columns']
+    row_edges = horizontal_rules(page, columns[0], columns[-1])
+    if len(row_edges) < 2:
+        return None
+
+    texts = _cell_texts(page.get_text('words'), columns, row_edges)
+    column_count = len(columns) - 1
+    rows = [
+        tuple(texts.get((row, col), '') for col in range(column_count))
+        for row in range(len(row_edges) - 1)
+    ]
+
+    # O cabeçalho do template precisa estar na grade; as linhas de dados vêm logo depois
+    header = tuple(template['header'])
+    for index, row in enumerate(rows):
+        if tuple(normalize_cell_text(text) for text in row) == header:
+            return rows[index + 1:]
+    return None
+
+def learn_page_template(page, column_count, producer):
+    """
+    Aprende um template com find_tables() na página: a primeira tabela de column_count
+    colunas que vira template e cuja leitura pela geometria encontra as mesmas linhas.
+    A detecção usa o estado global do find_tables(), por isso roda sob find_tables_lock.
+    Retorna o template (ainda não registrado) ou None.
+    """
+    with find_tables_lock:
+        for table in page.find_tables().tables:
+            if table.col_count != column_count:
+                continue
+            template = learn_template(table, producer)
+            if not template:
+                continue
+            # Só vale se a leitura pela geometria encontrar as mesmas linhas na própria página
+            rows = extract_rows_with_template(page, template)
+            if rows is not None and len(rows) == len(table.rows) - 1:
+                return template
+    return None
+
+def find_layout_template(doc, column_count, page_filter=None):
+    """
+    Encontra o template do documento: tenta os templates do mesmo produtor nas primeiras
+    páginas e, se nenhum servir, aprende (e registra) um novo com find_tables() na primeira
+    página que tiver uma tabela de column_count colunas. Páginas recusadas por page_filter
+    (pré-triagem) não são examinadas. O uso de um template conhecido é contado à parte,
+    com record_template_hit().
+    Retorna (template ou None, True se o template foi aprendido agora).
+    """
+    if not LAYOUT_TEMPLATES:
+        return None, False
+
+    producer = (doc.metadata or {}).get('producer') or ''
+    known = [t for t in templates_for_producer(producer) if len(t['columns']) == column_count + 1]
+    probe_pages = min(LAYOUT_TEMPLATE_PROBE_PAGES, doc.page_count)
+
+    for page_num in range(probe_pages):
+        page = doc[page_num]
+        if page_filter and not page_filter(page):
+            continue
+        for template in known:
+            if extract_rows_with_template(page, template) is not None:
+                return template, False
+
+        template = learn_page_template(page, column_count, producer)
+        if template:
+            register_template(template)
+            print(f"Novo template de layout: {template['key']}")
+            return template, True
+
+    return None, False
@@ -0,0 +1,109 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import (
+    Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# Métricas no formato do Prometheus, expostas em /metrics.
+# Com vários workers do Gunicorn, defina PROMETHEUS_MULTIPROC_DIR para que /metrics
+# agregue os valores de todos os processos (veja gunicorn.conf.py).
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+STAGE_DURATION = Histogram(
+    'pdf_extractor_stage_duration_seconds',
+    'Duração de cada etapa do processamento de um upload',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+PAGES_PROCESSED = Histogram(
+    'pdf_extractor_pages_processed',
+    'Páginas extraídas por PDF (não inclui respostas do cache)',
+    buckets=(1, 2, 5, 10, 20, 40, 100, 200, 500)
+)
+PAGES_SKIPPED = Histogram(
+    'pdf_extractor_pages_skipped',
+    'Páginas descartadas na pré-triagem por PDF (sem cabeçalho nem CCP)',
+    buckets=(0, 1, 2, 5, 10, 20, 40, 100, 200, 500)
+)
+ROWS_INSERTED = Histogram(
+    'pdf_extractor_rows_inserted',
+    'Registros inseridos por upload',
+    buckets=COUNT_BUCKETS
+)
+DUPLICATE_ROWS = Histogram(
+    'pdf_extractor_duplicate_rows',
+    'Registros duplicados (ignorados) por upload',
+    buckets=COUNT_BUCKETS
+)
+INVALID_ROWS = Histogram(
+    'pdf_extractor_invalid_rows',
+    'Registros inválidos por upload',
+    buckets=COUNT_BUCKETS
+)
+DB_POOL_WAIT = Histogram(
+    'pdf_extractor_db_pool_wait_seconds',
+    'Tempo de espera por uma conexão do pool do banco',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+)
+
+# Tempos por etapa da requisição/job atual, quando collect_timings() está ativo
+_current_timings = ContextVar('current_timings', default=None)
+
+@contextmanager
+def collect_timings():
+    """
+    Coleta, além dos histogramas, os tempos de cada etapa executada dentro do bloco.
+    Entrega um dicionário {etapa: segundos}, preenchido até o fim do bloco.
+    """
+    timings = {}
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+def observe_stage(stage_name, seconds):
+    """Registra a duração de uma etapa"""
+    STAGE_DURATION.labels(stage=stage_name).observe(seconds)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+@contextmanager
+def stage(stage_name):
+    """Mede o bloco como uma etapa: with stage('find_tables'): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage_name, time.perf_counter() - start)
+
+def observe_db_pool_wait(seconds):
+    """Registra a espera por uma conexão do pool (também entra nos tempos da requisição)"""
+    DB_POOL_WAIT.observe(seconds)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings['espera_conexao_banco'] = timings.get('espera_conexao_banco', 0.0) + seconds
+
+def rounded_timings(timings):
+    """Tempos em segundos, arredondados para a resposta da API"""
+    return {stage_name: round(seconds, 4) for stage_name, seconds in timings.items()}
+
+def observe_insert_result(insert_result):
+    """Registra os contadores de um insert_extraction_data bem-sucedido"""
+    ROWS_INSERTED.observe(insert_result['inserted_count'])
+    DUPLICATE_ROWS.observe(insert_result['skipped_count'])
+    INVALID_ROWS.observe(len(insert_result['invalid_records']))
+
+def render_metrics():
+    """Retorna (conteúdo, content_type) no formato texto do Prometheus"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,148 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import fitz  # PyMuPDF
+
+# O find_tables() do PyMuPDF guarda os caracteres e as réguas da página em variáveis globais
+# do módulo (fitz/table.py), lidas de novo por table.header, table.extract() e table.to_pandas():
+# duas detecções ao mesmo tempo no mesmo processo misturam as tabelas. Toda detecção e leitura
+# de tabelas do find_tables() é feita com este lock (um por processo).
+find_tables_lock = threading.Lock()
+
+
+class PdfPageLimitError(Exception):
+    """PDF com mais páginas que o permitido"""
+
+    def __init__(self, page_count, max_pages):
+        self.page_count = page_count
+        self.max_pages = max_pages
+        super().__init__(f"PDF tem {page_count} páginas. Limite máximo: {max_pages} páginas")
+
+
+class PdfDocument:
+    """
+    Sessão de um PDF enviado: o arquivo é lido e aberto uma única vez e o mesmo
+    documento é usado na validação, no cálculo do hash, na extração e no cache.
+    Deve ser fechado com close() (ou usado com 'with').
+    """
+
+    def __init__(self, data=None, filename=None, path=None, delete_on_close=False):
+        self.data = data
+        self.filename = filename
+        # Caminho do arquivo em disco, se houver (os workers da extração paralela abrem por ele)
+        self.path = path
+        # Arquivos temporários criados para o upload são removidos em close()
+        self.delete_on_close = delete_on_close
+        self._sha256 = None
+        try:
+            if data is not None:
+                self.doc = fitz.open(stream=data, filetype='pdf')
+            else:
+                self.doc = fitz.open(path)
+        except Exception:
+            self._remove_temp_file()
+            raise
+
+    @classmethod
+    def from_path(cls, path, filename=None):
+        """Lê o arquivo do disco uma única vez e abre o documento a partir dos bytes"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        return cls(data, filename=filename, path=path)
+
+    @classmethod
+    def from_upload(cls, file, filename=None, max_in_memory=None, temp_dir=None):
+        """
+        Abre o PDF direto do upload (FileStorage). Até max_in_memory bytes o documento
+        é aberto a partir da memória, sem tocar no disco; acima disso o upload vai para
+        um arquivo temporário com nome único, removido ao fechar o documento.
+        """
+        stream = file.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+
+        if max_in_memory is None or size <= max_in_memory:
+            return cls(stream.read(), filename=filename)
+
+        fd, path = tempfile.mkstemp(prefix='upload_', suffix=f"_{filename or 'documento.pdf'}", dir=temp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            file.save(f)
+        print(f"Upload de {size} bytes salvo em arquivo temporário: {path}")
+        return cls(filename=filename, path=path, delete_on_close=True)
+
+    @classmethod
+    def from_zip_entry(cls, archive, info, max_in_memory=None, temp_dir=None):
+        """
+        Abre um PDF de dentro de um ZIP (zipfile.ZipFile já aberto) sem extrair o arquivo:
+        a entrada é descompactada em streaming para a memória ou, acima de max_in_memory
+        bytes, para um arquivo temporário removido ao fechar o documento.
+        """
+        filename = os.path.basename(info.filename)
+        with archive.open(info) as entry:
+            if max_in_memory is None or info.file_size <= max_in_memory:
+                return cls(entry.read(), filename=filename)
+
+            fd, path = tempfile.mkstemp(prefix='upload_', suffix=f"_{filename}", dir=temp_dir)
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(entry, f, 1024 * 1024)
+        print(f"Entrada {info.filename} ({info.file_size} bytes) salva em arquivo temporário: {path}")
+        return cls(filename=filename, path=path, delete_on_close=True)
+
+    @property
+    def page_count(self):
+        """Quantidade de páginas, lida da árvore de páginas sem carregar nenhuma página"""
+        return self.doc.page_count
+
+    @property
+    def sha256(self):
+        """SHA-256 do conteúdo do PDF (calculado uma vez, dos bytes em memória ou do arquivo em blocos)"""
+        if self._sha256 is None:
+            if self.data is not None:
+                self._sha256 = hashlib.sha256(self.data).hexdigest()
+            else:
+                digest = hashlib.sha256()
+                with open(self.path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    def read_bytes(self):
+        """Conteúdo do PDF (os bytes em memória ou o arquivo lido do disco)"""
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    @property
+    def source(self):
+        """O que os processos da extração paralela usam para reabrir o documento"""
+        return self.path or self.data
+
+    def check_page_limit(self, max_pages):
+        """Rejeita o documento antes de qualquer página ser processada"""
+        if self.page_count > max_pages:
+            raise PdfPageLimitError(self.page_count, max_pages)
+        return self.page_count
+
+    def close(self):
+        if not self.doc.is_closed:
+            self.doc.close()
+        self._remove_temp_file()
+
+    def _remove_temp_file(self):
+        if self.delete_on_close and self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+                print(f"Arquivo temporário removido: {self.path}")
+            except OSError as e:
+                print(f"Erro ao remover arquivo temporário: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
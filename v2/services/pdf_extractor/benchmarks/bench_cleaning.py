@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark da limpeza/validação das tabelas de devedores:
+caminho antigo (apply + iterrows) x pipeline vetorizado (clean_devedores_dataframe)
+x backend sem pandas (clean_devedores_rows).
+
+Uso: python benchmarks/bench_cleaning.py [quantidade_de_linhas]
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import contextlib
+
+# Adicionar o diretório app ao path para importar o módulo
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import pandas as pd
+from extractor import (
+    DEVEDOR_COLUMNS, clean_devedores_dataframe, clean_devedores_rows,
+    process_contribuinte_data, process_valor_devido, is_valid_devedor_row
+)
+
+def legacy_clean(df):
+    """Caminho original: .apply por coluna e iterrows com is_valid_devedor_row"""
+    df = df.copy()
+    df['CONTRIBUINTE'] = df['CONTRIBUINTE'].apply(process_contribuinte_data)
+    df['VALOR DEVIDO'] = df['VALOR DEVIDO'].apply(process_valor_devido)
+
+    valid_rows = []
+    for _, row in df.iterrows():
+        if is_valid_devedor_row(row):
+            valid_rows.append(row.to_dict())
+
+    for row in valid_rows:
+        row['status'] = 'ativo'
+    return valid_rows
+
+def build_table(n_rows, seed=42):
+    """Gera uma tabela sintética no formato de table.to_pandas(), com cabeçalhos, totais e lixo"""
+    random.seed(seed)
+    nomes = ['MARIA DA SILVA', 'JOÃO  SOUZA', 'ANA PAULA DE\nOLIVEIRA', '  JOSÉ ROBERTO ', None, '']
+    rows = []
+    for i in range(n_rows):
+        r = random.random()
+        if r < 0.01:
+            rows.append(['CCP', 'CONTRIBUINTE', 'CELULAR', 'PROCESSO(S)', 'VALOR DEVIDO'])
+        elif r < 0.02:
+            rows.append([f'QUANTIDADE: {i} TOTAL:', None, None, None, 'R$ 1.234,56'])
+        elif r < 0.03:
+            rows.append(['---', '---', None, None, None])
+        elif r < 0.04:
+            rows.append([None, None, None, None, None])
+        else:
+            valor = f"{random.uniform(1, 3_000_000):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+            valor = random.choice([f'R$ {valor}', f'R${valor}', valor, '', None, 'isento'])
+            rows.append([
+                str(100000 + i),
+                random.choice(nomes),
+                f'(64) 9{random.randint(1000, 9999)}-{random.randint(1000, 9999)}',
+                f'{random.randint(1, 999)}/2023',
+                valor,
+            ])
+    return pd.DataFrame(rows, columns=DEVEDOR_COLUMNS)
+
+def same_rows(a, b):
+    """Compara as listas de dicionários (None e NaN são distintos; NaN é igual a NaN)"""
+    if len(a) != len(b):
+        return False
+    for row_a, row_b in zip(a, b):
+        if row_a.keys() != row_b.keys():
+            return False
+        for key in row_a:
+            va, vb = row_a[key], row_b[key]
+            if (va is None) != (vb is None) or type(va) is not type(vb):
+                return False
+            if va != vb and not (pd.isna(va) and pd.isna(vb)):
+                return False
+    return True
+
+def run(fn, df, repeat=3):
+    """Executa fn(df) algumas vezes, silenciando os prints, e retorna (melhor tempo, resultado)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn(df)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    df = build_table(n_rows)
+
+    legacy_time, legacy_rows = run(legacy_clean, df)
+    vector_time, vector_rows = run(clean_devedores_dataframe, df)
+    # Mesmo formato de table.extract(): uma tupla por linha
+    rows = list(df.itertuples(index=False, name=None))
+    python_time, python_rows = run(clean_devedores_rows, rows)
+
+    if not same_rows(legacy_rows, vector_rows):
+        print("❌ Resultados diferentes entre o caminho antigo e o vetorizado")
+        sys.exit(1)
+
+    if not same_rows(legacy_rows, python_rows):
+        print("❌ Resultados diferentes entre o caminho antigo e o backend sem pandas")
+        sys.exit(1)
+
+    print(f"Linhas: {n_rows} (válidas: {len(vector_rows)})")
+    print(f"apply/iterrows : {n_rows / legacy_time:12,.0f} linhas/s ({legacy_time:.3f}s)")
+    print(f"vetorizado     : {n_rows / vector_time:12,.0f} linhas/s ({vector_time:.3f}s)")
+    print(f"sem pandas     : {n_rows / python_time:12,.0f} linhas/s ({python_time:.3f}s)")
+    print(f"Ganho          : {legacy_time / vector_time:.1f}x (vetorizado), {legacy_time / python_time:.1f}x (sem pandas)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark do pipeline de extração de PDFs de devedores.
+
+Gera PDFs sintéticos (1, 10, 40 e 200 páginas por padrão) com a mesma tabela de
+cinco colunas das listas da prefeitura (CCP, CONTRIBUINTE, CELULAR, PROCESSO(S),
+VALOR DEVIDO) e os extrai com o mesmo código do serviço (extract_devedores_from_document),
+medindo o tempo total e as etapas registradas pelo extrator:
+  - template_layout / tabela_template: resolução do template de layout e leitura das
+    tabelas pela geometria conhecida (desligado com --no-template)
+  - escolha_motor / palavras: escolha do motor e leitura pelas coordenadas das palavras
+    (--engine; padrão EXTRACTION_ENGINE)
+  - pre_triagem: triagem das páginas pela camada de texto (desligada com --no-prescreen)
+  - find_tables: detecção das tabelas e leitura das células (table.extract())
+  - normalizacao: normalize_devedores_rows (ou a normalização em lote do backend pandas)
+  - validacao: filter_valid_devedores (ou a máscara de validação do backend pandas)
+  - inserção no banco: insert_extraction_data (só com --db; usa DATABASE_URL)
+A extração é sequencial, salvo com --parallel (mesma regra do serviço).
+Os templates aprendidos ficam em um diretório temporário, não no arquivo do serviço.
+
+O resultado é um JSON com páginas/s, linhas/s e pico de RSS de cada tamanho, que pode
+ser salvo como baseline (--output) e comparado em execuções futuras (--baseline): acusa
+regressão a queda de páginas/s e o aumento do tempo da normalização ou da validação.
+
+Uso:
+  python benchmarks/bench_pipeline.py [--pages 1 10 40 200] [--db] [--no-template] [--no-prescreen]
+                                      [--engine auto|tables|words] [--parallel] [--output baseline.json]
+  python benchmarks/bench_pipeline.py --baseline baseline.json [--tolerance 0.2]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+from datetime import datetime
+
+# Adicionar o diretório app ao path para importar o módulo
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+# Templates aprendidos no benchmark não podem ir para o arquivo compartilhado do serviço
+TEMPLATES_DIR = tempfile.mkdtemp(prefix='bench_templates_')
+atexit.register(shutil.rmtree, TEMPLATES_DIR, True)
+os.environ['LAYOUT_TEMPLATES_FILE'] = os.path.join(TEMPLATES_DIR, 'layout_templates.json')
+
+import fitz  # PyMuPDF
+import extractor
+import layout_templates
+from extractor import DEVEDOR_COLUMNS, EXTRACTOR_VERSION, EXTRACTION_ENGINE, EXTRACTION_ENGINES
+from pdf_document import PdfDocument
+
+DEFAULT_PAGE_COUNTS = [1, 10, 40, 200]
+ROWS_PER_PAGE = 30
+# Etapas comparadas com o baseline além de páginas/s, e o tempo mínimo (s) no baseline para comparar
+COMPARED_STAGES = ('normalizacao', 'validacao')
+MIN_COMPARED_STAGE_S = 0.005
+# Posição x das divisas das colunas na página A4
+COLUMN_EDGES = [40, 110, 330, 420, 500, 570]
+NOMES = ['MARIA DA SILVA', 'JOAO  SOUZA', 'ANA PAULA DE OLIVEIRA', 'JOSE\nROBERTO', 'FRANCISCA DOS\nSANTOS']
+
+def format_brl(valor):
+    """1234.5 -> 'R$ 1.234,50'"""
+    return 'R$ ' + f"{valor:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+def generate_devedores_pdf(path, pages, rows_per_page=ROWS_PER_PAGE, seed=42):
+    """
+    Gera um PDF com uma tabela de devedores por página, com cabeçalho em todas as
+    páginas, nomes quebrados em duas linhas, valores ausentes e a linha de totalizador
+    na última página. Retorna a quantidade de devedores gerados.
+    """
+    random.seed(seed)
+    doc = fitz.open()
+    row_height = 22
+    top = 60
+    count = 0
+
+    for page_num in range(pages):
+        page = doc.new_page(width=612, height=842)
+        last_page = page_num == pages - 1
+        n_rows = rows_per_page + 1 + (1 if last_page else 0)
+
+        for r in range(n_rows):
+            if r == 0:
+                cells = DEVEDOR_COLUMNS
+            elif last_page and r == n_rows - 1:
+                cells = [f'QUANTIDADE: {count} TOTAL:', '', '', '', format_brl(count * 1000)]
+            else:
+                count += 1
+                cells = [
+                    str(100000 + count),
+                    random.choice(NOMES),
+                    f'(64) 9{random.randint(1000, 9999)}-{random.randint(1000, 9999)}',
+                    f'{random.randint(1, 999)}/2023',
+                    '' if count % 17 == 0 else format_brl(random.uniform(10, 99999)),
+                ]
+
+            y = top + r * row_height
+            for col, text in enumerate(cells):
+                for line_num, line in enumerate(text.split('\n')):
+                    page.insert_text((COLUMN_EDGES[col] + 2, y + 9 + line_num * 8), line, fontsize=7)
+
+        for r in range(n_rows + 1):
+            page.draw_line((COLUMN_EDGES[0], top + r * row_height), (COLUMN_EDGES[-1], top + r * row_height))
+        for x in COLUMN_EDGES:
+            page.draw_line((x, top), (x, top + n_rows * row_height))
+
+    doc.save(path)
+    doc.close()
+    return count
+
+def peak_rss_mb():
+    """Pico de memória residente do processo até agora (ru_maxrss é em KB no Linux)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+def insert_into_database(devedores):
+    """Insere os devedores em um source temporário e o remove em seguida. Retorna o tempo gasto."""
+    from database import create_source, insert_extraction_data, db_connection
+
+    source_id = create_source('benchmark.pdf', 0, 0, 'processando')
+    if not source_id:
+        raise RuntimeError('Não foi possível criar o source do benchmark (verifique DATABASE_URL)')
+
+    try:
+        start = time.perf_counter()
+        result = insert_extraction_data(devedores, source_id)
+        elapsed = time.perf_counter() - start
+        if not result['success']:
+            raise RuntimeError('Erro ao inserir os dados do benchmark')
+        return elapsed
+    finally:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM extraction_results WHERE source_id = %s", (source_id,))
+                cur.execute("DELETE FROM sources WHERE id = %s", (source_id,))
+            conn.commit()
+
+def bench_pdf(path, with_db=False, engine=None, parallel=False):
+    """Extrai o PDF com extract_devedores_from_document, medindo o total e cada etapa"""
+    timings = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with PdfDocument.from_path(path) as pdf:
+            start = time.perf_counter()
+            devedores = extractor.extract_devedores_from_document(
+                pdf, parallel=None if parallel else False, timings=timings, engine=engine
+            )
+            timings['extracao'] = time.perf_counter() - start
+
+        if with_db:
+            timings['insercao_banco'] = insert_into_database(devedores)
+
+    return timings, devedores
+
+def run_benchmark(page_counts, with_db=False, use_template=True, prescreen=True, engine=None, parallel=False):
+    # As flags são lidas pelo extrator a cada documento
+    layout_templates.LAYOUT_TEMPLATES = use_template
+    extractor.PAGE_PRESCREEN = prescreen
+    engine = engine or EXTRACTION_ENGINE
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pages in page_counts:
+            path = os.path.join(tmp_dir, f'devedores_{pages}p.pdf')
+            expected_rows = generate_devedores_pdf(path, pages)
+
+            timings, devedores = bench_pdf(path, with_db, engine, parallel)
+            if len(devedores) != expected_rows:
+                raise RuntimeError(f'{pages} páginas: esperados {expected_rows} devedores, extraídos {len(devedores)}')
+
+            total = timings['extracao'] + timings.get('insercao_banco', 0.0)
+            results.append({
+                'pages': pages,
+                'rows': len(devedores),
+                'timings_s': {stage: round(value, 4) for stage, value in sorted(timings.items())},
+                'total_s': round(total, 4),
+                'pages_per_s': round(pages / total, 2),
+                'rows_per_s': round(len(devedores) / total, 1),
+                'peak_rss_mb': peak_rss_mb()
+            })
+            print(f"{pages:>4} páginas: {results[-1]['pages_per_s']:8.2f} páginas/s, "
+                  f"{results[-1]['rows_per_s']:10.1f} linhas/s, RSS {results[-1]['peak_rss_mb']} MB",
+                  file=sys.stderr)
+
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'pymupdf': fitz.VersionBind,
+        'extractor_version': EXTRACTOR_VERSION,
+        'rows_per_page': ROWS_PER_PAGE,
+        'with_db': with_db,
+        'layout_template': use_template,
+        'prescreen': prescreen,
+        'engine': engine,
+        'parallel': parallel,
+        'results': results
+    }
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Retorna a lista de regressões: páginas/s abaixo do baseline além da tolerância e etapas
+    de COMPARED_STAGES mais lentas que no baseline além da tolerância. Etapas que no baseline
+    levaram menos de MIN_COMPARED_STAGE_S são ignoradas (ruído de medição).
+    """
+    baseline_by_pages = {item['pages']: item for item in baseline.get('results', [])}
+    regressions = []
+    for item in report['results']:
+        previous = baseline_by_pages.get(item['pages'])
+        if not previous:
+            continue
+        if item['pages_per_s'] < previous['pages_per_s'] * (1 - tolerance):
+            regressions.append({
+                'pages': item['pages'],
+                'baseline_pages_per_s': previous['pages_per_s'],
+                'pages_per_s': item['pages_per_s']
+            })
+        for stage in COMPARED_STAGES:
+            baseline_s = previous.get('timings_s', {}).get(stage)
+            current_s = item['timings_s'].get(stage)
+            if baseline_s is None or current_s is None or baseline_s < MIN_COMPARED_STAGE_S:
+                continue
+            if current_s > baseline_s * (1 + tolerance):
+                regressions.append({
+                    'pages': item['pages'],
+                    'stage': stage,
+                    'baseline_s': baseline_s,
+                    's': current_s
+                })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline de extração de PDFs de devedores')
+    parser.add_argument('--pages', type=int, nargs='+', default=DEFAULT_PAGE_COUNTS,
+                        help='tamanhos dos PDFs sintéticos, em páginas')
+    parser.add_argument('--db', action='store_true', help='mede também a inserção no banco (DATABASE_URL)')
+    parser.add_argument('--no-template', action='store_true',
+                        help='usa find_tables() em todas as páginas, sem o template de layout')
+    parser.add_argument('--no-prescreen', action='store_true', help='desliga a pré-triagem das páginas')
+    parser.add_argument('--engine', choices=EXTRACTION_ENGINES,
+                        help=f'motor de leitura das tabelas (padrão: {EXTRACTION_ENGINE})')
+    parser.add_argument('--parallel', action='store_true',
+                        help='permite a extração paralela, como no serviço (padrão: sequencial)')
+    parser.add_argument('--output', help='arquivo onde salvar o relatório JSON (padrão: stdout)')
+    parser.add_argument('--baseline', help='relatório JSON anterior para detectar regressões')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='queda máxima aceita de páginas/s (e aumento do tempo das etapas) '
+                             'em relação ao baseline (padrão: 0.2)')
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.pages, args.db, not args.no_template, not args.no_prescreen, args.engine, args.parallel
+    )
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['regressions'] = compare_with_baseline(report, json.load(f), args.tolerance)
+        if report['regressions']:
+            print(f"❌ {len(report['regressions'])} regressão(ões) em relação ao baseline", file=sys.stderr)
+            exit_code = 1
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,9 @@ CREATE INDEX IF NOT EXISTS idx_extraction_results_nome ON extraction_results(nom
 CREATE INDEX IF NOT EXISTS idx_extraction_results_source_id ON extraction_results(source_id);
 CREATE INDEX IF NOT EXISTS idx_extraction_results_created_at ON extraction_results(created_at);
 CREATE INDEX IF NOT EXISTS idx_extraction_results_status ON extraction_results(status);
+-- Paginação por cursor (keyset) e busca por prefixo do nome dentro de um source
+CREATE INDEX IF NOT EXISTS idx_extraction_results_source_keyset ON extraction_results(source_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_extraction_results_source_nome_prefix ON extraction_results(source_id, upper(nome) text_pattern_ops);
 -- Criar trigger para atualizar updated_at
 CREATE OR REPLACE FUNCTION update_extraction_results_updated_at() RETURNS TRIGGER AS $$ BEGIN NEW.updated_at = CURRENT_TIMESTAMP;
 NEW.data_atualizacao = CURRENT_TIMESTAMP;
@@ -47,4 +50,94 @@ END;
 $$ language 'plpgsql';
 DROP TRIGGER IF EXISTS update_sources_updated_at ON sources;
 CREATE TRIGGER update_sources_updated_at BEFORE
-UPDATE ON sources FOR EACH ROW EXECUTE FUNCTION update_sources_updated_at();
\ No newline at end of file
+UPDATE ON sources FOR EACH ROW EXECUTE FUNCTION update_sources_updated_at();
+-- Criar tabela para jobs de extração assíncrona
+CREATE TABLE IF NOT EXISTS extraction_jobs (
+    id UUID PRIMARY KEY,
+    source_id INTEGER REFERENCES sources(id) ON DELETE CASCADE,
+    filename VARCHAR(255),
+    status VARCHAR(20) DEFAULT 'pendente',
+    is_update BOOLEAN DEFAULT FALSE,
+    total_paginas INTEGER DEFAULT 0,
+    paginas_processadas INTEGER DEFAULT 0,
+    resultado JSONB,
+    erro TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_extraction_jobs_source_id ON extraction_jobs(source_id);
+CREATE INDEX IF NOT EXISTS idx_extraction_jobs_status ON extraction_jobs(status);
+-- Fila durável: qualquer instância reivindica os jobs (SELECT ... FOR UPDATE SKIP LOCKED),
+-- renova heartbeat_at enquanto processa e, se parar de renovar, o job volta para a fila
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS on_conflict VARCHAR(10) DEFAULT 'nothing';
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS engine VARCHAR(10);
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS include_timings BOOLEAN DEFAULT FALSE;
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS max_paginas INTEGER;
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS tentativas INTEGER DEFAULT 0;
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(255);
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS disponivel_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_extraction_jobs_fila ON extraction_jobs(disponivel_em)
+    WHERE status IN ('pendente', 'processando');
+-- PDF de cada job até a conclusão, para que outra instância (ou a mesma, após reiniciar) processe o job
+CREATE TABLE IF NOT EXISTS extraction_job_files (
+    job_id UUID PRIMARY KEY REFERENCES extraction_jobs(id) ON DELETE CASCADE,
+    conteudo BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- Cache de extração por conteúdo do PDF (SHA-256) e versão do extrator (com o motor, ex.: '4:auto')
+-- registros é TEXT (JSON gerado pelo Python) para preservar valores NaN, que o JSONB não aceita
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    sha256 CHAR(64) NOT NULL,
+    extractor_version VARCHAR(20) NOT NULL,
+    page_count INTEGER,
+    registros TEXT NOT NULL,
+    hits INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (sha256, extractor_version)
+);
+-- Páginas descartadas na pré-triagem (capas, resumos, assinaturas), devolvidas também em cache hits
+ALTER TABLE extraction_cache ADD COLUMN IF NOT EXISTS paginas_ignoradas INTEGER;
+-- Arquivos (por hash) já aplicados a cada source, para responder reenvios sem reprocessar
+CREATE TABLE IF NOT EXISTS source_uploads (
+    source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+    sha256 CHAR(64) NOT NULL,
+    extractor_version VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source_id, sha256, extractor_version)
+);
+-- Índice de devedores por CCP entre todos os sources: aponta para o registro mais recente
+-- de cada CCP (mantido por insert_extraction_data/merge_extraction_data na mesma transação).
+-- O status continua em extraction_results; o histórico por source usa idx_extraction_results_ccp.
+CREATE TABLE IF NOT EXISTS devedores (
+    ccp VARCHAR(50) PRIMARY KEY,
+    extraction_result_id INTEGER NOT NULL REFERENCES extraction_results(id) ON DELETE CASCADE,
+    source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+    nome TEXT NOT NULL,
+    celular VARCHAR(20),
+    processo TEXT,
+    valor_devido NUMERIC,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_devedores_source_id ON devedores(source_id);
+CREATE INDEX IF NOT EXISTS idx_devedores_extraction_result_id ON devedores(extraction_result_id);
+-- Carga inicial a partir dos registros já existentes (o mais recente de cada CCP)
+INSERT INTO devedores (ccp, extraction_result_id, source_id, nome, celular, processo, valor_devido, updated_at)
+SELECT DISTINCT ON (ccp) ccp, id, source_id, nome, celular, processo, valor_devido, updated_at
+FROM extraction_results
+WHERE ccp IS NOT NULL AND source_id IS NOT NULL
+ORDER BY ccp, updated_at DESC, id DESC
+ON CONFLICT (ccp) DO NOTHING;
+-- Busca aproximada por nome (GET /extraction_results/search): índice GIN de trigramas
+-- sobre o nome sem acentos e em minúsculas
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+-- unaccent() é STABLE; o wrapper com dicionário explícito pode ser IMMUTABLE e usado no índice
+CREATE OR REPLACE FUNCTION normalize_nome(texto TEXT) RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto))
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+CREATE INDEX IF NOT EXISTS idx_extraction_results_nome_trgm ON extraction_results USING gin (normalize_nome(nome) gin_trgm_ops);
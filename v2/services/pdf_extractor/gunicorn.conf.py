@@ -0,0 +1,91 @@
+"""
+Configuração do Gunicorn para o modo de produção do PDF Extractor.
+Todos os valores podem ser ajustados por variáveis de ambiente.
+
+Cada worker é um processo com o seu próprio pool de threads (gthread): enquanto uma
+thread espera a extração de um upload, as demais continuam atendendo /health, /status,
+/sources etc. A leitura dos PDFs (PyMuPDF, limitada por CPU) roda no pool de processos
+de cada worker, fora do processo que atende as requisições.
+Veja também SYNC_EXTRACTION_CONCURRENCY em app/app.py. Cada worker também consome a
+fila durável de extração (EXTRACTION_WORKERS threads, veja app/jobs.py).
+"""
+import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+
+# Os módulos da aplicação usam imports planos (from database import ...)
+pythonpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app')
+wsgi_app = 'app:create_app()'
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Processos: metade dos núcleos por padrão (mínimo 2). Os workers recebem os uploads e gravam
+# os resultados; a extração, limitada por CPU, fica com o pool de processos abaixo
+workers = int(os.getenv('GUNICORN_WORKERS', str(max(2, multiprocessing.cpu_count() // 2))))
+worker_class = 'gthread'
+# Threads por processo, usadas principalmente pelos endpoints de leitura
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Cada worker cria, sob demanda, o seu pool de processos da extração (PARALLEL_EXTRACTION_WORKERS
+# em app/extractor.py), onde rodam todas as extrações do worker: uploads síncronos, lotes e a
+# fila de jobs. Para não somar workers × núcleos processos do PyMuPDF, o padrão divide os
+# núcleos entre os workers, com pelo menos 2 processos por worker:
+#   processos de extração na máquina ≈ workers × PARALLEL_EXTRACTION_WORKERS ≈ núcleos
+os.environ.setdefault('PARALLEL_EXTRACTION_WORKERS', str(max(2, multiprocessing.cpu_count() // workers)))
+
+# Extrações síncronas de PDFs grandes podem demorar
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+# Espera (s) pelos jobs da fila em andamento quando um worker encerra. O graceful_timeout conta
+# desde o SIGTERM e termina com o SIGKILL do arbiter, então a espera é menor: os jobs que não
+# terminarem precisam voltar para a fila antes disso. Em containers, o prazo do 'docker stop'
+# (10 s por padrão) tem de ser maior que graceful_timeout: veja stop_grace_period em v2/docker-compose.yml
+queue_shutdown_timeout = float(os.getenv('QUEUE_SHUTDOWN_TIMEOUT', str(max(0, graceful_timeout - 5))))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recicla os workers periodicamente para devolver a memória usada pelo PyMuPDF/pandas
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '500'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '50'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Métricas do Prometheus agregadas entre os workers (app/metrics.py)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'pdf_extractor_metrics'))
+
+def on_starting(server):
+    """Limpa as métricas da execução anterior antes de iniciar os workers"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    """Descarta as métricas de gauge do worker encerrado"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def post_worker_init(worker):
+    """
+    Inicia as threads que consomem a fila durável de extração (só nos workers, nunca no master).
+    O jobs não importa o extractor no boot: o PyMuPDF só é carregado no primeiro upload ou job.
+    """
+    from jobs import start_queue_workers
+    start_queue_workers()
+
+def worker_exit(server, worker):
+    """
+    Para de reivindicar jobs da fila (também na reciclagem por max_requests) e espera os
+    em andamento até queue_shutdown_timeout; os que não terminarem voltam para a fila na
+    hora, sem esperar o JOB_VISIBILITY_TIMEOUT e sem gastar uma das JOB_MAX_ATTEMPTS tentativas.
+    Depois encerra o pool de processos da extração.
+    """
+    from jobs import stop_queue_workers
+    stop_queue_workers(timeout=queue_shutdown_timeout)
+
+    # O pool da extração só existe se o extractor foi carregado neste worker
+    extractor = sys.modules.get('extractor')
+    if extractor:
+        extractor.shutdown_process_pool()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testes da API (create_app) que não dependem do banco: leitura dos uploads multipart.
+"""
+
+import io
+import sys
+import os
+
+from flask import request
+
+# Adicionar o diretório app ao path para importar o módulo
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+import app as pdf_app
+
+def upload_stream(size):
+    """Stream em que o Werkzeug guardou um upload de size bytes"""
+    flask_app = pdf_app.create_app()
+    data = {'file': (io.BytesIO(b'%PDF' + b'0' * (size - 4)), 'lista.pdf')}
+    with flask_app.test_request_context('/upload', method='POST', data=data, content_type='multipart/form-data'):
+        stream = request.files['file'].stream
+        return stream._rolled, stream.read(4)
+
+def test_upload_below_limit_stays_in_memory():
+    """Uma lista de 3 MB (acima dos 500 KB do Werkzeug) não vai para o disco antes da view"""
+    rolled, head = upload_stream(3 * 1024 * 1024)
+
+    assert head == b'%PDF'
+    assert not rolled
+
+def test_upload_above_limit_goes_to_disk(monkeypatch):
+    """Acima de PDF_IN_MEMORY_MAX_BYTES o upload continua indo para um arquivo temporário"""
+    monkeypatch.setattr(pdf_app, 'PDF_IN_MEMORY_MAX_BYTES', 1024 * 1024)
+    rolled, head = upload_stream(2 * 1024 * 1024)
+
+    assert head == b'%PDF'
+    assert rolled
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testes da atualização incremental (merge_extraction_data) de um source.
+Os testes são ignorados se o PostgreSQL (DATABASE_URL) não estiver acessível.
+"""
+
+import io
+import sys
+import os
+import contextlib
+
+import pytest
+
+# Adicionar o diretório app ao path para importar o módulo
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+import database
+
+def require_database():
+    """Ignora o teste se o banco não estiver acessível"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        conn = database.get_db_connection()
+    if conn is None:
+        pytest.skip("PostgreSQL indisponível")
+    conn.close()
+
+@pytest.fixture
+def source_id():
+    """Source de teste, removido com os seus registros ao final"""
+    require_database()
+    with contextlib.redirect_stdout(io.StringIO()):
+        source_id = database.create_source('teste_merge.pdf')
+    yield source_id
+    with database.db_connection() as conn:
+        with conn.cursor() as cur:
+            # Nem todo banco tem o ON DELETE CASCADE em extraction_results (veja fix-cascade.sql)
+            cur.execute("DELETE FROM extraction_results WHERE source_id = %s;", (source_id,))
+            cur.execute("DELETE FROM sources WHERE id = %s;", (source_id,))
+        conn.commit()
+
+def devedor(ccp, nome, valor, celular='', processo='123/2024'):
+    """Registro no formato devolvido pelo extractor"""
+    return {'CCP': ccp, 'CONTRIBUINTE': nome, 'CELULAR': celular, 'PROCESSO(S)': processo, 'VALOR DEVIDO': valor}
+
+def merge(data, source_id):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return database.merge_extraction_data(data, source_id)
+
+def stored_rows(source_id):
+    """{ccp: (nome, valor_devido, status)} dos registros gravados no source"""
+    with database.db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT ccp, nome, valor_devido, status FROM extraction_results WHERE source_id = %s",
+                (source_id,)
+            )
+            return {row[0]: (row[1], float(row[2]), row[3]) for row in cur.fetchall()}
+
+def test_merge_inserts_new_ccps(source_id):
+    """Num source vazio todos os CCPs do arquivo são inseridos como ativos"""
+    result = merge([devedor('100001', 'MARIA DA SILVA', 10.5), devedor('100002', 'JOAO SOUZA', 20.0)], source_id)
+
+    assert result['success']
+    assert result['inserted_count'] == 2
+    assert sorted(result['new_ccps']) == ['100001', '100002']
+    assert result['updated_count'] == result['removed_count'] == 0
+    assert stored_rows(source_id) == {
+        '100001': ('MARIA DA SILVA', 10.5, 'ativo'),
+        '100002': ('JOAO SOUZA', 20.0, 'ativo')
+    }
+
+def test_merge_updates_changed_and_removes_missing(source_id):
+    """Valor alterado é atualizado, CCP igual fica como está e CCP ausente vira 'removido'"""
+    merge([
+        devedor('100001', 'MARIA DA SILVA', 10.5),
+        devedor('100002', 'JOAO SOUZA', 20.0),
+        devedor('100003', 'ANA PAULA', 30.0)
+    ], source_id)
+
+    result = merge([devedor('100001', 'MARIA DA SILVA', 10.5), devedor('100002', 'JOAO SOUZA', 25.0)], source_id)
+
+    assert result['inserted_count'] == 0
+    assert result['unchanged_count'] == 1
+    assert [item['ccp'] for item in result['updated']] == ['100002']
+    assert result['updated'][0]['alteracoes'] == {'valor_devido': {'anterior': 20.0, 'novo': 25.0}}
+    assert [item['ccp'] for item in result['removed']] == ['100003']
+    assert stored_rows(source_id) == {
+        '100001': ('MARIA DA SILVA', 10.5, 'ativo'),
+        '100002': ('JOAO SOUZA', 25.0, 'ativo'),
+        '100003': ('ANA PAULA', 30.0, database.REMOVED_STATUS)
+    }
+
+    # O CCP que volta para a lista é reativado
+    result = merge([devedor('100001', 'MARIA DA SILVA', 10.5), devedor('100003', 'ANA PAULA', 30.0)], source_id)
+
+    assert result['updated'][0]['alteracoes'] == {'status': {'anterior': database.REMOVED_STATUS, 'novo': 'ativo'}}
+    assert stored_rows(source_id)['100003'] == ('ANA PAULA', 30.0, 'ativo')
+
+@pytest.mark.parametrize('empty_ccp', [None, '', '  '])
+def test_merge_skips_rows_without_ccp(source_id, empty_ccp):
+    """Registros sem CCP não são inseridos a cada merge nem marcam cópias anteriores como removidas"""
+    data = [devedor('100001', 'MARIA DA SILVA', 10.5), devedor(empty_ccp, 'SEM CCP', 5.0)]
+
+    for _ in range(2):
+        result = merge(data, source_id)
+
+        assert result['removed_count'] == 0
+        assert [record['motivo'] for record in result['invalid_records']] == ['CCP vazio']
+    assert result['unchanged_count'] == 1
+    assert stored_rows(source_id) == {'100001': ('MARIA DA SILVA', 10.5, 'ativo')}
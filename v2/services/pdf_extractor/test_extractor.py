@@ -1,66 +1,352 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Script de teste para verificar a função process_patient_data
+Script de teste para verificar a limpeza das tabelas de devedores
+(process_contribuinte_data, process_valor_devido e clean_devedores_rows)
 """
 
+import io
 import sys
 import os
+import math
+import tempfile
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Adicionar o diretório app ao path para importar o módulo
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
 
-from extractor import process_patient_data
+# Templates de layout aprendidos nos testes não vão para o arquivo padrão do serviço
+os.environ['LAYOUT_TEMPLATES_FILE'] = os.path.join(tempfile.mkdtemp(), 'layout_templates.json')
+
+import fitz  # PyMuPDF
+import extractor
+import layout_templates
+from extractor import process_contribuinte_data, process_valor_devido, clean_devedores_rows
+from pdf_document import PdfDocument
+
+# Divisas das colunas das tabelas geradas nos testes
+COLUMN_EDGES = [40, 110, 330, 420, 500, 570]
+
+def same_value(a, b):
+    """Compara valores considerando NaN igual a NaN"""
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+def report(i, success, input_value, expected, result):
+    status = "✅ PASSOU" if success else "❌ FALHOU"
+    print(f"Teste {i}: {status}")
+    print(f"  Input: {input_value!r}")
+    print(f"  Esperado: {expected!r}")
+    print(f"  Resultado: {result!r}")
+    print()
+
+def test_contribuinte_processing():
+    """Testa a normalização do nome do contribuinte"""
 
-def test_patient_data_processing():
-    """Testa diferentes formatos de dados de paciente"""
-    
     test_cases = [
-        # Padrão prioritário: número - nome (formato mais comum)
-        ("73288 - THAIS BARBOSA PENA", "73288", "THAIS BARBOSA PENA"),
-        ("12345 - JOÃO DA SILVA", "12345", "JOÃO DA SILVA"),
-        ("987654321 - MARIA SANTOS COSTA", "987654321", "MARIA SANTOS COSTA"),
-        ("456 - ANA PAULA", "456", "ANA PAULA"),
-        ("789123456 – CARLOS EDUARDO", "789123456", "CARLOS EDUARDO"),
-        
+        ("MARIA DA SILVA", "MARIA DA SILVA"),
+        ("  JOSÉ ROBERTO  ", "JOSÉ ROBERTO"),
+        ("JOÃO  SOUZA", "JOÃO SOUZA"),
+
         # Caso com quebra de linha
-        ("132955 - VIVIANE PERPETUO SOCORRO DOS\nPASSOS", "132955", "VIVIANE PERPETUO SOCORRO DOS PASSOS"),
-        ("12345 - NOME COM\nQUEBRA DE LINHA", "12345", "NOME COM QUEBRA DE LINHA"),
-        
-        # Padrão secundário: número nome (sem hífen)
-        ("123456 JOÃO DA SILVA", "123456", "JOÃO DA SILVA"),
-        ("987 MARIA SANTOS", "987", "MARIA SANTOS"),
-        
-        # Padrão terciário: nome - número
-        ("PEDRO OLIVEIRA - 654321", "654321", "PEDRO OLIVEIRA"),
-        ("JOSÉ ROBERTO SILVA - 111222333", "111222333", "JOSÉ ROBERTO SILVA"),
-        ("FERNANDA - 444555666", "444555666", "FERNANDA"),
-        ("RICARDO ALMEIDA – 777888999", "777888999", "RICARDO ALMEIDA"),
-        
-        # Padrão quaternário: nome número (sem hífen)
-        ("ANTONIO SILVA 555666", "555666", "ANTONIO SILVA"),
-        
+        ("VIVIANE PERPETUO SOCORRO DOS\nPASSOS", "VIVIANE PERPETUO SOCORRO DOS PASSOS"),
+
+        # Casos especiais
+        ("", None),  # Vazio
+        (None, None),  # None
+        (float('nan'), None),  # NaN
+    ]
+
+    print("=== Teste da função process_contribuinte_data ===\n")
+
+    failures = 0
+    for i, (input_text, expected) in enumerate(test_cases, 1):
+        result = process_contribuinte_data(input_text)
+        success = same_value(result, expected)
+        failures += not success
+        report(i, success, input_text, expected, result)
+
+    assert failures == 0, f"{failures} teste(s) falharam"
+
+def test_valor_devido_processing():
+    """Testa a conversão do valor devido no formato brasileiro"""
+
+    test_cases = [
+        ("R$ 2.572.371,44", 2572371.44),
+        ("R$1.234,56", 1234.56),
+        ("980,00", 980.0),
+        ("R$ 0,50", 0.5),
+
         # Casos especiais
-        ("12", None, "12"),  # Número muito pequeno (< 3 dígitos)
-        ("Ana", None, "Ana"),  # Só nome
-        ("", None, None),  # Vazio
-        (None, None, None),  # None
-        ("MARIA JOSÉ DA SILVA", None, "MARIA JOSÉ DA SILVA"),  # Só nome completo
+        ("isento", None),  # Texto não numérico
+        ("", None),  # Vazio
+        (None, None),  # None
     ]
-    
-    print("=== Teste da função process_patient_data ===\n")
-    
-    for i, (input_text, expected_id, expected_name) in enumerate(test_cases, 1):
-        result_id, result_name = process_patient_data(input_text)
-        
-        success = (result_id == expected_id and result_name == expected_name)
-        status = "✅ PASSOU" if success else "❌ FALHOU"
-        
-        print(f"Teste {i}: {status}")
-        print(f"  Input: '{input_text}'")
-        print(f"  Esperado: ID='{expected_id}', Nome='{expected_name}'")
-        print(f"  Resultado: ID='{result_id}', Nome='{result_name}'")
-        print()
+
+    print("=== Teste da função process_valor_devido ===\n")
+
+    failures = 0
+    for i, (input_text, expected) in enumerate(test_cases, 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = process_valor_devido(input_text)
+        success = same_value(result, expected)
+        failures += not success
+        report(i, success, input_text, expected, result)
+
+    assert failures == 0, f"{failures} teste(s) falharam"
+
+def test_table_cleaning():
+    """Testa a limpeza de uma tabela completa (linhas de table.extract())"""
+
+    rows = [
+        ("100001", "MARIA DA\nSILVA", "(64) 99999-0000", "12/2023", "R$ 1.500,00"),
+        ("100002", "JOÃO SOUZA", None, "13/2023", ""),
+        ("CCP", "CONTRIBUINTE", "CELULAR", "PROCESSO(S)", "VALOR DEVIDO"),  # Cabeçalho repetido
+        ("QUANTIDADE: 2 TOTAL:", "", "", "", "R$ 1.500,00"),  # Totalizador
+        ("---", "---", None, None, None),  # Linha com traços
+    ]
+    expected = [
+        {'CCP': '100001', 'CONTRIBUINTE': 'MARIA DA SILVA', 'CELULAR': '(64) 99999-0000',
+         'PROCESSO(S)': '12/2023', 'VALOR DEVIDO': 1500.0, 'status': 'ativo'},
+        {'CCP': '100002', 'CONTRIBUINTE': 'JOÃO SOUZA', 'CELULAR': None,
+         'PROCESSO(S)': '13/2023', 'VALOR DEVIDO': float('nan'), 'status': 'ativo'},
+    ]
+
+    print("=== Teste da função clean_devedores_rows ===\n")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = clean_devedores_rows(rows)
+
+    success = len(result) == len(expected) and all(
+        row.keys() == exp.keys() and all(same_value(row[key], exp[key]) for key in exp)
+        for row, exp in zip(result, expected)
+    )
+    report(1, success, rows, expected, result)
+
+    assert success, "Resultado da limpeza diferente do esperado"
+
+def make_devedores_pdf(pages, ccps=None, rows_per_page=5, header=True, names=None):
+    """
+    PDF em memória com uma tabela de devedores (cabeçalho + rows_per_page linhas) por página.
+    ccps, se informado, é a lista de CCPs usada nas linhas (em ordem). Com header=False
+    as páginas não repetem o cabeçalho (continuação da tabela). names, se informado, é
+    repetido em ciclo na coluna CONTRIBUINTE ('\n' quebra o nome em duas linhas da célula).
+    """
+    doc = fitz.open()
+    count = 0
+    for _ in range(pages):
+        page = doc.new_page(width=612, height=842)
+        rows = [extractor.DEVEDOR_COLUMNS] if header else []
+        for _ in range(rows_per_page):
+            ccp = ccps[count] if ccps else str(100001 + count)
+            nome = names[count % len(names)] if names else f'DEVEDOR {count}'
+            rows.append([ccp, nome, '(64) 99999-0000', f'{count}/2023', 'R$ 1.500,00'])
+            count += 1
+
+        top, row_height = 60, 22
+        for r, cells in enumerate(rows):
+            for col, text in enumerate(cells):
+                for line_num, line in enumerate(text.split('\n')):
+                    page.insert_text((COLUMN_EDGES[col] + 2, top + r * row_height + 9 + line_num * 8), line, fontsize=7)
+        for r in range(len(rows) + 1):
+            page.draw_line((COLUMN_EDGES[0], top + r * row_height), (COLUMN_EDGES[-1], top + r * row_height))
+        for x in COLUMN_EDGES:
+            page.draw_line((x, top), (x, top + len(rows) * row_height))
+
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+# Nomes de uma e de duas linhas na célula CONTRIBUINTE
+WRAPPED_NAMES = ['MARIA DA SILVA', 'JOSE\nROBERTO', 'FRANCISCA DOS\nSANTOS']
+
+@contextlib.contextmanager
+def isolated_layout_templates():
+    """Templates de layout em um arquivo temporário, sem tocar no arquivo do serviço"""
+    previous_file = layout_templates.LAYOUT_TEMPLATES_FILE
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        layout_templates.LAYOUT_TEMPLATES_FILE = os.path.join(tmp_dir, 'layout_templates.json')
+        layout_templates._templates = None
+        try:
+            yield
+        finally:
+            layout_templates.LAYOUT_TEMPLATES_FILE = previous_file
+            layout_templates._templates = None
+            layout_templates._pending_hits.clear()
+
+class BrokenPool:
+    """Pool de processos cujo worker morreu: toda tarefa falha com BrokenProcessPool"""
+
+    def submit(self, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenProcessPool('worker encerrado'))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+def test_broken_process_pool_falls_back_to_sequential():
+    """Com o pool quebrado, o documento é extraído sequencialmente e o pool é descartado"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        with PdfDocument(make_devedores_pdf(4)) as pdf:
+            expected = extractor.extract_devedores_from_document(pdf, parallel=False)
+
+            extractor._process_pool = BrokenPool()
+            stats = {}
+            result = extractor.extract_devedores_from_document(pdf, parallel=True, stats=stats)
+
+    assert len(expected) == 20
+    assert result == expected
+    assert stats.get('paginas_ignoradas', 0) == 0
+    assert extractor._process_pool is None
+
+def test_pool_extraction_matches_sequential():
+    """No pool de processos (uma faixa ou várias), o resultado e as páginas ignoradas são os da extração local"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for pages in (1, 6):
+            with PdfDocument(make_devedores_pdf(pages)) as pdf:
+                expected_stats = {}
+                expected = extractor.extract_devedores_from_document(pdf, parallel=False, stats=expected_stats)
+
+                stats = {}
+                timings = {}
+                result = extractor.extract_devedores_from_document(pdf, parallel=True, stats=stats, timings=timings)
+
+            assert len(result) == pages * 5
+            assert result == expected
+            assert stats.get('paginas_ignoradas', 0) == expected_stats.get('paginas_ignoradas', 0)
+            assert 'template_layout' in timings
+
+def test_concurrent_extractions_match_sequential():
+    """Extrações simultâneas em threads do mesmo processo (find_tables em toda página) não se misturam"""
+    layout_templates.LAYOUT_TEMPLATES = False
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with PdfDocument(make_devedores_pdf(6, rows_per_page=20)) as pdf:
+                expected = extractor.extract_devedores_from_document(pdf, parallel=False, engine='tables')
+
+            def extract():
+                with PdfDocument(make_devedores_pdf(6, rows_per_page=20)) as pdf:
+                    return extractor.extract_devedores_from_document(pdf, parallel=False, engine='tables')
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = [future.result() for future in [executor.submit(extract) for _ in range(4)]]
+    finally:
+        layout_templates.LAYOUT_TEMPLATES = True
+
+    assert len(expected) == 120
+    assert all(result == expected for result in results)
+
+def test_template_extraction_matches_find_tables():
+    """A leitura pela geometria do template encontra as mesmas linhas que o find_tables(), com nomes quebrados"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        with isolated_layout_templates():
+            with PdfDocument(make_devedores_pdf(3, names=WRAPPED_NAMES)) as pdf:
+                template, learned = layout_templates.find_layout_template(pdf.doc, len(extractor.DEVEDOR_COLUMNS))
+                assert learned
+                assert [t['key'] for t in layout_templates.list_templates()] == [template['key']]
+
+                for page_num in range(pdf.page_count):
+                    page = pdf.doc[page_num]
+                    expected = extractor.extract_devedores_from_page(page, page_num, engine='tables')
+                    timings = {}
+                    result = extractor.extract_devedores_from_page(page, page_num, timings=timings, template=template)
+
+                    assert len(expected) == 5
+                    assert result == expected
+                    # A página foi lida pelo template, sem cair no find_tables()
+                    assert 'tabela_template' in timings and 'find_tables' not in timings
+
+            # Outro PDF do mesmo layout reaproveita o template registrado
+            with PdfDocument(make_devedores_pdf(1, names=WRAPPED_NAMES)) as pdf:
+                known, learned = layout_templates.find_layout_template(pdf.doc, len(extractor.DEVEDOR_COLUMNS))
+
+    assert not learned
+    assert known['key'] == template['key']
+    assert {row['CONTRIBUINTE'] for row in expected} == {'MARIA DA SILVA', 'JOSE ROBERTO', 'FRANCISCA DOS SANTOS'}
+
+def test_words_engine_matches_tables():
+    """O motor de palavras, pelo cabeçalho da página ou pelo template, lê as mesmas linhas que o find_tables()"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        with isolated_layout_templates():
+            with PdfDocument(make_devedores_pdf(3, names=WRAPPED_NAMES)) as pdf:
+                layout_templates.LAYOUT_TEMPLATES = False
+                try:
+                    expected = extractor.extract_devedores_from_document(pdf, parallel=False, engine='tables')
+                    # A conferência na amostra de páginas aceita o motor de palavras
+                    assert extractor.choose_extraction_engine(pdf.doc, 'words', None) == 'words'
+                    result = extractor.extract_devedores_from_document(pdf, parallel=False, engine='words')
+                finally:
+                    layout_templates.LAYOUT_TEMPLATES = True
+
+                template, _ = layout_templates.find_layout_template(pdf.doc, len(extractor.DEVEDOR_COLUMNS))
+                for page_num in range(pdf.page_count):
+                    page = pdf.doc[page_num]
+                    from_header = clean_devedores_rows(extractor.extract_rows_from_words(page))
+                    from_template = clean_devedores_rows(extractor.extract_rows_from_words(page, template))
+
+                    assert from_header == from_template == expected[page_num * 5:(page_num + 1) * 5]
+
+    assert len(expected) == 15
+    assert result == expected
+    assert {row['CONTRIBUINTE'] for row in result} == {'MARIA DA SILVA', 'JOSE ROBERTO', 'FRANCISCA DOS SANTOS'}
+
+def test_prescreen_accepts_formatted_ccps():
+    """Páginas sem cabeçalho, com CCPs com ou sem pontos e dígito verificador, passam na pré-triagem"""
+    ccps = ['123.456-7', '100001', '98.765-4', '2.345.678', '54321-0']
+    with contextlib.redirect_stdout(io.StringIO()):
+        with PdfDocument(make_devedores_pdf(1, ccps=ccps, header=False)) as pdf:
+            assert extractor.is_candidate_page(pdf.doc[0])
+
+            stats = {}
+            with_prescreen = extractor.extract_devedores_from_document(pdf, parallel=False, stats=stats)
+
+            extractor.PAGE_PRESCREEN = False
+            try:
+                without_prescreen = extractor.extract_devedores_from_document(pdf, parallel=False)
+            finally:
+                extractor.PAGE_PRESCREEN = True
+
+    assert stats.get('paginas_ignoradas', 0) == 0
+    assert with_prescreen == without_prescreen
+    # Sem cabeçalho na página, o find_tables() lê a primeira linha como cabeçalho da tabela
+    assert [row['CCP'] for row in with_prescreen] == ccps[1:]
+
+def test_prescreen_rejects_page_numbers_and_dates():
+    """Número de página, ano e data sozinhos na linha não fazem uma página passar na pré-triagem"""
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=842)
+    page.insert_text((72, 72), 'TERMO DE ENCERRAMENTO\n12/2023\n2024')
+    page.insert_text((300, 800), '3')
+
+    assert not extractor.is_candidate_page(page)
+
+def test_prescreen_skips_pages_without_ccp():
+    """Uma capa (sem cabeçalho nem CCP) é ignorada e contada em paginas_ignoradas"""
+    doc = fitz.open()
+    doc.new_page(width=612, height=842).insert_text((72, 72), 'PREFEITURA MUNICIPAL\nLISTA DE DEVEDORES')
+    doc.insert_pdf(fitz.open(stream=make_devedores_pdf(1), filetype='pdf'))
+    data = doc.tobytes()
+    doc.close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with PdfDocument(data) as pdf:
+            stats = {}
+            result = extractor.extract_devedores_from_document(pdf, parallel=False, stats=stats)
+
+    assert stats['paginas_ignoradas'] == 1
+    assert len(result) == 5
 
 if __name__ == "__main__":
-    test_patient_data_processing()
+    test_contribuinte_processing()
+    test_valor_devido_processing()
+    test_table_cleaning()
+    test_broken_process_pool_falls_back_to_sequential()
+    test_pool_extraction_matches_sequential()
+    test_concurrent_extractions_match_sequential()
+    test_prescreen_accepts_formatted_ccps()
+    test_prescreen_rejects_page_numbers_and_dates()
+    test_prescreen_skips_pages_without_ccp()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testes dos jobs de extração assíncrona (resultado gravado em extraction_jobs).
+Os testes que usam o banco são ignorados se o PostgreSQL (DATABASE_URL) não estiver acessível.
+"""
+
+import io
+import sys
+import os
+import json
+import time
+import subprocess
+import uuid
+import threading
+import contextlib
+
+import pytest
+
+# Adicionar o diretório app ao path para importar o módulo
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+import database
+import jobs
+from database import jsonb_dumps
+
+# Resultado de um job com um registro sem valor devido (NaN) nos detalhes dos warnings
+NAN_RESULT = {
+    'status': 'success',
+    'registros_inseridos': 1,
+    'warnings': [{
+        'type': 'duplicates',
+        'count': 1,
+        'details': [{'ccp': '100001', 'nome': 'MARIA DA SILVA', 'valor_devido': float('nan')}]
+    }],
+    'timings': {'extracao': float('inf')}
+}
+
+def require_database():
+    """Ignora o teste se o banco não estiver acessível"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        conn = database.get_db_connection()
+    if conn is None:
+        pytest.skip("PostgreSQL indisponível")
+    conn.close()
+
+def delete_source(source_id):
+    """Remove o source de teste (os jobs são removidos em cascata)"""
+    with database.db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM sources WHERE id = %s;", (source_id,))
+        conn.commit()
+
+def test_nan_result_is_valid_json():
+    """NaN/Infinity no resultado viram null, e o texto gerado é JSON válido"""
+    result = json.loads(jsonb_dumps(NAN_RESULT))
+
+    assert result['warnings'][0]['details'][0]['valor_devido'] is None
+    assert result['warnings'][0]['details'][0]['ccp'] == '100001'
+    assert result['timings']['extracao'] is None
+
+def test_import_does_not_load_pymupdf():
+    """Importar o jobs (post_worker_init do Gunicorn) não carrega o extractor nem o PyMuPDF"""
+    code = "import sys, jobs; print(sorted(m for m in ('fitz', 'extractor', 'pandas') if m in sys.modules))"
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(__file__), 'app'),
+        capture_output=True, text=True, check=True
+    ).stdout
+
+    assert output.strip() == '[]'
+
+def test_finish_job_with_nan_result():
+    """Um job com NaN no resultado é finalizado (o JSONB rejeitaria o literal NaN)"""
+    require_database()
+
+    job_id = str(uuid.uuid4())
+    with contextlib.redirect_stdout(io.StringIO()):
+        source_id = database.create_source('teste_nan.pdf')
+        assert database.create_extraction_job(job_id, source_id, 'teste_nan.pdf', 1)
+        try:
+            assert database.finish_extraction_job(job_id, 'concluido', resultado=NAN_RESULT)
+            job = database.get_extraction_job(job_id)
+        finally:
+            delete_source(source_id)
+
+    assert job['status'] == 'concluido'
+    assert job['resultado']['warnings'][0]['details'][0]['valor_devido'] is None
+
+def wait_for(condition, timeout=10):
+    """Espera condition() ser verdadeira (até timeout segundos)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_job_is_reclaimed_after_stop(monkeypatch):
+    """
+    Um job em andamento quando os workers da fila param (reciclagem do Gunicorn) volta para
+    a fila sem gastar tentativa e é reivindicado de novo; o resultado do worker antigo é descartado.
+    """
+    require_database()
+
+    release = threading.Event()
+    processing = []
+
+    def blocking_process(job, worker_id):
+        processing.append(job['id'])
+        release.wait(10)
+        # O worker antigo termina depois de perder o job: o resultado não pode ser gravado
+        processing.append(database.finish_extraction_job(job['id'], 'concluido', resultado={}, worker_id=worker_id))
+
+    monkeypatch.setattr(jobs, 'EXTRACTION_WORKERS', 1)
+    monkeypatch.setattr(jobs, 'process_claimed_job', blocking_process)
+
+    job_id = str(uuid.uuid4())
+    with contextlib.redirect_stdout(io.StringIO()):
+        source_id = database.create_source('teste_fila.pdf')
+        try:
+            assert database.create_extraction_job(job_id, source_id, 'teste_fila.pdf', 1, pdf_data=b'%PDF')
+            # Primeiro da fila, à frente de jobs pendentes de outros testes
+            with database.db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE extraction_jobs SET disponivel_em = disponivel_em - interval '1 day' WHERE id = %s;",
+                        (job_id,)
+                    )
+                conn.commit()
+
+            jobs.start_queue_workers()
+            assert wait_for(lambda: processing == [job_id])
+
+            jobs.stop_queue_workers(timeout=0.1)
+            released = database.get_extraction_job(job_id)
+            reclaimed = database.claim_extraction_job('outra_instancia', 60, jobs.JOB_MAX_ATTEMPTS)
+
+            release.set()
+            assert wait_for(lambda: len(processing) == 2)
+        finally:
+            release.set()
+            jobs.stop_queue_workers(timeout=5)
+            delete_source(source_id)
+
+    assert released['status'] == 'pendente'
+    assert released['tentativas'] == 0
+    assert released['worker_id'] is None
+    assert reclaimed['id'] == job_id
+    assert reclaimed['tentativas'] == 1
+    assert processing[1] is False
+
+if __name__ == "__main__":
+    test_nan_result_is_valid_json()
+    test_finish_job_with_nan_result()